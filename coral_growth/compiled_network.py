@@ -0,0 +1,119 @@
+""" Compile a MultiNEAT phenotype into an array-backed feed-forward program so
+    that the network can be evaluated for every node of a form in one batched
+    numpy pass instead of one Flush/Input/ActivateFast/Output round trip per
+    node.
+"""
+from __future__ import division, print_function
+import numpy as np
+
+class CompiledNetwork(object):
+    """ Batched equivalent of repeatedly calling on a MultiNEAT network:
+
+            network.Flush()
+            network.Input(inputs)
+            for _ in range(depth):
+                network.ActivateFast()
+            network.Output()
+
+        ActivateFast updates every non-input neuron synchronously with an
+        unsigned sigmoid, 1 / (1 + exp(-a*x - b)), ignoring the activation
+        function type and bias. If the network is acyclic and 'depth' covers
+        its longest path then every neuron has settled after 'depth'
+        activations, so it can be evaluated once per layer in topological
+        order. Otherwise the synchronous update is replayed 'depth' times.
+    """
+    def __init__(self, network, depth):
+        self.depth = depth
+        self.n_inputs = network.NumInputs()
+        self.n_outputs = network.NumOutputs()
+        self.n_neurons = len(network.neurons)
+
+        self.slope = np.array([n.a for n in network.neurons], dtype='float64')
+        self.shift = np.array([n.b for n in network.neurons], dtype='float64')
+
+        # Connections into input neurons never affect the output.
+        self.weights = np.zeros((self.n_neurons, self.n_neurons))
+        sources = [ [] for _ in range(self.n_neurons) ]
+        for c in network.connections:
+            if c.target_neuron_idx < self.n_inputs:
+                continue
+            self.weights[c.source_neuron_idx, c.target_neuron_idx] += c.weight
+            sources[c.target_neuron_idx].append(c.source_neuron_idx)
+
+        self.layers = self._build_layers(sources)
+        self.activations = np.zeros((0, self.n_neurons))
+
+    def _build_layers(self, sources):
+        """ Return a list of (neuron_indices, weights, slope, shift) for each
+            layer or None if the network must be evaluated synchronously.
+        """
+        n_inputs = self.n_inputs
+        layer = np.zeros(self.n_neurons, dtype='int32')
+        state = np.zeros(self.n_neurons, dtype='uint8') # 0 new, 1 open, 2 done.
+
+        # Iterative DFS for the longest path from the inputs to each neuron.
+        for root in range(n_inputs, self.n_neurons):
+            if state[root]:
+                continue
+            stack = [ (root, 0) ]
+            state[root] = 1
+            while stack:
+                i, si = stack[-1]
+                if si < len(sources[i]):
+                    stack[-1] = (i, si+1)
+                    j = sources[i][si]
+                    if j < n_inputs:
+                        continue
+                    if state[j] == 1:
+                        return None # Recurrent connection.
+                    if state[j] == 0:
+                        state[j] = 1
+                        stack.append((j, 0))
+                else:
+                    stack.pop()
+                    state[i] = 2
+                    layer[i] = 1 + max([layer[j] for j in sources[i]], default=0)
+
+        n_layers = int(layer.max()) if self.n_neurons > n_inputs else 0
+        if n_layers > self.depth:
+            return None
+
+        layers = []
+        for li in range(1, n_layers+1):
+            idx = np.nonzero(layer == li)[0]
+            layers.append((idx, self.weights[:, idx].copy(),
+                           self.slope[idx], self.shift[idx]))
+        return layers
+
+    def NumInputs(self):
+        return self.n_inputs
+
+    def NumOutputs(self):
+        return self.n_outputs
+
+    def activate(self, inputs):
+        """ Evaluate the network on each row of 'inputs' and return an
+            (n, n_outputs) array.
+        """
+        n = inputs.shape[0]
+        if self.activations.shape[0] < n:
+            self.activations = np.zeros((n, self.n_neurons))
+
+        act = self.activations[:n]
+        act[:, :] = 0
+        act[:, :self.n_inputs] = inputs
+
+        with np.errstate(over='ignore'):
+            if self.layers is not None:
+                for idx, weights, slope, shift in self.layers:
+                    x = np.dot(act, weights)
+                    act[:, idx] = 1.0 / (1.0 + np.exp(-slope * x - shift))
+            else:
+                slope = self.slope[self.n_inputs:]
+                shift = self.shift[self.n_inputs:]
+                weights = self.weights[:, self.n_inputs:]
+                for _ in range(self.depth):
+                    x = np.dot(act, weights)
+                    act[:, self.n_inputs:] = 1.0 / (1.0 + np.exp(-slope * x - shift))
+
+        return act[:, self.n_inputs:self.n_inputs+self.n_outputs]
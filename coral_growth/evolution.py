@@ -5,6 +5,7 @@ import os, time, math, json
 from os.path import join as pjoin
 import MultiNEAT as NEAT
 import numpy as np
+from cymesh.mesh import Mesh
 from cymesh.shape_features import d2_features, a3_features
 from coral_growth.simulate import simulate_genome
 
@@ -51,8 +52,12 @@ def shape_descriptor(form, n=1024*1024):
     if form is None:
         return np.zeros(64)
     else:
-        d2 = d2_features(form.mesh, n_points=n, n_bins=32, hrange=(0.0, 3.0))
-        a3 = a3_features(form.mesh, n_points=n, n_bins=32, hrange=(0.0, 3.0))#vmin=0.0, vmax=math.pi)
+        mesh = form.mesh
+        if form.array_mesh: # The shape features sample cymesh faces.
+            mesh = Mesh(np.asarray(form.node_pos[:form.n_nodes]).tolist(),
+                        np.asarray(form.face_verts[:form.n_faces]).tolist())
+        d2 = d2_features(mesh, n_points=n, n_bins=32, hrange=(0.0, 3.0))
+        a3 = a3_features(mesh, n_points=n, n_bins=32, hrange=(0.0, 3.0))#vmin=0.0, vmax=math.pi)
         return np.hstack((d2, a3))
 
 def evaluate_novelty(Form, genome, traits, params):
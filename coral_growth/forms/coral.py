@@ -5,13 +5,26 @@ from coral_growth.modules.flowx import *
 from coral_growth.modules.flowx2 import *
 
 from coral_growth.modules import light
+from coral_growth.modules.tri_hash_2d import TriHash2D
+from coral_growth.modules.voxel_grid import VoxelGrid
+from coral_growth.modules.lattice_boltzmann import LatticeBoltzmann
+from coral_growth.modules.sparse_voxels import create_sparse_voxel_grid, \
+                                              calculate_collection_sparse
 from coral_growth.growth_form import GrowthForm
 
 class Coral(GrowthForm):
     def __init__(self, obj_path, network, net_depth, traits, params):
+        assert not (params.sparse_voxels and (params.incremental_voxels or \
+                                              params.collection_convolve)), \
+            'sparse_voxels can not be combined with incremental_voxels or collection_convolve.'
         # Corals calculate light and flow on every node to get growth energy.
         self.node_light = np.zeros(params.max_nodes)
         self.node_collection = np.zeros(params.max_nodes)
+        self.tri_hash = TriHash2D() # Faces bucketed in the xz plane for light.
+        self.height_map = light.HeightMap() # Used instead when params.light_method is 1 or 2.
+        self.flood_workspace = FloodFillWorkspace() # Reused by every collection flood fill.
+        self.voxel_grid = VoxelGrid() # Used when params.incremental_voxels is set.
+        self.flow = LatticeBoltzmann(params.flow_velocity, params.flow_tau)
         attributes = ['light', 'collection']
         super().__init__(attributes, obj_path, network, net_depth, traits, params)
 
@@ -22,7 +35,13 @@ class Coral(GrowthForm):
         return n_inputs, n_outputs
 
     def calculateEnergy(self):
-        light.calculate_light(self) # Update the light
+        # Update the light
+        if self.params.light_method == 1:
+            light.calculate_light_raster(self)
+        elif self.params.light_method == 2:
+            light.calculate_light_sky(self)
+        else:
+            light.calculate_light(self)
         np.nan_to_num(self.node_light, copy=False)
         self.calculateCollection(radius=self.params.collection_radius)
 
@@ -50,12 +69,52 @@ class Coral(GrowthForm):
             self.energy += energy
 
     def calculateCollection(self, radius):
-        node_voxels, voxel_grid, min_v = create_voxel_grid(self)
-        voxel_grid = np.array(voxel_grid).astype('uint8')
-        calculate_collection(self.node_collection, node_voxels, voxel_grid, radius)
+        if self.params.use_flow:
+            self.calculateFlowCollection()
+            return
+
+        if self.params.sparse_voxels:
+            node_voxels, voxel_grid, min_v = create_sparse_voxel_grid(
+                self.node_pos, self.n_nodes, self.face_verts, self.n_faces, self.voxel_length)
+            calculate_collection_sparse(self.node_collection, node_voxels, voxel_grid, radius)
+        else:
+            if self.params.incremental_voxels:
+                self.voxel_grid.update(self.node_pos, self.n_nodes, self.face_verts,
+                                       self.n_faces, self.voxel_length)
+                node_voxels, voxel_grid, min_v = self.voxel_grid.dense()
+            else:
+                node_voxels, voxel_grid, min_v = create_voxel_grid(self)
+                voxel_grid = np.array(voxel_grid).astype('uint8')
+
+            calculate_collection(self.node_collection, node_voxels, voxel_grid, radius,
+                                 self.flood_workspace, self.params.collection_convolve)
 
         for i in range(self.n_nodes):
             self.node_collection[i] *= 100
 
+    def calculateFlowCollection(self):
+        node_voxels, voxel_grid, min_v = create_voxel_grid(self)
+        self.flow.set_grid(voxel_grid, min_v)
+        if self.flow.n_sweeps == 0:
+            self.flow.run(self.params.flow_warmup_steps)
+        else:
+            self.flow.run(self.params.flow_steps)
+        self.flow.collection(self.node_collection, node_voxels, min_v)
+
+        for i in range(self.n_nodes):
+            self.node_collection[i] *= self.params.flow_collection_scale
+
+    def extraState(self):
+        # The flow field takes many sweeps to reach, so it is saved too.
+        state = super().extraState()
+        for key, value in self.flow.get_state().items():
+            state['flow_' + key] = value
+        return state
+
+    def loadExtraState(self, state):
+        super().loadExtraState(state)
+        self.flow.set_state({ key[5:]: state[key] for key in state.files
+                              if key.startswith('flow_') })
+
     def fitness(self):
         return self.energy
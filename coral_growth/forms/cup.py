@@ -1,7 +1,8 @@
 from math import sqrt
 import numpy as np
 from coral_growth.growth_form import GrowthForm
-from coral_growth.modules.water_hold import water_hold
+from coral_growth.modules.flowx import create_voxel_grid
+from coral_growth.modules.water_hold import water_hold, water_voxels, fill_faces
 from itertools import count
 # import heapq
 # import tripy
@@ -101,6 +102,7 @@ from itertools import count
 class Cup(GrowthForm):
     def __init__(self, obj_path, network, net_depth, traits, params):
         attributes = ['holding_water']
+        self.water = 0 # Volume held, when params.voxel_water is set.
         super().__init__(attributes, obj_path, network, net_depth, traits, params)
 
     @classmethod
@@ -142,8 +144,19 @@ class Cup(GrowthForm):
     #     super()
     #     self.calculateWaterHold()
 
+    def calculateEnergy(self):
+        if self.params.voxel_water:
+            node_voxels, voxel_grid, min_v = create_voxel_grid(self)
+            # Close the gaps between node and face midpoint voxels.
+            fill_faces(voxel_grid, self.node_pos, self.face_verts, self.n_faces, min_v,
+                       self.voxel_length)
+            n_water = water_voxels(voxel_grid, node_voxels, self.node_attributes[:, 0])
+            self.water = n_water * self.voxel_length**3
+
     def fitness(self):
-        return water_hold(self.mesh, self.max_edge_len)
+        if self.params.voxel_water:
+            return self.water
+        return water_hold(self.node_pos[:self.n_nodes], self.max_edge_len)
         # bbox = self.mesh.boundingBox()
         # volume = (bbox[1]-bbox[0]) * (bbox[3]-bbox[2]) * (bbox[5]-bbox[4])
         # return volume
@@ -8,4 +8,4 @@ class SurfaceArea(GrowthForm):
 
     def fitness(self):
         # The surface area.
-        return sum(f.area() for f in self.mesh.faces)
+        return sum(self.faceArea(f) for f in range(self.n_faces))
@@ -1,26 +1,62 @@
 from cymesh.mesh cimport Mesh
-from cymesh.structures cimport Vert
+from cymesh.structures cimport Vert, Face
+
+ctypedef unsigned char uint8
 
 cdef class GrowthForm:
-    cdef public Mesh mesh
+    cdef public object mesh
+    cdef public bint array_mesh
     cdef public object network, params, morphogens, traits, collisionManager
     cdef public list attributes
     cdef public int n_nodes, n_signals, n_inputs, n_outputs, max_nodes, age, \
-                    n_morphogens, morphogen_thresholds, n_attributes
-    cdef public double energy, volume, max_face_area, C, max_growth
-    cdef public double[:] node_gravity, signal_decay, node_energy, buffer
+                    n_morphogens, morphogen_thresholds, n_attributes, n_neighbor_nodes, \
+                    n_faces, n_region
+    cdef public double energy, volume, max_face_area, C, max_growth, local_error
+    cdef public double[:] node_gravity, node_curvature, signal_decay, node_energy, buffer
     cdef public int[:, ::1] node_memory
-    cdef public double[:,::1] node_inputs, node_pos, node_pos_next, node_normal, node_signals, buffer3
+    cdef public int[:] neighbor_offsets, neighbor_indices, neighbor_buffer, diffuse_steps
+    cdef public double[:] neighbor_weights
+    cdef public double[:, ::1] diffuse_state, diffuse_buffer
+    cdef public uint8[:] neighbor_dirty, node_dirty, node_in_region
+    cdef public int[:] region
+    cdef public double[:] node_defect
+    cdef public double[:, ::1] node_pos_prev
+    cdef public int[:, ::1] face_verts
+    cdef public int[:] node_corner, corner_next, corner_prev
+    cdef public double[:, ::1] node_pos_checked
+    cdef public uint8[:] face_mark
+    cdef public list face_pending
+    cdef public double[:,::1] node_inputs, node_outputs, node_pos, node_pos_next, node_normal, node_signals, buffer3
 
     cpdef void step(self) except *
+    cpdef dict seedTemplate(self)
     cpdef void grow(self) except *
     cpdef void calculateAttributes(self) except *
     cpdef void calculateEnergy(self) except *
     cpdef void calculateGravity(self) except *
     cpdef void createNode(self, Vert vert) except *
+    cpdef void addNode(self, list neighbors) except *
+    cpdef list nodeNeighbors(self, int i)
+    cpdef double faceArea(self, int f) except -1
+    cpdef list splitFace(self, int f)
     cpdef void subdivision(self) except *
+    cpdef void rebuildFaces(self) except *
+    cdef void insertCorner(self, int c) noexcept nogil
+    cdef void removeCorner(self, int c) noexcept nogil
+    cpdef void updateFace(self, int f) except *
+    cdef bint isLarge(self, int f) noexcept nogil
+    cpdef list largeFaces(self)
+    cpdef void rebuildNeighbors(self) except *
+    cpdef void updateNeighbors(self) except *
     cpdef void diffuse(self) except *
     cpdef void createNodeInputs(self) except *
     cpdef void smoothSharp(self, n=*) except *
+    cpdef void markRegion(self) except *
+    cpdef void calculateRegionDefect(self) except *
+    cpdef void calculateRegion(self) except *
+    cpdef void checkRegion(self) except *
+    cpdef void relaxRegion(self, double amount=*) except *
     # cpdef void decaySignals(self) except *
+    cpdef void saveState(self, str path) except *
+    cpdef void loadState(self, str path) except *
     cpdef void export(self, str path) except *
\ No newline at end of file
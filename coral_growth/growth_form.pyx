@@ -6,26 +6,55 @@
 # cython: profile=True
 
 from __future__ import division, print_function
-from libc.math cimport floor, atan, acos, cos, sin, M_PI
+import heapq
 import numpy as np
 cimport numpy as np
+cimport cython
+from cython.parallel cimport prange
 
 from coral_growth.modules.morphogens import Morphogens
 from coral_growth.modules.collisions import MeshCollisionManager
+from coral_growth.modules.node_inputs cimport create_node_inputs, calculate_gravity
+from coral_growth.modules cimport mesh_local
+from coral_growth.modules.array_mesh cimport ArrayMesh
+from coral_growth.modules.threads cimport set_threads, get_threads
+from coral_growth.compiled_network import CompiledNetwork
 
-from cymesh.vector3D cimport inormalized, vadd, vsub, vmultf, vset, dot, vangle
+from cymesh.vector3D cimport inormalized, vadd, vsub, vmultf, vset, dot
 from cymesh.mesh cimport Mesh
 from cymesh.structures cimport Vert, Face
 
 from cymesh.subdivision.sqrt3 import split
 from cymesh.operators.relax import relax_mesh
 
+# Seed meshes prepared once per process, keyed by seed path and the
+# parameters they depend on. See seedTemplate.
+seed_cache = {}
+
 cdef class GrowthForm:
     def __init__(self, attributes, obj_path, network, net_depth, traits, params):
         assert type(attributes) == list
         self.params = params
         self.network = network
-        self.mesh = Mesh.from_obj(obj_path)
+        self.array_mesh = params.array_mesh
+        assert params.local_updates or not self.array_mesh, 'array_mesh needs local_updates.'
+
+        seed_key = (obj_path, params.max_face_growth, params.array_mesh)
+        template = seed_cache.get(seed_key) if params.seed_cache else None
+        if self.array_mesh:
+            # The mesh positions become node_pos below.
+            if template is None:
+                self.mesh = ArrayMesh.from_obj(obj_path, max_verts=params.max_nodes)
+            else:
+                self.mesh = ArrayMesh(template['vertices'], template['faces'],
+                                      max_verts=params.max_nodes)
+            n_seed_faces = self.mesh.n_faces
+        else:
+            if template is None:
+                self.mesh = Mesh.from_obj(obj_path)
+            else:
+                self.mesh = Mesh(template['vertices'], template['faces'])
+            n_seed_faces = len(self.mesh.faces)
         self.attributes = attributes
         self.n_attributes = len(attributes)
         self.n_morphogens = params.n_morphogens
@@ -36,6 +65,7 @@ cdef class GrowthForm:
         self.max_nodes = params.max_nodes
         self.max_growth = params.max_growth
         self.morphogens = Morphogens(self, traits, params.n_morphogens)
+        set_threads(params.n_threads)
 
         # Some parameters are evolved traits.
         self.traits = traits
@@ -43,10 +73,19 @@ cdef class GrowthForm:
         #                                for i in range(params.n_signals) ])
 
         # Constants for simulation dependent on start mesh.
-        self.target_edge_len = np.mean([e.length() for e in self.mesh.edges])
+        if template is not None:
+            self.target_edge_len = template['target_edge_len']
+            self.max_face_area = template['max_face_area']
+        elif self.array_mesh:
+            self.target_edge_len = np.mean(self.mesh.edge_lengths())
+            self.max_face_area = np.mean([self.mesh.face_area(f) for f in range(n_seed_faces)]) * \
+                                 params.max_face_growth
+        else:
+            self.target_edge_len = np.mean([e.length() for e in self.mesh.edges])
+            self.max_face_area = np.mean([f.area() for f in self.mesh.faces]) * \
+                                 params.max_face_growth
         self.node_size = self.target_edge_len * 0.5
         self.max_edge_len = self.target_edge_len * 1.3
-        self.max_face_area = np.mean([f.area() for f in self.mesh.faces]) * params.max_face_growth
         self.voxel_length = self.target_edge_len
 
         # Data
@@ -54,16 +93,25 @@ cdef class GrowthForm:
         self.n_inputs = n_inputs
         self.n_outputs = n_outputs
 
+        # The layout written by create_node_inputs must fill every input.
+        assert n_inputs == 4 + self.n_attributes + \
+                           self.n_morphogens * params.morphogen_thresholds + \
+                           self.n_signals * params.signal_thresholds + \
+                           self.n_memory + 4 * params.use_polar_direction, \
+                           (n_inputs, self.n_attributes)
+
         self.age = 0
         self.n_nodes = 0
         self.volume = 0
-        self.node_inputs = np.zeros((self.max_nodes, self.n_inputs))
+        self.node_inputs = -np.ones((self.max_nodes, self.n_inputs))
+        self.node_outputs = np.zeros((self.max_nodes, self.n_outputs))
         self.node_verts = [None] * self.max_nodes
         self.node_energy = np.ones(self.max_nodes)
-        self.node_pos = np.zeros((self.max_nodes, 3))
+        self.node_pos = self.mesh.pos if self.array_mesh else np.zeros((self.max_nodes, 3))
         self.node_pos_next = np.zeros((self.max_nodes, 3))
         self.node_normal = np.zeros((self.max_nodes, 3))
         self.node_gravity = np.zeros(self.max_nodes)
+        self.node_curvature = np.zeros(self.max_nodes)
 
         self.node_signals = np.zeros((self.max_nodes, self.params.n_signals))
         self.node_memory = np.zeros((self.max_nodes, self.params.n_signals), dtype='int32')
@@ -71,12 +119,78 @@ cdef class GrowthForm:
         self.buffer3 = np.zeros((self.max_nodes, 3))
         self.node_attributes = np.zeros((self.max_nodes, self.n_attributes))
 
+        # Compressed sparse row index of node neighbors. The neighbors of node
+        # i are neighbor_indices[neighbor_offsets[i]:neighbor_offsets[i+1]].
+        self.neighbor_offsets = np.zeros(self.max_nodes+1, dtype='int32')
+        self.neighbor_indices = np.zeros(8*self.max_nodes, dtype='int32')
+        self.neighbor_buffer = np.zeros(8*self.max_nodes, dtype='int32')
+        self.neighbor_dirty = np.zeros(self.max_nodes, dtype='uint8')
+        self.neighbor_weights = np.zeros(self.max_nodes) # 1 / number of neighbors.
+        self.n_neighbor_nodes = 0
+
+        # Energy and signals are diffused together as columns of one matrix.
+        self.diffuse_steps = np.array([traits['energy_diffuse_steps']] + \
+                                      [traits['signal_diffuse_steps%i'%i] \
+                                       for i in range(self.n_signals)], dtype='int32')
+        self.diffuse_state = np.zeros((self.max_nodes, 1 + self.n_signals))
+        self.diffuse_buffer = np.zeros((self.max_nodes, 1 + self.n_signals))
+
+        # Nodes that moved or changed neighbors since attributes were last
+        # calculated, see markRegion.
+        self.node_pos_prev = np.zeros((self.max_nodes, 3))
+        self.node_dirty = np.zeros(self.max_nodes, dtype='uint8')
+        self.node_in_region = np.zeros(self.max_nodes, dtype='uint8')
+        self.node_defect = np.zeros(self.max_nodes)
+        self.region = np.zeros(self.max_nodes, dtype='int32')
+        self.n_region = 0
+        self.local_error = 0
+
+        # Vertex ids of each face, indexed by face id, to find large faces.
+        self.face_verts = np.zeros((2*self.max_nodes + n_seed_faces, 3), dtype='int32')
+        self.n_faces = 0
+
+        # Corner 3f+j is vertex j of face f. The corners of each node are a
+        # doubly linked list starting at node_corner, so the faces of a node
+        # are found without scanning every face.
+        self.node_corner = np.full(self.max_nodes, -1, dtype='int32')
+        self.corner_next = np.full(3*self.face_verts.shape[0], -1, dtype='int32')
+        self.corner_prev = np.full(3*self.face_verts.shape[0], -1, dtype='int32')
+
+        # Positions when faces were last checked for size and faces to check
+        # again next step, see largeFaces.
+        self.node_pos_checked = np.full((self.max_nodes, 3), np.nan)
+        self.face_mark = np.zeros(self.face_verts.shape[0], dtype='uint8')
+        self.face_pending = []
+
         self.collisionManager = MeshCollisionManager(self.mesh, self.node_pos,\
                                                      self.node_normal, self.node_size)
-        for vert in self.mesh.verts:
-            self.createNode(vert)
+        if self.array_mesh:
+            for i in range(self.mesh.n_verts):
+                self.addNode(self.nodeNeighbors(i))
+        else:
+            for vert in self.mesh.verts:
+                self.createNode(vert)
+
+        self.updateNeighbors()
+        self.rebuildFaces()
+        if template is None and params.seed_cache:
+            seed_cache[seed_key] = self.seedTemplate()
+
         self.calculateAttributes()
 
+    cpdef dict seedTemplate(self):
+        """ What a new form from the same seed needs besides parsing the obj:
+            the mesh as lists in node order and the constants computed from
+            it. The neighbor and face indices are read from the new mesh.
+        """
+        cdef int n = self.n_nodes
+        return {
+            'vertices': np.asarray(self.node_pos[:n]).tolist(),
+            'faces': np.asarray(self.face_verts[:self.n_faces]).tolist(),
+            'target_edge_len': self.target_edge_len,
+            'max_face_area': self.max_face_area,
+        }
+
     @classmethod
     def calculate_inouts(cls, params):
         n_inputs = 4 # energy, gravity, curvature, extra-bias-bit.
@@ -93,48 +207,160 @@ cdef class GrowthForm:
     cpdef void step(self) except *:
         self.createNodeInputs()
         self.grow()
-        for i in range(self.n_nodes):
-            self.collisionManager.attemptVertUpdate(self.mesh.verts[i], self.node_pos_next[i])
+        self.collisionManager.attemptUpdates(self.node_pos_next, self.n_nodes,
+                                             self.neighbor_offsets, self.neighbor_indices)
         self.smoothSharp()
-        relax_mesh(self.mesh)
+        if self.params.local_updates:
+            self.relaxRegion()
+        else:
+            relax_mesh(self.mesh)
         self.subdivision() # Divide mesh and create new nodes.
         self.calculateAttributes()
         self.age += 1
 
     cpdef void calculateAttributes(self) except *:
-        self.mesh.calculateNormals()
-        self.mesh.calculateDefect()
-        self.mesh.calculateCurvature()
+        cdef Vert vert
+        cdef Mesh mesh
+        if self.params.local_updates == 0:
+            mesh = self.mesh
+            mesh.calculateNormals()
+            mesh.calculateDefect()
+            mesh.calculateCurvature()
+            for vert in mesh.verts:
+                self.node_curvature[vert.id] = vert.curvature
+        elif self.params.local_updates == 1:
+            self.calculateRegion()
+        else:
+            self.checkRegion()
         self.calculateEnergy()
-        self.volume = self.mesh.volume()
+        if self.array_mesh:
+            self.volume = (<ArrayMesh>self.mesh).volume()
+        else:
+            self.volume = (<Mesh>self.mesh).volume()
         self.calculateGravity()
         # self.decaySignals()
-        self.morphogens.update(self.params.morphogen_steps)
+        self.morphogens.update(self.params.morphogen_steps, self.params.morphogen_tolerance)
         self.diffuse()
 
     cpdef void smoothSharp(self, n=0.5) except *:
-        cdef Vert vert, vert_neighbor
+        cdef Vert vert
+        cdef Mesh mesh
+        cdef int i, k, j
         cdef double max_defect = self.params.max_defect
-        cdef list neighbors
         cdef double m = 1-n
-        self.mesh.calculateDefect()
+        cdef int[:] offsets = self.neighbor_offsets
+        cdef int[:] indices = self.neighbor_indices
+        cdef double[:] defect = self.node_defect
+        cdef double[:, ::1] pos = self.node_pos
+        if self.params.local_updates:
+            self.markRegion()
+            self.calculateRegionDefect()
+        else:
+            mesh = self.mesh
+            mesh.calculateDefect()
+            for vert in mesh.verts:
+                defect[vert.id] = vert.defect
         self.buffer3[:, :] = 0
 
         # For pointy nodes get the average position of neighbors.
-        for vert in self.mesh.verts:
-            if abs(vert.defect) > max_defect:
-                neighbors = vert.neighbors()
-                for vert_neighbor in neighbors:
-                    vadd(self.buffer3[vert.id], self.buffer3[vert.id], vert_neighbor.p)
+        for i in range(self.n_nodes):
+            if abs(defect[i]) > max_defect:
+                for k in range(offsets[i], offsets[i+1]):
+                    j = indices[k]
+                    vadd(self.buffer3[i], self.buffer3[i], self.node_pos[j])
 
-                vmultf(self.buffer3[vert.id], self.buffer3[vert.id], 1.0/len(neighbors))
+                vmultf(self.buffer3[i], self.buffer3[i], 1.0/(offsets[i+1] - offsets[i]))
 
         # Move to average.
-        for vert in self.mesh.verts:
-            if abs(vert.defect) > max_defect:
-                vert.p[0] = m*vert.p[0] + n*self.buffer3[vert.id, 0]
-                vert.p[1] = m*vert.p[1] + n*self.buffer3[vert.id, 1]
-                vert.p[2] = m*vert.p[2] + n*self.buffer3[vert.id, 2]
+        for i in range(self.n_nodes):
+            if abs(defect[i]) > max_defect:
+                pos[i, 0] = m*pos[i, 0] + n*self.buffer3[i, 0]
+                pos[i, 1] = m*pos[i, 1] + n*self.buffer3[i, 1]
+                pos[i, 2] = m*pos[i, 2] + n*self.buffer3[i, 2]
+
+    cpdef void markRegion(self) except *:
+        """ Find the region whose attributes may have changed: nodes that
+            moved or changed neighbors since calculateRegion and their
+            neighbors.
+        """
+        self.n_region = mesh_local.mark_region(self.node_pos, self.node_pos_prev,
+                                               self.node_dirty, self.n_nodes,
+                                               self.neighbor_offsets, self.neighbor_indices,
+                                               self.node_in_region, self.region)
+
+    cpdef void calculateRegionDefect(self) except *:
+        cdef int i
+        cdef Vert vert
+        mesh_local.vertex_defects(self.node_pos, self.face_verts, self.node_corner,
+                                  self.corner_next, self.region, self.n_region,
+                                  self.neighbor_offsets, self.node_defect)
+        if self.array_mesh:
+            return
+        for i in range(self.n_region):
+            vert = self.node_verts[self.region[i]]
+            vert.defect = self.node_defect[vert.id]
+
+    cpdef void calculateRegion(self) except *:
+        """ Recalculate normals, defect and curvature of the region only, the
+            rest of the mesh keeps the values it had.
+        """
+        cdef int i
+        cdef Vert vert
+        self.markRegion()
+        mesh_local.vertex_normals(self.node_pos, self.face_verts, self.node_corner,
+                                  self.corner_next, self.region, self.n_region,
+                                  self.node_normal)
+        self.calculateRegionDefect()
+        mesh_local.vertex_curvature(self.node_pos, self.node_normal, self.neighbor_offsets,
+                                    self.neighbor_indices, self.region, self.n_region,
+                                    self.node_curvature)
+        if not self.array_mesh:
+            for i in range(self.n_region):
+                vert = self.node_verts[self.region[i]]
+                vert.curvature = self.node_curvature[vert.id]
+        mesh_local.clear_region(self.node_pos, self.node_pos_prev, self.node_dirty,
+                                self.region, self.n_region)
+
+    cpdef void checkRegion(self) except *:
+        """ Update the region like calculateRegion, then recalculate every
+            node with the same kernels and keep that. local_error is set to
+            the largest difference, which is 0 unless the region missed a
+            node whose attributes changed.
+        """
+        cdef int i
+        cdef Vert vert
+        cdef int n = self.n_nodes
+        cdef int[:] everything = np.arange(n, dtype='int32')
+
+        self.calculateRegion()
+        normal = np.array(self.node_normal[:n])
+        defect = np.array(self.node_defect[:n])
+        curvature = np.array(self.node_curvature[:n])
+
+        mesh_local.vertex_normals(self.node_pos, self.face_verts, self.node_corner,
+                                  self.corner_next, everything, n, self.node_normal)
+        mesh_local.vertex_defects(self.node_pos, self.face_verts, self.node_corner,
+                                  self.corner_next, everything, n, self.neighbor_offsets,
+                                  self.node_defect)
+        mesh_local.vertex_curvature(self.node_pos, self.node_normal, self.neighbor_offsets,
+                                    self.neighbor_indices, everything, n,
+                                    self.node_curvature)
+        if not self.array_mesh:
+            for vert in self.mesh.verts:
+                vert.defect = self.node_defect[vert.id]
+                vert.curvature = self.node_curvature[vert.id]
+
+        self.local_error = max(
+            np.abs(normal - np.asarray(self.node_normal[:n])).max(),
+            np.abs(defect - np.asarray(self.node_defect[:n])).max(),
+            np.abs(curvature - np.asarray(self.node_curvature[:n])).max())
+
+    cpdef void relaxRegion(self, double amount=0.5) except *:
+        """ Relax the nodes near ones that moved since the last step. """
+        self.markRegion()
+        mesh_local.relax_region(self.node_pos, self.node_normal, self.neighbor_offsets,
+                                self.neighbor_indices, self.region, self.n_region, amount,
+                                self.buffer3)
 
     cpdef void calculateEnergy(self) except *:
         """ Calculate how much each node is allowed to grow. If sub-classes do
@@ -143,32 +369,37 @@ cdef class GrowthForm:
         pass
 
     cpdef void calculateGravity(self) except *:
-        cdef int i = 0
-        cdef double[:] down = np.array([0, -1.0, 0])
-        for i in range(self.n_nodes):
-            self.node_gravity[i] = vangle(down, self.node_normal[i]) / M_PI
+        calculate_gravity(self.node_gravity, self.node_normal, self.n_nodes)
 
     cpdef void createNode(self, Vert vert) except *:
         if self.n_nodes == self.max_nodes:
             return
 
-        cdef Vert vert_n
-        cdef int i
         cdef int idx = self.n_nodes
-        self.n_nodes += 1
         vert.data['node'] = idx
         self.node_pos[idx, :] = vert.p
         vert.normal = self.node_normal[idx]
         vert.p = self.node_pos[idx]
         self.node_verts[idx] = vert
-        self.collisionManager.newVert(vert)
+        self.addNode(self.nodeNeighbors(idx))
+        assert vert.id == idx
+
+    cpdef void addNode(self, list neighbors) except *:
+        """ Add node n_nodes, whose position is in node_pos already, next to
+            the nodes in neighbors.
+        """
+        cdef int i, j
+        cdef int idx = self.n_nodes
+        self.n_nodes += 1
+        self.collisionManager.newNode(idx)
+        self.neighbor_dirty[idx] = 1
 
         cdef int n = 0
-        for vert_n in vert.neighbors():
+        for j in neighbors:
             for i in range(self.n_memory):
-                self.node_memory[idx, i] += self.node_memory[vert_n.id, i]
+                self.node_memory[idx, i] += self.node_memory[j, i]
             for i in range(self.n_signals):
-                self.node_signals[idx, i] += self.node_signals[vert_n.id, i]
+                self.node_signals[idx, i] += self.node_signals[j, i]
             n += 1
 
         # Signals are average of neighbors.
@@ -179,52 +410,350 @@ cdef class GrowthForm:
         for i in range(self.n_memory):
             self.node_memory[idx, i] = 1 if self.node_memory[idx, i] > n/2 else 0
 
-        assert vert.id == idx
+    cpdef list nodeNeighbors(self, int i):
+        """ Ids of the nodes adjacent to node i, read from the mesh. """
+        cdef Vert vert, vert_n
+        if self.array_mesh:
+            return (<ArrayMesh>self.mesh).neighbors(i)
+        # Vertices split off in this subdivision have no node yet.
+        vert = (<Mesh>self.mesh).verts[i]
+        return [ vert_n.id for vert_n in vert.neighbors() ]
+
+    cpdef double faceArea(self, int f) except -1:
+        """ Area of face f, read from the mesh. """
+        cdef Face face
+        if self.array_mesh:
+            return (<ArrayMesh>self.mesh).face_area(f)
+        face = (<Mesh>self.mesh).faces[f]
+        return face.area()
+
+    cpdef list splitFace(self, int f):
+        """ Split face f at its centroid and flip its old edges, as sqrt(3)
+            subdivision does. Returns the ids of the faces that changed: f,
+            the faces across its edges and the new faces.
+        """
+        cdef int h, n_faces
+        cdef Face face
+        cdef Mesh mesh
+        cdef ArrayMesh amesh
+        cdef list touched = [f]
+
+        # The faces across its edges are the only old faces a split changes.
+        if self.array_mesh:
+            amesh = self.mesh
+            for h in range(3*f, 3*f + 3):
+                if amesh.he_twin[h] != -1:
+                    touched.append(amesh.he_twin[h] // 3)
+            n_faces = amesh.n_faces
+            amesh.split(f)
+            touched.extend(range(n_faces, amesh.n_faces))
+        else:
+            mesh = self.mesh
+            face = mesh.faces[f]
+            for he in (face.he, face.he.next, face.he.next.next):
+                if he.twin is not None and he.twin.face is not None:
+                    touched.append(he.twin.face.id)
+            n_faces = len(mesh.faces)
+            split(mesh, face, max_vertices=self.max_nodes)
+            touched.extend(range(n_faces, len(mesh.faces)))
+        return touched
 
     cpdef void subdivision(self) except *:
-        """ Adaptively subdivide the mesh and create new nodes.
+        """ Adaptively subdivide the mesh and create new nodes. Faces are
+            visited in order of id like a scan of mesh.faces would, but only
+            the ones that are too large or were changed by a split.
+        """
+        cdef int fid, f, i, j, v
+        cdef list heap = self.largeFaces() # Sorted, so already a heap.
+        cdef set queued = set(heap)
+
+        while heap:
+            fid = heapq.heappop(heap)
+            if self.faceArea(fid) <= self.max_face_area:
+                continue
+
+            # Splitting a face and flipping its edges only changes the
+            # neighbors of its vertices and their one-ring.
+            for j in range(3):
+                v = self.face_verts[fid, j]
+                self.neighbor_dirty[v] = 1
+                for i in self.nodeNeighbors(v):
+                    self.neighbor_dirty[i] = 1
+
+            # Large faces before this one are split next step, as a scan would.
+            for f in self.splitFace(fid):
+                self.updateFace(f)
+                if self.faceArea(f) > self.max_face_area:
+                    if f <= fid:
+                        self.face_pending.append(f)
+                    elif f not in queued:
+                        heapq.heappush(heap, f)
+                        queued.add(f)
+
+            if self.n_nodes == self.max_nodes:
+                self.face_pending.extend(heap)
+                break
+
+        # New vertices are appended to the mesh.
+        if self.array_mesh:
+            for i in range(self.n_nodes, (<ArrayMesh>self.mesh).n_verts):
+                self.addNode(self.nodeNeighbors(i))
+        else:
+            for i in range(self.n_nodes, len(self.mesh.verts)):
+                self.createNode(self.mesh.verts[i])
+
+        self.updateNeighbors()
+
+    cpdef void rebuildFaces(self) except *:
+        """ Rebuild face_verts and the corner lists from every face of the
+            mesh.
+        """
+        cdef int f
+        cdef int n_faces = (<ArrayMesh>self.mesh).n_faces if self.array_mesh else \
+                           len(self.mesh.faces)
+        self.n_faces = 0
+        self.node_corner[:] = -1
+        for f in range(n_faces):
+            self.updateFace(f)
+        self.node_pos_checked[:, :] = np.nan
+        self.face_pending = []
+
+    cdef void insertCorner(self, int c) noexcept nogil:
+        cdef int v = self.face_verts[c // 3, c % 3]
+        self.corner_prev[c] = -1
+        self.corner_next[c] = self.node_corner[v]
+        if self.node_corner[v] != -1:
+            self.corner_prev[self.node_corner[v]] = c
+        self.node_corner[v] = c
+
+    cdef void removeCorner(self, int c) noexcept nogil:
+        cdef int v = self.face_verts[c // 3, c % 3]
+        if self.corner_prev[c] != -1:
+            self.corner_next[self.corner_prev[c]] = self.corner_next[c]
+        else:
+            self.node_corner[v] = self.corner_next[c]
+        if self.corner_next[c] != -1:
+            self.corner_prev[self.corner_next[c]] = self.corner_prev[c]
+
+    cpdef void updateFace(self, int f) except *:
+        """ Write the vertex ids of face f into its row of face_verts and
+            move the corners that changed vertex.
         """
+        cdef int j, v
+        cdef bint is_new = f >= self.n_faces
         cdef Face face
-        cdef Vert vert
-        for face in self.mesh.faces:
-            if face.area() > self.max_face_area:
-                split(self.mesh, face, max_vertices=self.max_nodes)
-                if self.n_nodes == self.max_nodes:
-                    break
-
-        for vert in self.mesh.verts:
-            if 'node' not in vert.data:
-                self.createNode(vert)
-
-    cpdef void diffuse(self) except *:
-        """ Diffuse energy and signals across surface.
+        cdef ArrayMesh amesh
+        cdef int verts[3]
+        if f >= self.face_verts.shape[0]:
+            face_verts = np.zeros((2*self.face_verts.shape[0], 3), dtype='int32')
+            face_verts[:self.n_faces] = self.face_verts[:self.n_faces]
+            self.face_verts = face_verts
+            for name in ('corner_next', 'corner_prev'):
+                corners = np.full(3*face_verts.shape[0], -1, dtype='int32')
+                corners[:3*self.n_faces] = getattr(self, name)[:3*self.n_faces]
+                setattr(self, name, corners)
+            self.face_mark = np.zeros(face_verts.shape[0], dtype='uint8')
+
+        if self.array_mesh:
+            amesh = self.mesh
+            for j in range(3):
+                verts[j] = amesh.he_vert[3*f + j]
+        else:
+            face = (<Mesh>self.mesh).faces[f]
+            verts[0] = face.he.vert.id
+            verts[1] = face.he.next.vert.id
+            verts[2] = face.he.next.next.vert.id
+
+        for j in range(3):
+            v = verts[j]
+            if is_new or self.face_verts[f, j] != v:
+                if not is_new:
+                    self.removeCorner(3*f + j)
+                self.face_verts[f, j] = v
+                self.insertCorner(3*f + j)
+        self.n_faces = max(self.n_faces, f + 1)
+
+    cdef bint isLarge(self, int f) noexcept nogil:
+        """ Whether face f has area over max_face_area. """
+        cdef int a = self.face_verts[f, 0]
+        cdef int b = self.face_verts[f, 1]
+        cdef int c = self.face_verts[f, 2]
+        cdef double ux = self.node_pos[b, 0] - self.node_pos[a, 0]
+        cdef double uy = self.node_pos[b, 1] - self.node_pos[a, 1]
+        cdef double uz = self.node_pos[b, 2] - self.node_pos[a, 2]
+        cdef double vx = self.node_pos[c, 0] - self.node_pos[a, 0]
+        cdef double vy = self.node_pos[c, 1] - self.node_pos[a, 1]
+        cdef double vz = self.node_pos[c, 2] - self.node_pos[a, 2]
+        cdef double cx = uy*vz - uz*vy
+        cdef double cy = uz*vx - ux*vz
+        cdef double cz = ux*vy - uy*vx
+        # Twice the area squared, so no square root.
+        return cx*cx + cy*cy + cz*cz > 4 * self.max_face_area * self.max_face_area
+
+    cpdef list largeFaces(self):
+        """ Ids of the faces with area over max_face_area, in order. Only the
+            faces of nodes that moved since the last call and the faces left
+            over by the last subdivision are checked, the area of any other
+            face is unchanged since it was found to be small.
         """
-        cdef int i, mi, steps
-        cdef float nsum
-        cdef Vert vert
-        cdef list neighbors = [ vert.neighbors() for vert in self.mesh.verts ]
-
-        for _ in range(self.traits['energy_diffuse_steps']):
-            for i in range(self.n_nodes):
-                nsum = 0
-                for vert in neighbors[i]:
-                    nsum += self.node_energy[vert.id]
-                self.buffer[i] = .5*self.node_energy[i] + .5*nsum / len(neighbors[i])
-
+        cdef int i, c, f
+        cdef int n_candidates = 0
+        cdef double[:, ::1] pos = self.node_pos
+        cdef double[:, ::1] checked = self.node_pos_checked
+        cdef int[:] corner_next = self.corner_next
+        cdef int[:] node_corner = self.node_corner
+        cdef uint8[:] mark = self.face_mark
+        cdef int[:] candidates = np.empty(self.n_faces, dtype='int32')
+        cdef list large = []
+
+        for f in self.face_pending:
+            if not mark[f]:
+                mark[f] = 1
+                candidates[n_candidates] = f
+                n_candidates += 1
+        self.face_pending = []
+
+        with nogil:
             for i in range(self.n_nodes):
-                self.node_energy[i] = self.buffer[i]
+                if pos[i, 0] == checked[i, 0] and pos[i, 1] == checked[i, 1] and \
+                   pos[i, 2] == checked[i, 2]:
+                    continue
+                checked[i, 0] = pos[i, 0]
+                checked[i, 1] = pos[i, 1]
+                checked[i, 2] = pos[i, 2]
+                c = node_corner[i]
+                while c != -1:
+                    f = c // 3
+                    if not mark[f]:
+                        mark[f] = 1
+                        candidates[n_candidates] = f
+                        n_candidates += 1
+                    c = corner_next[c]
+
+        for i in range(n_candidates):
+            f = candidates[i]
+            mark[f] = 0
+            if self.isLarge(f):
+                large.append(f)
+
+        large.sort()
+        return large
+
+    cpdef void rebuildNeighbors(self) except *:
+        """ Rebuild the neighbor index of every node from the mesh.
+        """
+        self.neighbor_dirty[:self.n_nodes] = 1
+        self.updateNeighbors()
 
-        for mi in range(self.n_signals):
-            steps = self.traits['signal_diffuse_steps%i'%mi]
-            for _ in range(steps):
-                for i in range(self.n_nodes):
-                    nsum = 0
-                    for vert in neighbors[i]:
-                        nsum += self.node_signals[vert.id, mi]
-                    self.buffer[i] = .5*self.node_signals[i, mi] + .5*nsum / len(neighbors[i])
+    cpdef void updateNeighbors(self) except *:
+        """ Patch the neighbor index. Rows of nodes marked in neighbor_dirty
+            are read from the mesh and all others are copied from the
+            previous index.
+        """
+        cdef int i, k, start, end
+        cdef int n = self.n_nodes
+        cdef int n_old = self.n_neighbor_nodes
+        cdef list rows = []
+        cdef list row
+        cdef int[:] offsets = self.neighbor_offsets
+        cdef int[:] indices = self.neighbor_indices
+        cdef int[:] out
+        cdef uint8[:] dirty = self.neighbor_dirty
+        cdef int size = 0
+
+        # Size of the new index.
+        for i in range(n):
+            if i >= n_old or dirty[i]:
+                row = self.nodeNeighbors(i)
+                rows.append(row)
+                size += len(row)
+            else:
+                size += offsets[i+1] - offsets[i]
+
+        if size > self.neighbor_buffer.shape[0]:
+            self.neighbor_buffer = np.zeros(2*size, dtype='int32')
+        out = self.neighbor_buffer
+
+        # Write the new index into the spare buffer.
+        cdef int ri = 0
+        cdef int pos = 0
+        start = offsets[0]
+        for i in range(n):
+            end = offsets[i+1]
+            offsets[i] = pos
+            if i >= n_old or dirty[i]:
+                row = rows[ri]
+                ri += 1
+                for k in range(len(row)):
+                    out[pos] = row[k]
+                    pos += 1
+                dirty[i] = 0
+                self.node_dirty[i] = 1
+            else:
+                for k in range(start, end):
+                    out[pos] = indices[k]
+                    pos += 1
+            start = end
+            self.neighbor_weights[i] = 1.0 / (pos - offsets[i])
+        offsets[n] = pos
+
+        self.neighbor_buffer, self.neighbor_indices = self.neighbor_indices, self.neighbor_buffer
+        self.n_neighbor_nodes = n
+
+    @cython.wraparound(False)
+    cpdef void diffuse(self) except *:
+        """ Diffuse energy and signals across surface. Energy and every signal
+            are stacked as columns and advanced together, each column for its
+            own number of steps.
+        """
+        cdef int i, k, j, c, t
+        cdef int n = self.n_nodes
+        cdef int nc = 1 + self.n_signals
+        cdef int max_steps = 0
+        cdef double w
+        cdef int[:] steps = self.diffuse_steps
+        cdef int[:] offsets = self.neighbor_offsets
+        cdef int[:] indices = self.neighbor_indices
+        cdef double[:] weights = self.neighbor_weights
+        cdef double[:, ::1] X = self.diffuse_state
+        cdef double[:, ::1] Y = self.diffuse_buffer
+        cdef double[:, ::1] tmp
+        cdef int n_threads = get_threads()
+
+        for c in range(nc):
+            max_steps = max(max_steps, steps[c])
+        if max_steps == 0:
+            return
 
-                for i in range(self.n_nodes):
-                    self.node_signals[i, mi] = self.buffer[i]
+        for i in range(n):
+            X[i, 0] = self.node_energy[i]
+            for c in range(1, nc):
+                X[i, c] = self.node_signals[i, c-1]
+
+        for t in range(max_steps):
+            for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                for c in range(nc):
+                    Y[i, c] = 0
+
+                for k in range(offsets[i], offsets[i+1]):
+                    j = indices[k]
+                    for c in range(nc):
+                        Y[i, c] += X[j, c]
+
+                w = weights[i]
+                for c in range(nc):
+                    if t < steps[c]:
+                        Y[i, c] = .5*X[i, c] + .5*Y[i, c]*w
+                    else:
+                        Y[i, c] = X[i, c]
+            tmp = X
+            X = Y
+            Y = tmp
+
+        for i in range(n):
+            self.node_energy[i] = X[i, 0]
+            for c in range(1, nc):
+                self.node_signals[i, c-1] = X[i, c]
 
     # cpdef void decaySignals(self) except *:
     #     cdef int i, si
@@ -235,118 +764,237 @@ cdef class GrowthForm:
 
     cpdef void createNodeInputs(self) except *:
         """ Map node stats to neural input in [-1, 1] range. """
-        cdef int input_idx, i, j, mi, mbin
-        cdef int morphogen_thresholds = self.params.morphogen_thresholds
-        cdef int signal_thresholds = self.params.signal_thresholds
-        cdef double[:,:] morphogensU = self.morphogens.U
-        cdef bint use_polar_direction = self.params.use_polar_direction
-        cdef double signal_sum, azimuthal_angle, polar_angle
-
-        self.node_inputs[:, :] = -1
-
-        for i in range(self.n_nodes):
-            self.node_inputs[i, 0] = (self.node_energy[i] * 2) - 1
-            self.node_inputs[i, 1] = self.node_gravity[i]
-            self.node_inputs[i, 2] = self.mesh.verts[i].curvature
-            input_idx = 3
-
-            for j in range(self.n_attributes):
-                self.node_inputs[i, input_idx] = self.node_attributes[i, j]
-                input_idx += 1
-
-            # Morphogens.
-            for mi in range(self.n_morphogens):
-                mbin = <int>(floor(morphogensU[mi, i] * morphogen_thresholds))
-                mbin = min(morphogen_thresholds - 1, mbin)
-                self.node_inputs[i, input_idx + (mbin)] = 1
-                input_idx += morphogen_thresholds
-
-            # Signals.
-            for mi in range(self.n_signals):
-                mbin = <int>(floor(self.node_signals[i, mi] * signal_thresholds))
-                mbin = min(signal_thresholds - 1, mbin)
-                self.node_inputs[i, input_idx + mbin] = 1
-                input_idx += signal_thresholds
-
-            # Memory.
-            for mi in range(self.n_memory):
-                self.node_inputs[i, input_idx] = -1.0 + self.node_memory[i, mi] * 2.0
-                input_idx += 1
-
-            if use_polar_direction:
-                azimuthal_angle = atan(self.node_normal[i, 1] / self.node_normal[i, 0])
-                polar_angle = acos(self.node_normal[i, 2])
-                self.node_inputs[i, input_idx] = cos(azimuthal_angle)
-                self.node_inputs[i, input_idx+1] = sin(azimuthal_angle)
-                self.node_inputs[i, input_idx+2] = cos(polar_angle)
-                self.node_inputs[i, input_idx+3] = sin(polar_angle)
-                input_idx += 4
-
-            self.node_inputs[i, input_idx] = 1 # Bias Bit
-            input_idx += 1
-
-            assert input_idx == self.n_inputs, (input_idx, self.n_inputs)
-
+        create_node_inputs(self.node_inputs, self.n_nodes, self.node_energy,
+                           self.node_gravity, self.node_curvature, self.node_attributes,
+                           self.morphogens.U, self.params.morphogen_thresholds,
+                           self.node_signals, self.params.signal_thresholds,
+                           self.node_memory, self.n_memory, self.node_normal,
+                           self.params.use_polar_direction)
+
+    @cython.wraparound(False)
     cpdef void grow(self) except *:
-        cdef int i, out_idx, mi, n
-        cdef Vert vert
+        cdef int i, j, k, out_idx, mi, n
+        cdef int[:] offsets = self.neighbor_offsets
+        cdef int[:] indices = self.neighbor_indices
+        cdef double[:] buffer = self.buffer
+        cdef double[:, ::1] pos = self.node_pos
+        cdef double[:, ::1] pos_next = self.node_pos_next
+        cdef double[:, ::1] normal = self.node_normal
         cdef double growth
         cdef object output
+        cdef double[:,:] outputs
         cdef double[:,:] morphogensV = self.morphogens.V
 
         # Boost library for neural network wants numpy array or list.
         cdef object inputs = np.asarray(self.node_inputs)
 
-        for i in range(self.n_nodes):
-
-            # Compute feed-forward network results.
-            self.network.Flush()
-            self.network.Input(inputs[i])
-            for _ in range(self.net_depth):
-                self.network.ActivateFast()
-            output = self.network.Output()
+        # Compute feed-forward network results.
+        if isinstance(self.network, CompiledNetwork):
+            outputs = self.network.activate(inputs[:self.n_nodes])
+        else:
+            outputs = self.node_outputs
+            for i in range(self.n_nodes):
+                self.network.Flush()
+                self.network.Input(inputs[i])
+                for _ in range(self.net_depth):
+                    self.network.ActivateFast()
+                output = self.network.Output()
+                for j in range(self.n_outputs):
+                    outputs[i, j] = output[j]
 
+        for i in range(self.n_nodes):
             # Move in normal direction by growth amount.
-            growth = min(output[0], self.node_energy[i]) * self.C
+            growth = min(outputs[i, 0], self.node_energy[i]) * self.C
             growth = min(growth, self.max_growth)
             self.buffer[i] = growth
 
             # Morphogens.
             out_idx = 1
             for mi in range(self.n_morphogens):
-                if output[out_idx] > 0.5:
+                if outputs[i, out_idx] > 0.5:
                     morphogensV[mi, i] = 1.0
                 out_idx += 1
 
             # Signals
             for mi in range(self.n_signals):
-                self.node_signals[i, mi] = <int>(output[out_idx] > 0.5)
+                self.node_signals[i, mi] = <int>(outputs[i, out_idx] > 0.5)
                 out_idx += 1
 
             # Memory
             for mi in range(self.n_memory):
-                if output[out_idx] > 0.75:
+                if outputs[i, out_idx] > 0.75:
                     self.node_memory[i, mi] = 1
                 out_idx += 1
 
-        for i in range(self.n_nodes):
+        for i in prange(self.n_nodes, nogil=True, num_threads=get_threads(), schedule='static'):
             growth = 0.0
             n = 0
 
-            for vert in self.mesh.verts[i].neighbors():
-                growth += self.buffer[vert.id]
-                n += 1
+            for k in range(offsets[i], offsets[i+1]):
+                growth = growth + buffer[indices[k]]
+                n = n + 1
 
-            growth = ((growth/n) + self.buffer[i]) * 0.5
+            growth = ((growth/n) + buffer[i]) * 0.5
 
-            self.node_pos_next[i, 0] = self.node_pos[i, 0] + growth * self.node_normal[i, 0]
-            self.node_pos_next[i, 1] = self.node_pos[i, 1] + growth * self.node_normal[i, 1]
-            self.node_pos_next[i, 2] = self.node_pos[i, 2] + growth * self.node_normal[i, 2]
+            pos_next[i, 0] = pos[i, 0] + growth * normal[i, 0]
+            pos_next[i, 1] = pos[i, 1] + growth * normal[i, 1]
+            pos_next[i, 2] = pos[i, 2] + growth * normal[i, 2]
 
         if self.params.has_ground: # Can't go below ground.
             for i in range(self.n_nodes):
                 self.node_pos_next[i, 1] = max(0, self.node_pos_next[i, 1])
 
+    def nodeArrays(self):
+        """ Every node_* array by name, including those added by subclasses.
+            The arrays share memory with the form.
+        """
+        arrays = {}
+        for name in dir(self):
+            if not name.startswith('node_'):
+                continue
+            value = getattr(self, name)
+            if isinstance(value, list):
+                continue
+            arr = np.asarray(value)
+            if arr.ndim > 0 and arr.shape[0] == self.max_nodes:
+                arrays[name] = arr
+        return arrays
+
+    cpdef void saveState(self, str path) except *:
+        """ Write everything needed to continue the simulation to one
+            compressed numpy archive: the mesh, every node_* array, the
+            morphogens, the neighbor, face and corner indices, the collision
+            grid, the age and whatever extraState adds. Caches like the light
+            hash and voxel grids are rebuilt on the next step.
+        """
+        cdef int n = self.n_nodes
+        cdef Vert vert
+        cm = self.collisionManager
+        state = {
+            'age': self.age,
+            'n_nodes': n,
+            'volume': self.volume,
+            'faces': np.asarray(self.face_verts[:self.n_faces]),
+            'morphogens_U': np.asarray(self.morphogens.U)[:, :n],
+            'morphogens_V': np.asarray(self.morphogens.V)[:, :n],
+            'neighbor_offsets': np.asarray(self.neighbor_offsets[:n+1]),
+            'neighbor_indices': np.asarray(self.neighbor_indices[:self.neighbor_offsets[n]]),
+            'collision_particles': np.asarray(cm.particles)[:n],
+            'collision_bucket': np.asarray(cm.bucket)[:n],
+            'collision_next': np.asarray(cm.next)[:n],
+            'collision_prev': np.asarray(cm.prev)[:n],
+            'collision_head': np.asarray(cm.head),
+            'corner_next': np.asarray(self.corner_next[:3*self.n_faces]),
+            'corner_prev': np.asarray(self.corner_prev[:3*self.n_faces]),
+            'face_pending': np.array(self.face_pending, dtype='int32'),
+        }
+        if self.array_mesh:
+            # The half-edge each vertex ring starts at, so rings keep their order.
+            state['vert_he'] = np.asarray(self.mesh.vert_he)[:n]
+        else:
+            state['vert_defect'] = np.array([ vert.defect for vert in self.mesh.verts ])
+            state['vert_curvature'] = np.array([ vert.curvature for vert in self.mesh.verts ])
+        for name, arr in self.nodeArrays().items():
+            state[name] = arr[:n]
+        state.update(self.extraState())
+
+        with open(path, 'wb') as out:
+            np.savez_compressed(out, **state)
+
+    cpdef void loadState(self, str path) except *:
+        """ Continue from a file written by saveState. The form must have
+            been created with the same parameters and traits.
+        """
+        cdef int i, n
+        cdef Vert vert
+        state = np.load(path)
+        n = int(state['n_nodes'])
+        assert n <= self.max_nodes, 'Checkpoint has %i nodes, max_nodes is %i.' % \
+                                    (n, self.max_nodes)
+
+        # A fresh mesh whose positions alias node_pos, as in __init__.
+        if self.array_mesh:
+            self.mesh = ArrayMesh(state['node_pos'], state['faces'], np.asarray(self.node_pos))
+            np.asarray(self.mesh.vert_he)[:n] = state['vert_he']
+        else:
+            self.mesh = Mesh(state['node_pos'].tolist(), state['faces'].tolist())
+        self.morphogens.mesh = self.mesh
+        self.n_nodes = 0
+        self.node_verts = [None] * self.max_nodes
+        self.collisionManager = MeshCollisionManager(self.mesh, self.node_pos,\
+                                                     self.node_normal, self.node_size)
+        if self.array_mesh:
+            for i in range(n):
+                self.addNode(self.nodeNeighbors(i))
+        else:
+            for vert in self.mesh.verts:
+                self.createNode(vert)
+        assert self.n_nodes == n
+
+        arrays = self.nodeArrays()
+        for name in state.files:
+            if name in arrays:
+                arrays[name][:n] = state[name]
+
+        if not self.array_mesh:
+            for vert in self.mesh.verts:
+                vert.defect = state['vert_defect'][vert.id]
+                vert.curvature = state['vert_curvature'][vert.id]
+
+        np.asarray(self.morphogens.U)[:, :n] = state['morphogens_U']
+        np.asarray(self.morphogens.V)[:, :n] = state['morphogens_V']
+
+        # The neighbor index in the saved order so sums repeat exactly.
+        offsets = state['neighbor_offsets']
+        indices = state['neighbor_indices']
+        if indices.shape[0] > self.neighbor_indices.shape[0]:
+            self.neighbor_indices = np.zeros(2*indices.shape[0], dtype='int32')
+            self.neighbor_buffer = np.zeros(2*indices.shape[0], dtype='int32')
+        np.asarray(self.neighbor_offsets)[:n+1] = offsets
+        np.asarray(self.neighbor_indices)[:indices.shape[0]] = indices
+        np.asarray(self.neighbor_weights)[:n] = 1.0 / np.diff(offsets)
+        np.asarray(self.neighbor_dirty)[:n] = 0
+        self.n_neighbor_nodes = n
+
+        faces = state['faces']
+        if faces.shape[0] > self.face_verts.shape[0]:
+            self.face_verts = np.zeros((2*faces.shape[0], 3), dtype='int32')
+        np.asarray(self.face_verts)[:faces.shape[0]] = faces
+        self.n_faces = faces.shape[0]
+
+        # The corner lists in the saved order, the region kernels sum over
+        # them. node_corner and node_pos_checked are node arrays.
+        if self.corner_next.shape[0] < 3*self.face_verts.shape[0]:
+            self.corner_next = np.full(3*self.face_verts.shape[0], -1, dtype='int32')
+            self.corner_prev = np.full(3*self.face_verts.shape[0], -1, dtype='int32')
+            self.face_mark = np.zeros(self.face_verts.shape[0], dtype='uint8')
+        np.asarray(self.corner_next)[:3*self.n_faces] = state['corner_next']
+        np.asarray(self.corner_prev)[:3*self.n_faces] = state['corner_prev']
+        self.face_pending = state['face_pending'].tolist()
+
+        # The collision grid with the same bucket order.
+        cm = self.collisionManager
+        if state['collision_head'].shape[0] == cm.head.shape[0]:
+            np.asarray(cm.particles)[:n] = state['collision_particles']
+            np.asarray(cm.bucket)[:n] = state['collision_bucket']
+            np.asarray(cm.next)[:n] = state['collision_next']
+            np.asarray(cm.prev)[:n] = state['collision_prev']
+            np.asarray(cm.head)[:] = state['collision_head']
+
+        self.age = int(state['age'])
+        self.volume = float(state['volume'])
+        self.loadExtraState(state)
+
+    def extraState(self):
+        """ Arrays a subclass adds to the saveState file, beyond its node_*
+            arrays which are saved already.
+        """
+        return {}
+
+    def loadExtraState(self, state):
+        """ Restore what extraState saved. """
+        pass
+
     cpdef void export(self, str path) except *:
         """ Export the coral to .coral.obj file
             A .coral.obj file is a 3d mesh with node specific information.
@@ -381,7 +1029,7 @@ cdef class GrowthForm:
                 p_attributes[i].append(self.node_attributes[i, j])
 
             p_attributes[i].append( self.node_energy[i] )
-            p_attributes[i].append( self.node_verts[i].curvature )
+            p_attributes[i].append( self.node_curvature[i] )
             p_attributes[i].append( self.node_gravity[i] )
 
             for j in range(self.n_morphogens):
@@ -396,9 +1044,10 @@ cdef class GrowthForm:
         assert len(p_attributes[0]) == len(header)
 
         # Write vertices (position and color).
-        for i, vert in enumerate(self.mesh.verts):
+        for i in range(self.n_nodes):
             r, g, b = p_attributes[i][:3]
-            out.write('v %f %f %f %f %f %f\n' % (tuple(vert.p)+(r, g, b)))
+            out.write('v %f %f %f %f %f %f\n' % (self.node_pos[i, 0], self.node_pos[i, 1],
+                                                 self.node_pos[i, 2], r, g, b))
         out.write('\n')
 
         # Write coral data lines.
@@ -407,7 +1056,7 @@ cdef class GrowthForm:
         out.write('\n')
 
         # Write Faces
-        for face in self.mesh.faces:
-            v1, v2, v3 = face.vertices()
-            out.write('f %i %i %i\n' % (v1.id+1, v2.id+1, v3.id+1))
+        for i in range(self.n_faces):
+            out.write('f %i %i %i\n' % (self.face_verts[i, 0]+1, self.face_verts[i, 1]+1,
+                                        self.face_verts[i, 2]+1))
         out.close()
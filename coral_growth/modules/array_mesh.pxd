@@ -0,0 +1,19 @@
+cdef class ArrayMesh:
+    cdef public int n_verts, n_faces, n_edges, max_verts
+    cdef public double[:, ::1] pos
+    cdef public int[:] he_vert, he_next, he_twin, he_face, vert_he, face_he
+
+    cdef int outgoing_start(self, int v) noexcept nogil
+    cdef void set_he(self, int h, int vert, int twin)
+    cpdef list neighbors(self, int v)
+    cpdef int neighbor_index(self, int[:] offsets, int[:] indices) except -2
+    cpdef void face_verts(self, int[:, ::1] out) except *
+    cpdef double face_area(self, int f) except -1
+    cpdef double volume(self) except *
+    cpdef void calculate_normals(self, double[:, ::1] normals) except *
+    cpdef void calculate_defect(self, double[:] defect) except *
+    cpdef void calculate_curvature(self, double[:, ::1] normals, double[:] curvature) except *
+    cpdef void relax(self, double[:, ::1] normals, double amount=*) except *
+    cpdef void reserve(self, int n_faces) except *
+    cpdef bint flip(self, int h) except *
+    cpdef int split(self, int f) except -2
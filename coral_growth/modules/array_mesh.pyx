@@ -0,0 +1,372 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+""" A triangle mesh stored as flat int32 half-edge arrays, an alternative to
+    the object mesh of cymesh with every operation GrowthForm needs.
+
+    The half-edges of face f are 3f, 3f+1 and 3f+2, so he_vert viewed as an
+    (n_faces, 3) array is the face vertex table. he_vert is the vertex a
+    half-edge starts at and he_twin is -1 on the boundary.
+
+    GrowthForm keeps its mesh in one when params.array_mesh is set.
+"""
+from __future__ import print_function
+from libc.math cimport sqrt
+import numpy as np
+from coral_growth.modules cimport mesh_local
+
+cdef inline int prev_he(int h) noexcept nogil:
+    return h - h % 3 + (h + 2) % 3
+
+cdef class ArrayMesh:
+    def __init__(self, points, faces, pos=None, max_verts=0):
+        """ points is (n, 3) and faces (m, 3) vertex indices with a consistent
+            winding. When pos is given the mesh positions are its rows, so it
+            can alias node_pos, and it sets the maximum number of vertices.
+        """
+        points = np.asarray(points, dtype='float64')
+        faces = np.asarray(faces, dtype='int32')
+        cdef int n = points.shape[0]
+        cdef int m = faces.shape[0]
+
+        if pos is None:
+            pos = np.zeros((max(max_verts, n), 3))
+        assert pos.shape[0] >= n, 'pos has room for %i verts, not %i' % (pos.shape[0], n)
+        pos[:n] = points
+        self.pos = pos
+        self.max_verts = pos.shape[0]
+        self.n_verts = n
+        self.n_faces = 0
+        self.n_edges = 0
+
+        self.vert_he = np.full(self.max_verts, -1, dtype='int32')
+        self.face_he = np.zeros(0, dtype='int32')
+        self.he_vert = np.zeros(0, dtype='int32')
+        self.he_next = np.zeros(0, dtype='int32')
+        self.he_twin = np.zeros(0, dtype='int32')
+        self.he_face = np.zeros(0, dtype='int32')
+        self.reserve(2*self.max_verts + m)
+
+        cdef int f, k, h, a, b
+        cdef dict edges = {}
+        for f in range(m):
+            self.face_he[f] = 3*f
+            for k in range(3):
+                h = 3*f + k
+                a = faces[f, k]
+                b = faces[f, (k+1) % 3]
+                self.he_vert[h] = a
+                self.he_next[h] = 3*f + (k+1) % 3
+                self.he_face[h] = f
+                self.vert_he[a] = h
+                assert (a, b) not in edges, 'Edge %i-%i is in two faces the same way.' % (a, b)
+                edges[(a, b)] = h
+        self.n_faces = m
+
+        for (a, b), h in edges.items():
+            twin = edges.get((b, a), -1)
+            self.he_twin[h] = twin
+            if twin == -1 or a < b:
+                self.n_edges += 1
+
+    @staticmethod
+    def from_obj(path, pos=None, max_verts=0):
+        """ Load the vertices and triangles of an obj file. """
+        points = []
+        faces = []
+        for line in open(path):
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'v':
+                points.append([float(x) for x in parts[1:4]])
+            elif parts[0] == 'f':
+                faces.append([int(x.split('/')[0]) - 1 for x in parts[1:4]])
+        return ArrayMesh(points, faces, pos, max_verts)
+
+    def export(self, path):
+        """ Write the mesh to an obj file. """
+        faces = self.faces()
+        with open(path, 'w+') as out:
+            for i in range(self.n_verts):
+                out.write('v %f %f %f\n' % tuple(self.pos[i]))
+            for f in range(self.n_faces):
+                out.write('f %i %i %i\n' % tuple(faces[f] + 1))
+
+    def faces(self):
+        """ The (n_faces, 3) vertex table, a view of he_vert. """
+        return np.asarray(self.he_vert)[:3*self.n_faces].reshape(-1, 3)
+
+    cpdef void reserve(self, int n_faces) except *:
+        """ Make room for n_faces faces, growing the buffers geometrically. """
+        cdef int old_size = self.face_he.shape[0]
+        cdef int size = max(old_size, 1)
+        if n_faces <= old_size:
+            return
+        while size < n_faces:
+            size *= 2
+
+        face_he = np.zeros(size, dtype='int32')
+        face_he[:old_size] = self.face_he
+        self.face_he = face_he
+        for name in ('he_vert', 'he_next', 'he_twin', 'he_face'):
+            arr = np.full(3*size, -1, dtype='int32')
+            arr[:3*old_size] = getattr(self, name)
+            setattr(self, name, arr)
+
+    cdef int outgoing_start(self, int v) noexcept nogil:
+        """ An outgoing half-edge of v that sweeps all of its faces by
+            rotating counter clockwise, the boundary one if v is on the
+            boundary. -1 if v is in no face.
+        """
+        cdef int h = self.vert_he[v]
+        cdef int start = h
+        if h == -1:
+            return -1
+        while self.he_twin[h] != -1:
+            h = self.he_next[self.he_twin[h]]
+            if h == start:
+                break
+        return h
+
+    cpdef list neighbors(self, int v):
+        """ Ids of the vertices adjacent to v, in counter clockwise order. """
+        cdef list result = []
+        cdef int h = self.outgoing_start(v)
+        cdef int start = h
+        cdef int p
+        while h != -1:
+            result.append(self.he_vert[self.he_next[h]])
+            p = prev_he(h)
+            if self.he_twin[p] == -1:
+                result.append(self.he_vert[p])
+                break
+            h = self.he_twin[p]
+            if h == start:
+                break
+        return result
+
+    cpdef int neighbor_index(self, int[:] offsets, int[:] indices) except -2:
+        """ Write the compressed sparse row neighbor index used by GrowthForm.
+            Returns the number of indices or -1 if indices is too small.
+        """
+        cdef int v, h, p, start
+        cdef int pos = 0
+        cdef int size = indices.shape[0]
+        with nogil:
+            for v in range(self.n_verts):
+                offsets[v] = pos
+                h = self.outgoing_start(v)
+                start = h
+                while h != -1:
+                    if pos + 2 > size:
+                        return -1
+                    indices[pos] = self.he_vert[self.he_next[h]]
+                    pos += 1
+                    p = prev_he(h)
+                    if self.he_twin[p] == -1:
+                        indices[pos] = self.he_vert[p]
+                        pos += 1
+                        break
+                    h = self.he_twin[p]
+                    if h == start:
+                        break
+            offsets[self.n_verts] = pos
+        return pos
+
+    cpdef void face_verts(self, int[:, ::1] out) except *:
+        """ Copy the vertex table into the first n_faces rows of out. """
+        cdef int f, k
+        for f in range(self.n_faces):
+            for k in range(3):
+                out[f, k] = self.he_vert[3*f + k]
+
+    cpdef double face_area(self, int f) except -1:
+        cdef int a = self.he_vert[3*f]
+        cdef int b = self.he_vert[3*f+1]
+        cdef int c = self.he_vert[3*f+2]
+        cdef double ux = self.pos[b, 0] - self.pos[a, 0]
+        cdef double uy = self.pos[b, 1] - self.pos[a, 1]
+        cdef double uz = self.pos[b, 2] - self.pos[a, 2]
+        cdef double vx = self.pos[c, 0] - self.pos[a, 0]
+        cdef double vy = self.pos[c, 1] - self.pos[a, 1]
+        cdef double vz = self.pos[c, 2] - self.pos[a, 2]
+        return 0.5 * sqrt((uy*vz - uz*vy)**2 + (uz*vx - ux*vz)**2 + (ux*vy - uy*vx)**2)
+
+    cpdef double volume(self) except *:
+        """ Signed volume enclosed by the faces, positive for outward faces. """
+        cdef int f, a, b, c
+        cdef double total = 0
+        cdef double[:, ::1] p = self.pos
+        with nogil:
+            for f in range(self.n_faces):
+                a = self.he_vert[3*f]
+                b = self.he_vert[3*f+1]
+                c = self.he_vert[3*f+2]
+                total += p[a, 0] * (p[b, 1]*p[c, 2] - p[b, 2]*p[c, 1]) + \
+                         p[a, 1] * (p[b, 2]*p[c, 0] - p[b, 0]*p[c, 2]) + \
+                         p[a, 2] * (p[b, 0]*p[c, 1] - p[b, 1]*p[c, 0])
+        return total / 6
+
+    def edge_lengths(self):
+        """ The length of every edge, once each. """
+        he = np.arange(3*self.n_faces)
+        twin = np.asarray(self.he_twin)[he]
+        he = he[(twin == -1) | (he < twin)]
+        vert = np.asarray(self.he_vert)
+        pos = np.asarray(self.pos)
+        a = pos[vert[he]]
+        b = pos[vert[np.asarray(self.he_next)[he]]]
+        return np.sqrt(((a - b)**2).sum(axis=1))
+
+    def _everything(self):
+        """ A region of every vertex for the mesh_local kernels. """
+        return np.arange(self.n_verts, dtype='int32')
+
+    def _corners(self):
+        """ The corner lists of the mesh_local kernels. Corner 3f+j of face f
+            is half-edge 3f+j, so each vertex lists its outgoing half-edges.
+        """
+        cdef int c, v
+        cdef int[:] node_corner = np.full(self.n_verts, -1, dtype='int32')
+        cdef int[:] corner_next = np.full(3*self.n_faces, -1, dtype='int32')
+        for c in range(3*self.n_faces):
+            v = self.he_vert[c]
+            corner_next[c] = node_corner[v]
+            node_corner[v] = c
+        return node_corner, corner_next
+
+    def _csr(self):
+        offsets = np.zeros(self.n_verts + 1, dtype='int32')
+        indices = np.zeros(8*self.n_verts, dtype='int32')
+        while self.neighbor_index(offsets, indices) == -1:
+            indices = np.zeros(2*indices.shape[0], dtype='int32')
+        return offsets, indices
+
+    cpdef void calculate_normals(self, double[:, ::1] normals) except *:
+        node_corner, corner_next = self._corners()
+        mesh_local.vertex_normals(self.pos, self.faces(), node_corner, corner_next,
+                                  self._everything(), self.n_verts, normals)
+
+    cpdef void calculate_defect(self, double[:] defect) except *:
+        node_corner, corner_next = self._corners()
+        offsets, _ = self._csr()
+        mesh_local.vertex_defects(self.pos, self.faces(), node_corner, corner_next,
+                                  self._everything(), self.n_verts, offsets, defect)
+
+    cpdef void calculate_curvature(self, double[:, ::1] normals, double[:] curvature) except *:
+        offsets, indices = self._csr()
+        mesh_local.vertex_curvature(self.pos, normals, offsets, indices, self._everything(),
+                                    self.n_verts, curvature)
+
+    cpdef void relax(self, double[:, ::1] normals, double amount=0.5) except *:
+        """ Move every vertex toward the centroid of its neighbors within its
+            tangent plane.
+        """
+        offsets, indices = self._csr()
+        mesh_local.relax_region(self.pos, normals, offsets, indices, self._everything(),
+                                self.n_verts, amount, np.zeros((self.n_verts, 3)))
+
+    cpdef bint flip(self, int h) except *:
+        """ Replace the edge of h by the other diagonal of its two faces.
+            Returns False on the boundary or when the diagonal already exists.
+        """
+        cdef int t = self.he_twin[h]
+        if t == -1:
+            return False
+
+        cdef int fh = 3 * (h // 3)
+        cdef int ft = 3 * (t // 3)
+        cdef int hn = self.he_next[h]
+        cdef int hp = prev_he(h)
+        cdef int tn = self.he_next[t]
+        cdef int tp = prev_he(t)
+        cdef int a = self.he_vert[h]
+        cdef int b = self.he_vert[t]
+        cdef int c = self.he_vert[hp]
+        cdef int d = self.he_vert[tp]
+        if c == d or d in self.neighbors(c):
+            return False
+
+        # Twins across the outside of the quad a, d, b, c.
+        cdef int t_ca = self.he_twin[hp]
+        cdef int t_ad = self.he_twin[tn]
+        cdef int t_db = self.he_twin[tp]
+        cdef int t_bc = self.he_twin[hn]
+
+        # The faces become (c, a, d) and (d, b, c).
+        self.set_he(fh, c, t_ca)
+        self.set_he(fh+1, a, t_ad)
+        self.set_he(fh+2, d, ft+2)
+        self.set_he(ft, d, t_db)
+        self.set_he(ft+1, b, t_bc)
+        self.set_he(ft+2, c, fh+2)
+        self.face_he[fh // 3] = fh
+        self.face_he[ft // 3] = ft
+        self.vert_he[a] = fh+1
+        self.vert_he[b] = ft+1
+        self.vert_he[c] = fh
+        self.vert_he[d] = ft
+        return True
+
+    cdef void set_he(self, int h, int vert, int twin):
+        self.he_vert[h] = vert
+        self.he_twin[h] = twin
+        if twin != -1:
+            self.he_twin[twin] = h
+
+    cpdef int split(self, int f) except -2:
+        """ Split face f at its centroid into three faces and flip its old
+            edges, the adaptive step of sqrt(3) subdivision. f keeps its id
+            and two faces are appended. Returns the new vertex id, or -1 if
+            the mesh has max_verts vertices.
+        """
+        if self.n_verts == self.max_verts:
+            return -1
+        self.reserve(self.n_faces + 2)
+
+        cdef int k
+        cdef int h0 = 3*f
+        cdef int f1 = 3*self.n_faces
+        cdef int f2 = f1 + 3
+        cdef int a = self.he_vert[h0]
+        cdef int b = self.he_vert[h0+1]
+        cdef int c = self.he_vert[h0+2]
+        cdef int t_bc = self.he_twin[h0+1]
+        cdef int t_ca = self.he_twin[h0+2]
+        cdef int m = self.n_verts
+
+        for k in range(3):
+            self.pos[m, k] = (self.pos[a, k] + self.pos[b, k] + self.pos[c, k]) / 3
+
+        for k in range(3):
+            self.he_next[f1+k] = f1 + (k+1) % 3
+            self.he_next[f2+k] = f2 + (k+1) % 3
+            self.he_face[f1+k] = self.n_faces
+            self.he_face[f2+k] = self.n_faces + 1
+
+        # (a, b, m), (b, c, m) and (c, a, m).
+        self.set_he(h0+1, b, f1+2)
+        self.set_he(h0+2, m, f2+1)
+        self.set_he(f1, b, t_bc)
+        self.set_he(f1+1, c, f2+2)
+        self.set_he(f1+2, m, h0+1)
+        self.set_he(f2, c, t_ca)
+        self.set_he(f2+1, a, h0+2)
+        self.set_he(f2+2, m, f1+1)
+        self.face_he[self.n_faces] = f1
+        self.face_he[self.n_faces+1] = f2
+        self.vert_he[a] = h0
+        self.vert_he[b] = f1
+        self.vert_he[c] = f2
+        self.vert_he[m] = h0+2
+        self.n_faces += 2
+        self.n_verts += 1
+        self.n_edges += 3
+
+        self.flip(h0)
+        self.flip(f1)
+        self.flip(f2)
+        return m
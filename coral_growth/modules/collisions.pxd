@@ -5,8 +5,16 @@ cdef class MeshCollisionManager:
     cdef public double[:,:] vertices, normals
     cdef public double blocksize, r
     cdef public int[:,:] particles
-    cdef public object grid
+    cdef public int[:] bucket, next, prev, head
+    cdef public unsigned int mask
 
     cpdef int[:] getIndices(self, double[:] p) except *
+    cdef void insert(self, int vid, int x, int y, int z) noexcept nogil
+    cdef void remove(self, int vid) noexcept nogil
     cpdef void newVert(self, Vert vert) except *
-    cpdef bint attemptVertUpdate(self, Vert vert, double[:] p) except *
+    cpdef void newNode(self, int vid) except *
+    cdef bint attempt(self, int vid, double[:] p, int[:] neighbors, int n_start,
+                      int n_end) noexcept nogil
+    cpdef bint attemptVertUpdate(self, Vert vert, double[:] p, int[:] neighbors) except *
+    cpdef int attemptUpdates(self, double[:, :] positions, int n, int[:] offsets,
+                             int[:] indices) except -1
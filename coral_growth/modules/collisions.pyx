@@ -5,21 +5,37 @@
 # cython: cdivision=True
 from __future__ import print_function
 from libc.math cimport sqrt, floor, fmin
-from collections import defaultdict
 from cymesh.structures cimport Vert
-from cymesh.vector3D cimport dot, vdist, vsub
 import numpy as np
 cimport numpy as np
 
+cdef inline unsigned int cell_hash(int x, int y, int z, unsigned int mask) noexcept nogil:
+    return ((<unsigned int>x * 73856093u) ^ (<unsigned int>y * 19349663u) ^ \
+            (<unsigned int>z * 83492791u)) & mask
+
 cdef class MeshCollisionManager:
+    """ A spatial hash of vertices with cells the size of a vertex. Each
+        vertex is in a doubly linked list of the vertices hashed to the same
+        bucket, stored as int arrays indexed by vertex id.
+    """
     def __init__(self, mesh, vertices, normals, r=1):
         self.mesh = mesh
         self.vertices = vertices
         self.normals = normals
         self.blocksize = 2*r
         self.r = r
-        self.particles = np.zeros((vertices.shape[0], 3), dtype='int32')
-        self.grid = defaultdict(set)
+
+        cdef int n = vertices.shape[0]
+        cdef unsigned int n_buckets = 1
+        while n_buckets < 2*n:
+            n_buckets *= 2
+
+        self.mask = n_buckets - 1
+        self.particles = np.zeros((n, 3), dtype='int32')
+        self.bucket = np.full(n, -1, dtype='int32')
+        self.next = np.full(n, -1, dtype='int32')
+        self.prev = np.full(n, -1, dtype='int32')
+        self.head = np.full(n_buckets, -1, dtype='int32')
 
     cpdef int[:] getIndices(self, double[:] p) except *:
         """ Map the floating point position into voxel space.
@@ -30,50 +46,110 @@ cdef class MeshCollisionManager:
         indices[2] = <int>(floor((p[2]) / self.blocksize))
         return indices
 
+    cdef void insert(self, int vid, int x, int y, int z) noexcept nogil:
+        cdef int b = cell_hash(x, y, z, self.mask)
+        self.particles[vid, 0] = x
+        self.particles[vid, 1] = y
+        self.particles[vid, 2] = z
+        self.bucket[vid] = b
+        self.prev[vid] = -1
+        self.next[vid] = self.head[b]
+        if self.head[b] != -1:
+            self.prev[self.head[b]] = vid
+        self.head[b] = vid
+
+    cdef void remove(self, int vid) noexcept nogil:
+        if self.prev[vid] != -1:
+            self.next[self.prev[vid]] = self.next[vid]
+        else:
+            self.head[self.bucket[vid]] = self.next[vid]
+        if self.next[vid] != -1:
+            self.prev[self.next[vid]] = self.prev[vid]
+        self.bucket[vid] = -1
+
     cpdef void newVert(self, Vert vert) except *:
-        cdef int[:] ind = self.getIndices(vert.p)
-        self.grid[ (ind[0], ind[1], ind[2]) ].add( vert.id )
-        self.particles[vert.id, 0] = ind[0]
-        self.particles[vert.id, 1] = ind[1]
-        self.particles[vert.id, 2] = ind[1]
-
-    cpdef bint attemptVertUpdate(self, Vert vert, double[:] p) except *:
-        """ Update if it does not collide and return True, else False
+        cdef double bs = self.blocksize
+        self.insert(vert.id, <int>floor(vert.p[0] / bs), <int>floor(vert.p[1] / bs),
+                    <int>floor(vert.p[2] / bs))
+
+    cpdef void newNode(self, int vid) except *:
+        """ Insert vertex vid at its row of vertices. """
+        cdef double bs = self.blocksize
+        self.insert(vid, <int>floor(self.vertices[vid, 0] / bs),
+                    <int>floor(self.vertices[vid, 1] / bs), <int>floor(self.vertices[vid, 2] / bs))
+
+    cdef bint attempt(self, int vid, double[:] p, int[:] neighbors, int n_start,
+                      int n_end) noexcept nogil:
+        """ Move vertex vid to p unless it would collide with a vertex in front
+            of it. Vertices neighbors[n_start:n_end] are adjacent and ignored.
         """
-        cdef int ix, iy, iz, id_other
-        cdef double dist
-        cdef set block
-        cdef int vid = vert.id
-        cdef list neighbors = [v.id for v in vert.neighbors()]
-        cdef int[:] old_ind = self.particles[vert.id]
-        cdef int[:] new_ind = self.getIndices(p)
-        cdef double[:] temp = np.zeros(3)
-
-        for ix in range(new_ind[0]-1, new_ind[0]+2):
-            for iy in range(new_ind[1]-1, new_ind[1]+2):
-                for iz in range(new_ind[2]-1, new_ind[2]+2):
-                    block = self.grid.get((ix, iy, iz), None)
-                    if block is None:
-                        continue
-
-                    for id_other in block:
-                        if vid == id_other or id_other in neighbors:
+        cdef int ix, iy, iz, id_other, k
+        cdef bint is_neighbor
+        cdef double dx, dy, dz
+        cdef double bs = self.blocksize
+        cdef int nx = <int>floor(p[0] / bs)
+        cdef int ny = <int>floor(p[1] / bs)
+        cdef int nz = <int>floor(p[2] / bs)
+
+        for ix in range(nx-1, nx+2):
+            for iy in range(ny-1, ny+2):
+                for iz in range(nz-1, nz+2):
+                    id_other = self.head[cell_hash(ix, iy, iz, self.mask)]
+
+                    while id_other != -1:
+                        # Buckets are shared by hash collisions, only look at this cell.
+                        if id_other == vid or self.particles[id_other, 0] != ix or \
+                           self.particles[id_other, 1] != iy or \
+                           self.particles[id_other, 2] != iz:
+                            id_other = self.next[id_other]
                             continue
-                        dist = vdist(p, self.vertices[id_other])
-                        if dist <= self.blocksize:
-                            # Do a check that one is in front of the other and not behind.
-                            vsub(temp, self.vertices[id_other], p)
-                            if dot(temp, self.normals[vid]) > 0:
-                                return False
+
+                        is_neighbor = False
+                        for k in range(n_start, n_end):
+                            if neighbors[k] == id_other:
+                                is_neighbor = True
+                                break
+
+                        if not is_neighbor:
+                            dx = self.vertices[id_other, 0] - p[0]
+                            dy = self.vertices[id_other, 1] - p[1]
+                            dz = self.vertices[id_other, 2] - p[2]
+                            if sqrt(dx*dx + dy*dy + dz*dz) <= bs:
+                                # Do a check that one is in front of the other and not behind.
+                                if dx*self.normals[vid, 0] + dy*self.normals[vid, 1] + \
+                                   dz*self.normals[vid, 2] > 0:
+                                    return False
+
+                        id_other = self.next[id_other]
 
         # Accept the update.
-        vert.p[:] = p
-        self.particles[vid, 0] = new_ind[0]
-        self.particles[vid, 1] = new_ind[1]
-        self.particles[vid, 2] = new_ind[2]
+        self.vertices[vid, 0] = p[0]
+        self.vertices[vid, 1] = p[1]
+        self.vertices[vid, 2] = p[2]
 
-        if old_ind[0] != new_ind[0] or old_ind[1] != new_ind[1] or old_ind[2] != new_ind[2]:
-            self.grid[(old_ind[0], old_ind[1], old_ind[2])].remove(vid)
-            self.grid[(new_ind[0], new_ind[1], new_ind[2])].add(vid)
+        if self.particles[vid, 0] != nx or self.particles[vid, 1] != ny or \
+           self.particles[vid, 2] != nz:
+            self.remove(vid)
+            self.insert(vid, nx, ny, nz)
 
         return True
+
+    cpdef bint attemptVertUpdate(self, Vert vert, double[:] p, int[:] neighbors) except *:
+        """ Update if it does not collide and return True, else False.
+            neighbors are the ids of the verts adjacent to vert, they never collide.
+        """
+        return self.attempt(vert.id, p, neighbors, 0, neighbors.shape[0])
+
+    cpdef int attemptUpdates(self, double[:, :] positions, int n, int[:] offsets,
+                             int[:] indices) except -1:
+        """ Attempt to move every vertex i < n to positions[i], in order. The
+            neighbors of vertex i are indices[offsets[i]:offsets[i+1]].
+            Returns the number of accepted updates.
+        """
+        cdef int i
+        cdef int n_accepted = 0
+        with nogil:
+            for i in range(n):
+                if self.attempt(i, positions[i], indices, offsets[i], offsets[i+1]):
+                    n_accepted += 1
+        return n_accepted
@@ -8,7 +8,6 @@ from libc.math cimport round, floor
 import numpy as np
 cimport numpy as np
 
-from minheap import MinHeap
 from coral_growth.growth_form cimport GrowthForm
 
 cdef int[:,:] neighbors = np.array([[-1, 0, 0], [1, 0, 0], [0, 1, 0],
@@ -71,8 +70,108 @@ cdef list reconstruct_path(int[:,:,:,:] came_from, int[:] start, int[:] goal):
     path.reverse()
     return path
 
-cpdef tuple dijkstra_search(int[:,:,:] grid, float[:,:,:] cost_grid, int startx):
-    cdef int pid
+cdef class PathSearch:
+    """ Buffers for dijkstra_search kept between calls: the came_from and
+        cost_so_far grids and an indexed binary min-heap of voxel ids with
+        their price (heap_ids, heap_price, and heap_pos, the slot of each
+        voxel in the heap or -1).
+    """
+    cdef public int[:,:,:,:] came_from
+    cdef public float[:,:,:] cost_so_far
+    cdef public int[:] heap_ids, heap_pos
+    cdef public float[:] heap_price
+    cdef public int heap_size
+
+    def __init__(self):
+        self.came_from = np.zeros((0, 0, 0, 3), dtype='int32')
+        self.cost_so_far = np.zeros((0, 0, 0), dtype='float32')
+        self.heap_ids = np.zeros(0, dtype='int32')
+        self.heap_pos = np.zeros(0, dtype='int32')
+        self.heap_price = np.zeros(0, dtype='float32')
+        self.heap_size = 0
+
+    cpdef void reset(self, int nx, int ny, int nz) except *:
+        """ Zero the buffers for an nx*ny*nz grid, reallocating on a new size. """
+        cdef int n = nx * ny * nz
+        if self.cost_so_far.shape[0] != nx or self.cost_so_far.shape[1] != ny or \
+           self.cost_so_far.shape[2] != nz:
+            self.came_from = np.zeros((nx, ny, nz, 3), dtype='int32')
+            self.cost_so_far = np.zeros((nx, ny, nz), dtype='float32')
+            self.heap_ids = np.zeros(n, dtype='int32')
+            self.heap_pos = np.full(n, -1, dtype='int32')
+            self.heap_price = np.zeros(n, dtype='float32')
+        else:
+            np.asarray(self.came_from)[:] = 0
+            np.asarray(self.cost_so_far)[:] = 0
+            np.asarray(self.heap_pos)[:] = -1
+        self.heap_size = 0
+
+    cdef void sift_up(self, int i) noexcept nogil:
+        cdef int parent
+        cdef int pid = self.heap_ids[i]
+        cdef float price = self.heap_price[i]
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.heap_price[parent] <= price:
+                break
+            self.heap_ids[i] = self.heap_ids[parent]
+            self.heap_price[i] = self.heap_price[parent]
+            self.heap_pos[self.heap_ids[i]] = i
+            i = parent
+        self.heap_ids[i] = pid
+        self.heap_price[i] = price
+        self.heap_pos[pid] = i
+
+    cdef void push(self, int pid, float price) noexcept nogil:
+        """ Add pid to the heap or lower its price if it is already in it. """
+        cdef int i = self.heap_pos[pid]
+        if i == -1:
+            i = self.heap_size
+            self.heap_size += 1
+        elif price >= self.heap_price[i]:
+            return
+        self.heap_ids[i] = pid
+        self.heap_price[i] = price
+        self.sift_up(i)
+
+    cdef int pop(self) noexcept nogil:
+        """ Remove and return the id with the lowest price. """
+        cdef int i = 0, child
+        cdef int top = self.heap_ids[0]
+        cdef int pid
+        cdef float price
+        self.heap_pos[top] = -1
+        self.heap_size -= 1
+        if self.heap_size == 0:
+            return top
+
+        pid = self.heap_ids[self.heap_size]
+        price = self.heap_price[self.heap_size]
+        while True:
+            child = 2*i + 1
+            if child >= self.heap_size:
+                break
+            if child + 1 < self.heap_size and \
+               self.heap_price[child+1] < self.heap_price[child]:
+                child += 1
+            if self.heap_price[child] >= price:
+                break
+            self.heap_ids[i] = self.heap_ids[child]
+            self.heap_price[i] = self.heap_price[child]
+            self.heap_pos[self.heap_ids[i]] = i
+            i = child
+        self.heap_ids[i] = pid
+        self.heap_price[i] = price
+        self.heap_pos[pid] = i
+        return top
+
+cpdef tuple dijkstra_search(int[:,:,:] grid, float[:,:,:] cost_grid, int startx,
+                            PathSearch search=None):
+    """ Cheapest paths through the empty voxels from every voxel of the
+        plane x=startx. Returns the came_from and cost_so_far grids, which
+        are the buffers of search when one is given.
+    """
+    cdef int pid, i
     cdef float new_cost
     cdef int x, y, z, x2, y2, z2
     cdef int nx = grid.shape[0]
@@ -80,57 +179,57 @@ cpdef tuple dijkstra_search(int[:,:,:] grid, float[:,:,:] cost_grid, int startx)
     cdef int nz = grid.shape[2]
     cdef int nynz = ny*nz
 
-    frontier = MinHeap()
-    cdef int[:,:,:,:] came_from = np.zeros((nx, ny, nz, 3), dtype='int32')
-    cdef float[:,:,:] cost_so_far = np.zeros_like(grid, dtype='float32')
-
-    for y in range(ny):
-        for z in range(nz):
-            pid = startx*nynz + y*nz + z
-            frontier.push({"id": pid, "price": 0})
-            came_from[startx, y, z, 0] = -1
-            came_from[startx, y, z, 1] = -1
-            came_from[startx, y, z, 2] = -1
-            cost_so_far[startx, y, z] = 1.0
-
-    while True:
-        try:
-            pid = frontier.pop()['id']
+    if search is None:
+        search = PathSearch()
+    search.reset(nx, ny, nz)
+    cdef int[:,:,:,:] came_from = search.came_from
+    cdef float[:,:,:] cost_so_far = search.cost_so_far
+
+    with nogil:
+        for y in range(ny):
+            for z in range(nz):
+                pid = startx*nynz + y*nz + z
+                search.push(pid, 0)
+                came_from[startx, y, z, 0] = -1
+                came_from[startx, y, z, 1] = -1
+                came_from[startx, y, z, 2] = -1
+                cost_so_far[startx, y, z] = 1.0
+
+        while search.heap_size > 0:
+            pid = search.pop()
             x = pid // (nynz)
             y = (pid-x*(nynz)) // nz
             z = pid % nz
 
-        except IndexError:
-            break
-
-        for i in range(6):
-            x2 = x + neighbors[i, 0]
-            y2 = y + neighbors[i, 1]
-            z2 = z + neighbors[i, 2]
+            for i in range(6):
+                x2 = x + neighbors[i, 0]
+                y2 = y + neighbors[i, 1]
+                z2 = z + neighbors[i, 2]
 
-            if x2<0 or y2<0 or z2<0 or x2>nx-1 or y2>ny-1 or z2>nz-1:
-                continue
+                if x2<0 or y2<0 or z2<0 or x2>nx-1 or y2>ny-1 or z2>nz-1:
+                    continue
 
-            if grid[x2, y2, z2] == 1:
-                continue
+                if grid[x2, y2, z2] == 1:
+                    continue
 
-            new_cost = cost_so_far[x, y, z] + cost_grid[x2, y2, z2]
-            if cost_so_far[x2, y2, z2] == 0 or new_cost < cost_so_far[x2, y2, z2]:
-                cost_so_far[x2, y2, z2] = new_cost
-                frontier.push({"id":(x2*nynz)+(y2*nz)+z2, "price": new_cost})
-                came_from[x2, y2, z2, 0] = x
-                came_from[x2, y2, z2, 1] = y
-                came_from[x2, y2, z2, 2] = z
+                new_cost = cost_so_far[x, y, z] + cost_grid[x2, y2, z2]
+                if cost_so_far[x2, y2, z2] == 0 or new_cost < cost_so_far[x2, y2, z2]:
+                    cost_so_far[x2, y2, z2] = new_cost
+                    search.push((x2*nynz)+(y2*nz)+z2, new_cost)
+                    came_from[x2, y2, z2, 0] = x
+                    came_from[x2, y2, z2, 1] = y
+                    came_from[x2, y2, z2, 2] = z
 
     return came_from, cost_so_far
 
 cpdef tuple create_voxel_grid(GrowthForm coral):
-    cdef int i, vx, vy, vz
-    cpdef double[:] p
+    cdef int i, f, k, a, b, c, vx, vy, vz
+    cdef double mid[3]
 
     # Cast coral objects for fast access.
     cdef double voxel_length = coral.voxel_length
     cdef double[:,:] node_pos = coral.node_pos
+    cdef int[:, ::1] face_verts = coral.face_verts
 
     # Map each node to its voxel positions. This contains negatives at first.
     cdef int [:,:] node_voxel = np.zeros((coral.n_nodes, 3), dtype='int32')
@@ -155,11 +254,15 @@ cpdef tuple create_voxel_grid(GrowthForm coral):
     for i in range(coral.n_nodes):
         voxel_grid[node_voxel[i,0], node_voxel[i,1], node_voxel[i,2]] = 1
 
-    for face in coral.mesh.faces:
-        p = face.midpoint()
-        vx = <int>(floor(p[0] / voxel_length)) - min_v[0] + offset[0]
-        vy = <int>(floor(p[1] / voxel_length)) - min_v[1] + offset[1]
-        vz = <int>(floor(p[2] / voxel_length)) - min_v[2] + offset[2]
+    for f in range(coral.n_faces):
+        a = face_verts[f, 0]
+        b = face_verts[f, 1]
+        c = face_verts[f, 2]
+        for k in range(3):
+            mid[k] = (node_pos[a, k] + node_pos[b, k] + node_pos[c, k]) / 3
+        vx = <int>(floor(mid[0] / voxel_length)) - min_v[0] + offset[0]
+        vy = <int>(floor(mid[1] / voxel_length)) - min_v[1] + offset[1]
+        vz = <int>(floor(mid[2] / voxel_length)) - min_v[2] + offset[2]
         voxel_grid[vx, vy, vz] = 1
 
     return node_voxel, voxel_grid, (np.array(min_v) - offset)
@@ -194,6 +297,7 @@ cpdef tuple calculate_collectionx(int[:,:,:] grid, int n_iters, float collection
     cdef int[:] path_end = np.zeros(3, dtype='i')
     cdef int[:,:,:,:] came_from
     cdef float[:,:,:] cost_so_far
+    cdef PathSearch search = PathSearch()
 
     cdef int startx = (nx-1 if reverse else 0)
 
@@ -204,7 +308,7 @@ cpdef tuple calculate_collectionx(int[:,:,:] grid, int n_iters, float collection
                 for z in range(nz):
                     cost[x, y, z] = 1 + (travel_sum[x, y, z] / (i+1))
 
-        came_from, cost_so_far = dijkstra_search(grid, cost, startx)
+        came_from, cost_so_far = dijkstra_search(grid, cost, startx, search)
 
         # Go along the paths and calculate flow and resources
         for y in range(ny):
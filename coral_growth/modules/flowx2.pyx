@@ -4,59 +4,124 @@
 # cython: nonecheck=False
 # cython: cdivision=True
 from libc.math cimport sqrt
+from cython.parallel cimport prange
 import numpy as np
 cimport numpy as np
+from coral_growth.modules.threads cimport get_threads
 
 ctypedef unsigned char uint8
 
-cdef int[:,:] neighbors = np.array([[-1, 0, 0], [1, 0, 0], [0, 1, 0],
-                                    [0, -1, 0], [0, 0, -1], [0, 0, 1]], dtype='int32')
-
-cpdef uint8[:,:,:] flood_fill(uint8[:,:,:] grid) except *:
-    cdef int x, y, z, x2, y2, z2, i
+cdef class FloodFillWorkspace:
+    """ Buffers for flood_fill that are kept between calls and only grow: a
+        bit per voxel that is set once it is solid or queued, the int32
+        queue of voxel indices and the result grid.
+    """
+    cdef public np.uint64_t[:] mask
+    cdef public int[:] queue
+    cdef public uint8[:] result
+
+    def __init__(self, int n_voxels=0):
+        self.mask = np.zeros(0, dtype='uint64')
+        self.queue = np.zeros(0, dtype='int32')
+        self.result = np.zeros(0, dtype='uint8')
+        self.reserve(n_voxels)
+
+    cpdef void reserve(self, int n_voxels) except *:
+        if self.queue.shape[0] >= n_voxels:
+            return
+        n_voxels = max(n_voxels, 3 * self.queue.shape[0] // 2)
+        self.mask = np.zeros((n_voxels + 63) // 64, dtype='uint64')
+        self.queue = np.zeros(n_voxels, dtype='int32')
+        self.result = np.zeros(n_voxels, dtype='uint8')
+
+cdef inline bint test_and_set(np.uint64_t[:] mask, int idx) noexcept nogil:
+    """ Set the bit of idx and return if it was already set. """
+    cdef np.uint64_t bit = (<np.uint64_t>1) << (idx & 63)
+    if mask[idx >> 6] & bit:
+        return True
+    mask[idx >> 6] |= bit
+    return False
+
+cdef void flood_fill_kernel(uint8[:,:,:] grid, np.uint64_t[:] mask, int[:] queue,
+                            uint8[:] result) noexcept nogil:
+    """ Breadth first fill of the empty voxels connected to (0, 0, 0). Every
+        voxel is queued at most once, so the queue never wraps.
+    """
     cdef int nx = grid.shape[0]
     cdef int ny = grid.shape[1]
     cdef int nz = grid.shape[2]
-    cdef uint8[:,:,:] seen = np.zeros_like(grid)
-    cdef uint8[:,:,:] result = np.zeros_like(grid)
-    cdef list current = [(0, 0, 0)]
-
-    while current:
-        x, y, z = current.pop()
-        seen[x, y, z] = 1
-
-        if not grid[x, y, z]:
-            result[x, y, z] = 1
-
-            for i in range(neighbors.shape[0]):
-                x2 = x + neighbors[i, 0]
-                y2 = y + neighbors[i, 1]
-                z2 = z + neighbors[i, 2]
-
-                if x2<0 or y2<0 or z2<0 or x2>nx-1 or y2>ny-1 or z2>nz-1:
-                    continue
-
-                if seen[x2, y2, z2]:
-                    continue
-
-                current.append((x2, y2, z2))
-    return result
-
-cpdef void calculate_collection(double[:] collection, int[:,:] voxels,\
-                                uint8[:,:,:] voxel_grid, int radius = 3) except *:
-    cdef int i, x, y, z, dx, dy, dz, x2, y2, z2, d
-    cdef float v
-    cdef float total = float((2*radius+1)**3)
-    cdef int nx = voxel_grid.shape[0]
-    cdef int ny = voxel_grid.shape[1]
-    cdef int nz = voxel_grid.shape[2]
-    cdef uint8[:,:,:] outside = flood_fill(voxel_grid)
-    cdef float[:,:,:] counts = np.zeros_like(voxel_grid, dtype='float32')
-
-    ### Create a 3D kernel
+    cdef int n = nx * ny * nz
+    cdef int x, y, z, idx, yz
+    cdef int head = 0, tail = 0
+
+    for idx in range((n + 63) // 64):
+        mask[idx] = 0
+
+    # Solid voxels start out set so they are never queued.
+    idx = 0
+    for x in range(nx):
+        for y in range(ny):
+            for z in range(nz):
+                result[idx] = 0
+                if grid[x, y, z]:
+                    mask[idx >> 6] |= (<np.uint64_t>1) << (idx & 63)
+                idx += 1
+
+    if n == 0 or test_and_set(mask, 0):
+        return
+    queue[tail] = 0
+    tail += 1
+
+    while head < tail:
+        idx = queue[head]
+        head += 1
+        result[idx] = 1
+
+        z = idx % nz
+        yz = idx // nz
+        y = yz % ny
+        x = yz // ny
+
+        if x > 0 and not test_and_set(mask, idx - ny*nz):
+            queue[tail] = idx - ny*nz
+            tail += 1
+        if x < nx-1 and not test_and_set(mask, idx + ny*nz):
+            queue[tail] = idx + ny*nz
+            tail += 1
+        if y > 0 and not test_and_set(mask, idx - nz):
+            queue[tail] = idx - nz
+            tail += 1
+        if y < ny-1 and not test_and_set(mask, idx + nz):
+            queue[tail] = idx + nz
+            tail += 1
+        if z > 0 and not test_and_set(mask, idx - 1):
+            queue[tail] = idx - 1
+            tail += 1
+        if z < nz-1 and not test_and_set(mask, idx + 1):
+            queue[tail] = idx + 1
+            tail += 1
+
+cpdef uint8[:,:,:] flood_fill(uint8[:,:,:] grid, FloodFillWorkspace workspace=None) except *:
+    """ Mark the empty voxels connected to the corner (0, 0, 0) with 1. With
+        a workspace the result is a view of its buffer, valid until the
+        workspace is used again.
+    """
+    cdef int n = grid.shape[0] * grid.shape[1] * grid.shape[2]
+    if workspace is None:
+        workspace = FloodFillWorkspace(n)
+    else:
+        workspace.reserve(n)
+
+    with nogil:
+        flood_fill_kernel(grid, workspace.mask, workspace.queue, workspace.result)
+
+    return np.asarray(workspace.result[:n]).reshape(grid.shape[0], grid.shape[1], grid.shape[2])
+
+cpdef np.ndarray sphere_kernel(int radius):
+    """ The (2r+1)^3 kernel of voxels within radius of the center. """
+    cdef int x, y, z, dx, dy, dz, d
     cdef int w = (2*radius)+1
     cdef float[:,:,:] kernel = np.zeros((w, w, w), dtype='float32')
-    cdef int r2 = radius * radius
 
     for x in range(w):
         for y in range(w):
@@ -69,6 +134,38 @@ cpdef void calculate_collection(double[:] collection, int[:,:] voxels,\
                     kernel[x, y, z] = 1.0
                     # kernel[x, y, z] = 1.0 / (1 + d / radius)
 
+    return np.asarray(kernel)
+
+cpdef void calculate_collection(double[:] collection, int[:,:] voxels,\
+                                uint8[:,:,:] voxel_grid, int radius = 3,
+                                FloodFillWorkspace workspace=None,
+                                bint convolve=False) except *:
+    """ The collection of each node voxel is how much of the outside water
+        within radius it gets, where each water voxel is shared between the
+        nodes that reach it. With convolve the per-node kernel loops are
+        replaced by two FFT convolutions of the whole grid, so the cost no
+        longer depends on the radius.
+    """
+    cdef int i, x, y, z, dx, dy, dz, x2, y2, z2
+    cdef float v
+    cdef float total = float((2*radius+1)**3)
+    cdef int nx = voxel_grid.shape[0]
+    cdef int ny = voxel_grid.shape[1]
+    cdef int nz = voxel_grid.shape[2]
+    cdef uint8[:,:,:] outside = flood_fill(voxel_grid, workspace)
+    cdef float[:,:,:] counts
+
+    ### Create a 3D kernel
+    cdef int w = (2*radius)+1
+    cdef float[:,:,:] kernel = sphere_kernel(radius)
+
+    if convolve:
+        calculate_collection_convolve(collection, voxels, np.asarray(outside),
+                                      np.asarray(kernel), radius)
+        return
+
+    counts = np.zeros_like(voxel_grid, dtype='float32')
+
     # np.set_printoptions(linewidth=100, threshold=9999999)
     # print(np.array(kernel).astype('uint8'))
 
@@ -86,7 +183,9 @@ cpdef void calculate_collection(double[:] collection, int[:,:] voxels,\
                     if x2>=0 and y2>=0 and z2>=0 and x2<nx-1 and y2<ny-1 and z2<nz-1:
                         counts[ x2, y2, z2 ] += kernel[ dx, dy, dz ]
 
-    for i in range(voxels.shape[0]):
+    # Each node only reads the grid, so nodes are gathered in parallel.
+    for i in prange(voxels.shape[0], nogil=True, num_threads=get_threads(),
+                    schedule='static'):
         x = voxels[i, 0]
         y = voxels[i, 1]
         z = voxels[i, 2]
@@ -98,7 +197,47 @@ cpdef void calculate_collection(double[:] collection, int[:,:] voxels,\
                     y2 = y + dy - radius
                     z2 = z + dz - radius
                     if x2>=0 and y2>=0 and z2>=0 and x2<nx-1 and y2<ny-1 and z2<nz-1:
-                        v += kernel[ dx, dy, dz ] * outside[ x2, y2, z2 ] / (1 + counts[ x2, y2, z2])
+                        v = v + kernel[ dx, dy, dz ] * outside[ x2, y2, z2 ] / \
+                                (1 + counts[ x2, y2, z2])
 
         collection[i] = v / total
 
+cdef np.ndarray convolve_same(np.ndarray grid, np.ndarray kernel_fft, tuple shape, int radius):
+    """ Convolve grid with a (2r+1)^3 kernel given by its FFT at 'shape' and
+        crop the result back to the size of grid.
+    """
+    full = np.fft.irfftn(np.fft.rfftn(grid, shape, axes=(0, 1, 2)) * kernel_fft, shape,
+                         axes=(0, 1, 2))
+    return full[radius:radius+grid.shape[0], radius:radius+grid.shape[1],
+                radius:radius+grid.shape[2]]
+
+cdef void calculate_collection_convolve(double[:] collection, int[:,:] voxels,
+                                        np.ndarray outside, np.ndarray kernel,
+                                        int radius) except *:
+    """ calculate_collection with the two kernel loops done as convolutions
+        of the grid (the kernel is symmetric, so gathering is convolving).
+        Only voxels in [0, n-1) on each axis take part, as in the loops.
+    """
+    cdef int i
+    cdef double total = float((2*radius+1)**3)
+    cdef int nx = outside.shape[0]
+    cdef int ny = outside.shape[1]
+    cdef int nz = outside.shape[2]
+    shape = (nx + 2*radius, ny + 2*radius, nz + 2*radius)
+    kernel_fft = np.fft.rfftn(kernel, shape, axes=(0, 1, 2))
+
+    # How many node kernels reach each voxel.
+    occupancy = np.zeros((nx, ny, nz))
+    np.add.at(occupancy, (np.asarray(voxels[:, 0]), np.asarray(voxels[:, 1]),
+                          np.asarray(voxels[:, 2])), 1)
+    counts = np.rint(convolve_same(occupancy, kernel_fft, shape, radius))
+
+    # Each outside voxel split between the nodes that reach it.
+    share = outside / (1.0 + counts)
+    share[nx-1, :, :] = 0
+    share[:, ny-1, :] = 0
+    share[:, :, nz-1] = 0
+    cdef double[:,:,:] gathered = convolve_same(share, kernel_fft, shape, radius)
+
+    for i in range(voxels.shape[0]):
+        collection[i] = gathered[voxels[i, 0], voxels[i, 1], voxels[i, 2]] / total
@@ -0,0 +1,218 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+""" A D3Q19 lattice-Boltzmann model of water flowing past a coral, as an
+    alternative to the exposure and path based collection models.
+"""
+from libc.math cimport sqrt
+import numpy as np
+cimport numpy as np
+
+ctypedef unsigned char uint8
+
+# Lattice velocities, their opposites and weights.
+cdef int[19][3] C = [[0, 0, 0],
+                     [1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1],
+                     [1, 1, 0], [-1, -1, 0], [1, -1, 0], [-1, 1, 0],
+                     [1, 0, 1], [-1, 0, -1], [1, 0, -1], [-1, 0, 1],
+                     [0, 1, 1], [0, -1, -1], [0, 1, -1], [0, -1, 1]]
+cdef int[19] OPPOSITE = [0, 2, 1, 4, 3, 6, 5, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15, 18, 17]
+cdef float[19] W = [1./3, 1./18, 1./18, 1./18, 1./18, 1./18, 1./18,
+                    1./36, 1./36, 1./36, 1./36, 1./36, 1./36,
+                    1./36, 1./36, 1./36, 1./36, 1./36, 1./36]
+
+# Water cells added around the voxel grid, below and above on each axis.
+cdef int[3] PAD_LOW = [8, 0, 4]
+cdef int[3] PAD_HIGH = [8, 8, 4]
+
+cdef inline void equilibrium(float *feq, float rho, float ux, float uy, float uz) noexcept nogil:
+    cdef int q
+    cdef float cu
+    cdef float usq = 1.5 * (ux*ux + uy*uy + uz*uz)
+    for q in range(19):
+        cu = 3 * (C[q][0]*ux + C[q][1]*uy + C[q][2]*uz)
+        feq[q] = W[q] * rho * (1 + cu + 0.5*cu*cu - usq)
+
+cdef object equilibrium_array(float rho, float ux, float uy, float uz):
+    cdef float[19] feq
+    equilibrium(feq, rho, ux, uy, uz)
+    return np.array([feq[q] for q in range(19)], dtype='float32')
+
+cdef class LatticeBoltzmann:
+    """ Water enters at x=0 (and the top) with speed velocity along x and
+        leaves at the far x side, z is periodic and the ground (y=0) and the
+        coral voxels are no-slip walls. The distributions are kept between
+        steps in absolute voxel coordinates, so after the coral grows a few
+        sweeps bring the field back to steady state.
+    """
+    cdef public int nx, ny, nz, n_sweeps
+    cdef public float velocity, tau
+    cdef public int[:] origin
+    cdef public float[:, :, :, ::1] f, f_next
+    cdef public uint8[:, :, ::1] solid
+    cdef public float[:, :, ::1] speed
+
+    def __init__(self, float velocity=0.05, float tau=0.6):
+        self.velocity = velocity
+        self.tau = tau
+        self.nx = self.ny = self.nz = 0
+        self.n_sweeps = 0
+        self.origin = np.zeros(3, dtype='int32')
+        self.f = np.zeros((0, 0, 0, 19), dtype='float32')
+        self.f_next = np.zeros((0, 0, 0, 19), dtype='float32')
+        self.solid = np.zeros((0, 0, 0), dtype='uint8')
+        self.speed = np.zeros((0, 0, 0), dtype='float32')
+
+    cpdef void set_grid(self, int[:, :, :] grid, grid_origin) except *:
+        """ Place the coral voxels (grid, whose cell 0 is at voxel grid_origin)
+            in the lattice. The lattice is resized around it and what
+            overlaps the previous lattice keeps its distributions. Water
+            where there was coral starts at rest.
+        """
+        cdef int axis
+        grid_shape = np.asarray(grid).shape
+        origin = np.asarray(grid_origin, dtype='int32') - np.array(PAD_LOW, dtype='int32')
+        shape = np.array(grid_shape) + np.array(PAD_LOW) + np.array(PAD_HIGH)
+        old_f = np.asarray(self.f)
+        old_solid = np.asarray(self.solid).astype(bool)
+        old_origin = np.asarray(self.origin)
+
+        if tuple(shape) != old_f.shape[:3] or (origin != old_origin).any():
+            new_f = np.empty((shape[0], shape[1], shape[2], 19), dtype='float32')
+            new_f[:] = equilibrium_array(1, self.velocity, 0, 0)
+            was_solid = np.zeros(shape, dtype=bool)
+
+            # Copy the overlap of the old and new lattice.
+            lo = np.maximum(origin, old_origin)
+            hi = np.minimum(origin + shape, old_origin + old_f.shape[:3])
+            if self.n_sweeps and (hi > lo).all():
+                a = []
+                b = []
+                for axis in range(3):
+                    a.append(slice(lo[axis] - origin[axis], hi[axis] - origin[axis]))
+                    b.append(slice(lo[axis] - old_origin[axis], hi[axis] - old_origin[axis]))
+                a = tuple(a)
+                b = tuple(b)
+                new_f[a] = old_f[b]
+                was_solid[a] = old_solid[b]
+
+            self.f = new_f
+            self.f_next = np.empty_like(new_f)
+            self.speed = np.zeros(shape, dtype='float32')
+            self.origin = origin
+            self.nx, self.ny, self.nz = shape
+        else:
+            was_solid = old_solid
+
+        solid = np.zeros(shape, dtype='uint8')
+        solid[PAD_LOW[0]:PAD_LOW[0]+grid_shape[0], PAD_LOW[1]:PAD_LOW[1]+grid_shape[1],
+              PAD_LOW[2]:PAD_LOW[2]+grid_shape[2]] = np.asarray(grid) != 0
+        self.solid = solid
+        np.asarray(self.f)[was_solid & (solid == 0)] = equilibrium_array(1, 0, 0, 0)
+
+    def get_state(self):
+        """ The arrays needed to continue the flow from where it is. """
+        return {
+            'f': np.asarray(self.f),
+            'solid': np.asarray(self.solid),
+            'origin': np.asarray(self.origin),
+            'n_sweeps': self.n_sweeps,
+        }
+
+    def set_state(self, state):
+        """ Continue from arrays returned by get_state. """
+        self.f = np.ascontiguousarray(state['f'], dtype='float32')
+        self.f_next = np.empty_like(self.f)
+        self.solid = np.ascontiguousarray(state['solid'], dtype='uint8')
+        self.origin = np.array(state['origin'], dtype='int32')
+        self.nx, self.ny, self.nz = np.asarray(self.solid).shape
+        self.speed = np.zeros((self.nx, self.ny, self.nz), dtype='float32')
+        self.n_sweeps = int(state['n_sweeps'])
+
+    cdef void sweep(self) noexcept nogil:
+        """ One fused stream (pull) and BGK collision from f into f_next. """
+        cdef int x, y, z, q, sx, sy, sz
+        cdef float rho, ux, uy, uz
+        cdef float omega = 1.0 / self.tau
+        cdef float[19] fq
+        cdef float[19] feq
+        cdef float[19] inflow
+        cdef int nx = self.nx, ny = self.ny, nz = self.nz
+        cdef float[:, :, :, ::1] f = self.f
+        cdef float[:, :, :, ::1] f_next = self.f_next
+        cdef uint8[:, :, ::1] solid = self.solid
+        cdef float[:, :, ::1] speed = self.speed
+        equilibrium(inflow, 1, self.velocity, 0, 0)
+
+        for x in range(nx):
+            for y in range(ny):
+                for z in range(nz):
+                    if solid[x, y, z]:
+                        speed[x, y, z] = 0
+                        continue
+
+                    for q in range(19):
+                        sx = x - C[q][0]
+                        sy = y - C[q][1]
+                        sz = z - C[q][2]
+                        if sz < 0:
+                            sz += nz
+                        elif sz >= nz:
+                            sz -= nz
+
+                        if sx < 0 or sy >= ny:
+                            fq[q] = inflow[q]
+                        elif sx >= nx:
+                            fq[q] = f[x, y, z, q]
+                        elif sy < 0 or solid[sx, sy, sz]:
+                            fq[q] = f[x, y, z, OPPOSITE[q]]
+                        else:
+                            fq[q] = f[sx, sy, sz, q]
+
+                    rho = ux = uy = uz = 0
+                    for q in range(19):
+                        rho += fq[q]
+                        ux += C[q][0] * fq[q]
+                        uy += C[q][1] * fq[q]
+                        uz += C[q][2] * fq[q]
+                    ux /= rho
+                    uy /= rho
+                    uz /= rho
+
+                    equilibrium(feq, rho, ux, uy, uz)
+                    for q in range(19):
+                        f_next[x, y, z, q] = fq[q] + omega * (feq[q] - fq[q])
+                    speed[x, y, z] = sqrt(ux*ux + uy*uy + uz*uz)
+
+    cpdef void run(self, int sweeps) except *:
+        cdef int i
+        for i in range(sweeps):
+            with nogil:
+                self.sweep()
+            self.f, self.f_next = self.f_next, self.f
+            self.n_sweeps += 1
+
+    cpdef void collection(self, double[:] collection, int[:, :] voxels, grid_origin) except *:
+        """ The collection of each node voxel (in the grid passed to
+            set_grid) is the mean flow speed of the water around it relative
+            to the inflow speed.
+        """
+        cdef int i, x, y, z, dx, dy, dz, n
+        cdef double total
+        cdef int[:] shift = np.asarray(grid_origin, dtype='int32') - np.asarray(self.origin)
+
+        for i in range(voxels.shape[0]):
+            x = voxels[i, 0] + shift[0]
+            y = voxels[i, 1] + shift[1]
+            z = voxels[i, 2] + shift[2]
+            total = 0
+            n = 0
+            for dx in range(max(0, x-1), min(self.nx, x+2)):
+                for dy in range(max(0, y-1), min(self.ny, y+2)):
+                    for dz in range(max(0, z-1), min(self.nz, z+2)):
+                        if not self.solid[dx, dy, dz]:
+                            total += self.speed[dx, dy, dz]
+                            n += 1
+            collection[i] = total / n / self.velocity if n else 0
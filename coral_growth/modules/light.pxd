@@ -4,20 +4,19 @@
 # cython: nonecheck=False
 # cython: cdivision=True
 
+from libc.math cimport sqrt, acos, fmax, fmin
 from coral_growth.growth_form cimport GrowthForm
 
-cdef inline bint pnt_in_tri(double[:] p, double[:] p0, double[:] p1, double[:] p2) nogil:
+cdef inline bint pnt_in_tri(double px, double py, double x0, double y0, double x1, double y1,
+                            double x2, double y2) noexcept nogil:
     # https://stackoverflow.com/questions/2049582/how-to-determine-if-a-point-is-in-a-2d-triangle
-    cdef double s = p0[1] * p2[0] - p0[0] * p2[1] + (p2[1] - p0[1]) * p[0] + \
-                                                    (p0[0] - p2[0]) * p[1]
-    cdef double t = p0[0] * p1[1] - p0[1] * p1[0] + (p0[1] - p1[1]) * p[0] + \
-                                                    (p1[0] - p0[0]) * p[1]
+    cdef double s = y0 * x2 - x0 * y2 + (y2 - y0) * px + (x0 - x2) * py
+    cdef double t = x0 * y1 - y0 * x1 + (y0 - y1) * px + (x1 - x0) * py
 
     if (s < 0) != (t < 0):
         return False
 
-    cdef double A = -p1[1] * p2[0] + p0[1] * (p2[0] - p1[0]) + p0[0] * \
-                                     (p1[1] - p2[1]) + p1[0] * p2[1]
+    cdef double A = -y1 * x2 + y0 * (x2 - x1) + x0 * (y1 - y2) + x1 * y2
 
     if A < 0.0:
         s = -s
@@ -26,4 +25,30 @@ cdef inline bint pnt_in_tri(double[:] p, double[:] p0, double[:] p1, double[:] p
 
     return s > 0 and t > 0 and (s + t) <= A
 
+cdef inline double angle_to(double[:] d, double[:, ::1] normals, int i) noexcept nogil:
+    """ Angle between d and the normal of node i. """
+    cdef double dn = d[0]*normals[i, 0] + d[1]*normals[i, 1] + d[2]*normals[i, 2]
+    cdef double length = sqrt((d[0]*d[0] + d[1]*d[1] + d[2]*d[2]) * \
+                              (normals[i, 0]*normals[i, 0] + normals[i, 1]*normals[i, 1] + \
+                               normals[i, 2]*normals[i, 2]))
+    return acos(fmax(-1, fmin(1, dn / length)))
+
+from coral_growth.modules.tri_hash_2d cimport TriHash2D
+
+cdef class HeightMap:
+    cdef public double pixel, min_u, min_w
+    cdef public int nu, nw
+    cdef public double[:] direction, axis_u, axis_w
+    cdef public double[:, :] height, projected
+
+    cpdef void set_direction(self, direction) except *
+    cdef double sample(self, double u, double w) noexcept nogil
+    cdef void project(self, double[:, :] points, int n_points) except *
+    cpdef void render(self, double[:, :] points, int n_points, int[:, :] faces,
+                      int n_faces, double pixel) except *
+    cdef bint occluded(self, int i, double[:] normal) noexcept nogil
+
+cdef int fill_faces(GrowthForm coral, TriHash2D th2d) except -1
 cpdef void calculate_light(GrowthForm) except *
+cpdef void calculate_light_raster(GrowthForm) except *
+cpdef void calculate_light_sky(GrowthForm) except *
@@ -4,105 +4,296 @@
 # cython: nonecheck=False
 # cython: cdivision=True
 
-from libc.math cimport M_PI, sin, cos, fmax
+from libc.math cimport M_PI, sin, cos, fmax, fmin, floor, ceil, sqrt, fabs, INFINITY
+from cython.parallel cimport prange
 import numpy as np
 cimport numpy as np
 
 from coral_growth.growth_form cimport GrowthForm
 from coral_growth.modules.tri_hash_2d cimport TriHash2D
 
-from cymesh.mesh cimport Mesh
-from cymesh.structures cimport Vert, Face, Edge
-from cymesh.vector3D cimport vangle
+from coral_growth.modules.threads cimport get_threads
+
+cdef int fill_faces(GrowthForm coral, TriHash2D th2d) except -1:
+    """ Copy the vertex ids of every face into th2d.faces, return the count.
+    """
+    cdef int i
+    cdef int n_faces = coral.n_faces
+    th2d.reserve(n_faces)
+    cdef int[:, :] faces = th2d.faces
+    cdef int[:, ::1] face_verts = coral.face_verts
+
+    for i in range(n_faces):
+        faces[i, 0] = face_verts[i, 0]
+        faces[i, 1] = face_verts[i, 1]
+        faces[i, 2] = face_verts[i, 2]
+
+    return n_faces
 
 cpdef void calculate_light(GrowthForm coral) except *:
-    """ Calculate the light on each node of a coral.
+    """ Calculate the light on each node of a coral. The faces are kept in a
+        persistent TriHash2D on coral.tri_hash so only moved or split faces
+        are re-bucketed. Nodes are queried in parallel.
     """
     cdef:
-        Vert v1, v2, v3, vert
-        Face face
-        Edge e
-        Mesh mesh = coral.mesh
-        double[:] p = np.zeros(2)
-        double[:] a = np.zeros(2)
-        double[:] b = np.zeros(2)
-        double[:] c = np.zeros(2)
-        double angle_to_light, c_height
-        int i, j, n, v1_id, v2_id, v3_id, face_id
-        double[:] boundingBox = coral.mesh.boundingBox()
-        double world_size = max(boundingBox[1]-boundingBox[0], boundingBox[3]-boundingBox[2])
-
-    cdef double max_e = 0
-    for e in coral.mesh.edges:
-        max_e = fmax(max_e, e.length())
-
-    cdef int[:] face_buffer = np.zeros(1000, dtype='int32')
+        TriHash2D th2d = coral.tri_hash
+        double px, py, angle_to_light, c_height
+        int i, cx, cy, x, y, n_faces, v1_id, v2_id, v3_id, face_id
+        int[:, :] faces
+        int[:] head, next
+        bint blocked
+        double[:, ::1] pos = coral.node_pos
+        double[:, ::1] normals = coral.node_normal
+        double[:] node_light = coral.node_light
+
     cdef double[:] light = np.array([0, 1.0, 0], dtype='float64')
-    cdef TriHash2D th2d = TriHash2D(cell_size=max_e, world_size=world_size)
 
-    cdef int[:,:] faces = np.zeros((len(coral.mesh.faces), 3), dtype='i')
+    n_faces = fill_faces(coral, th2d)
+    faces = th2d.faces
+    th2d.update(n_faces, coral.node_pos)
+    head = th2d.head
+    next = th2d.next
 
-    i = 0
-    for face in mesh.faces:
-        v1 = face.he.vert
-        v2 = face.he.next.vert
-        v3 = face.he.next.next.vert
+    for i in prange(coral.n_nodes, nogil=True, num_threads=get_threads(), schedule='guided'):
+        angle_to_light = angle_to(light, normals, i) / M_PI
 
-        faces[i, 0] = v1.id
-        faces[i, 1] = v2.id
-        faces[i, 2] = v3.id
+        if angle_to_light > .5:
+            node_light[i] = 0
+            continue
 
-        a[0] = v1.p[0]
-        a[1] = v1.p[2]
+        node_light[i] = 2*(1 - angle_to_light - 0.5)
 
-        b[0] = v2.p[0]
-        b[1] = v2.p[2]
+        # Take position in xz plane.
+        px = pos[i, 0]
+        py = pos[i, 2]
 
-        c[0] = v3.p[0]
-        c[1] = v3.p[2]
+        cx = <int>floor((px - th2d.min_x) / th2d.cell_size)
+        cy = <int>floor((py - th2d.min_y) / th2d.cell_size)
+        blocked = False
 
-        th2d.add_tri(i, a, b, c)
-        i += 1
+        for x in range(max(0, cx-1), min(cx+2, th2d.dim_x)):
+            for y in range(max(0, cy-1), min(cy+2, th2d.dim_y)):
+                face_id = head[x + y*th2d.dim_x]
 
-    for i in range(coral.n_nodes):
-        angle_to_light = vangle(light, coral.node_normal[i]) / M_PI
+                while face_id != -1 and not blocked:
+                    v1_id = faces[face_id, 0]
+                    v2_id = faces[face_id, 1]
+                    v3_id = faces[face_id, 2]
+                    face_id = next[face_id]
 
-        if angle_to_light > .5:
-            coral.node_light[i] = 0
-            continue
+                    if v1_id == i or v2_id == i or v3_id == i:
+                        continue
 
-        coral.node_light[i] = 2*(1 - angle_to_light - 0.5)
+                    c_height = (pos[v1_id, 1] + pos[v2_id, 1] + pos[v3_id, 1]) / 3.0
 
-        # Take position in xz plane.
-        p[0] = coral.node_pos[i, 0]
-        p[1] = coral.node_pos[i, 2]
+                    # If face is below vert, it does not block.
+                    if c_height < pos[i, 1]:
+                        continue
 
-        n = th2d.neighbors(p, face_buffer)
+                    if pnt_in_tri(px, py, pos[v1_id, 0], pos[v1_id, 2], pos[v2_id, 0],
+                                  pos[v2_id, 2], pos[v3_id, 0], pos[v3_id, 2]):
+                        node_light[i] = 0
+                        blocked = True
 
-        for j in range(n):
-            face_id = face_buffer[j]
+cdef class HeightMap:
+    """ A depth buffer looking down a light direction. Faces are rasterized
+        into square pixels on the plane perpendicular to the direction and
+        each pixel keeps the highest surface point along the direction, so
+        a point is in shadow if the surface above its pixel is higher.
+    """
+    def __init__(self, direction=(0, 1.0, 0)):
+        self.set_direction(direction)
+        self.pixel = 1.0
+        self.min_u = 0
+        self.min_w = 0
+        self.nu = 0
+        self.nw = 0
+        self.height = np.zeros((0, 0))
+        self.projected = np.zeros((0, 3))
 
-            v1_id = faces[face_id, 0]
-            v2_id = faces[face_id, 1]
-            v3_id = faces[face_id, 2]
+    cpdef void set_direction(self, direction) except *:
+        """ Look down a new direction, the buffers are kept. """
+        d = np.array(direction, dtype='float64')
+        d /= np.linalg.norm(d)
+        a = np.array([1.0, 0, 0]) if abs(d[0]) < 0.9 else np.array([0, 0, 1.0])
+        u = a - np.dot(a, d) * d
+        u /= np.linalg.norm(u)
+        self.direction = d
+        self.axis_u = u
+        self.axis_w = np.cross(d, u)
 
-            if v1_id == i or v2_id == i or v3_id == i:
-                continue
+    cdef inline double sample(self, double u, double w) noexcept nogil:
+        cdef int iu = <int>floor((u - self.min_u) / self.pixel)
+        cdef int iw = <int>floor((w - self.min_w) / self.pixel)
+        if iu < 0 or iw < 0 or iu >= self.nu or iw >= self.nw:
+            return -INFINITY
+        return self.height[iu, iw]
+
+    cdef void project(self, double[:, :] points, int n_points) except *:
+        """ Store each point as (u, w, depth) in self.projected. """
+        cdef int i
+        cdef double[:] d = self.direction
+        cdef double[:] u = self.axis_u
+        cdef double[:] w = self.axis_w
+        if self.projected.shape[0] < n_points:
+            self.projected = np.zeros((2*n_points, 3))
+        cdef double[:, :] proj = self.projected
+
+        for i in range(n_points):
+            proj[i, 0] = points[i, 0]*u[0] + points[i, 1]*u[1] + points[i, 2]*u[2]
+            proj[i, 1] = points[i, 0]*w[0] + points[i, 1]*w[1] + points[i, 2]*w[2]
+            proj[i, 2] = points[i, 0]*d[0] + points[i, 1]*d[1] + points[i, 2]*d[2]
+
+    cpdef void render(self, double[:, :] points, int n_points, int[:, :] faces,
+                      int n_faces, double pixel) except *:
+        """ Rasterize the faces, with pixels of width 'pixel'.
+        """
+        cdef int i, j, iu, iw, u0, u1, w0, w1
+        cdef int a, b, c
+        cdef double min_u = INFINITY, min_w = INFINITY
+        cdef double max_u = -INFINITY, max_w = -INFINITY
+        cdef double area, b0, b1, b2, cu, cw, depth
+
+        self.project(points, n_points)
+        cdef double[:, :] proj = self.projected
+
+        for i in range(n_points):
+            min_u = fmin(min_u, proj[i, 0])
+            min_w = fmin(min_w, proj[i, 1])
+            max_u = fmax(max_u, proj[i, 0])
+            max_w = fmax(max_w, proj[i, 1])
 
-            c_height = (coral.node_pos[v1_id, 1] + coral.node_pos[v2_id, 1] + \
-                        coral.node_pos[v3_id, 1]) / 3.0
+        self.pixel = pixel
+        self.min_u = min_u
+        self.min_w = min_w
+        self.nu = <int>((max_u - min_u) / pixel) + 1
+        self.nw = <int>((max_w - min_w) / pixel) + 1
 
-            # If face is below vert, it does not block.
-            if c_height < coral.node_pos[i, 1]:
+        # The buffer is reused and only grows.
+        if self.height.shape[0] < self.nu or self.height.shape[1] < self.nw:
+            self.height = np.zeros((max(self.nu, self.height.shape[0]*3//2),
+                                    max(self.nw, self.height.shape[1]*3//2)))
+        cdef double[:, :] height = self.height
+
+        for iu in range(self.nu):
+            for iw in range(self.nw):
+                height[iu, iw] = -INFINITY
+
+        # Vertices first so faces thinner than a pixel still cast a shadow.
+        for i in range(n_points):
+            iu = <int>((proj[i, 0] - min_u) / pixel)
+            iw = <int>((proj[i, 1] - min_w) / pixel)
+            height[iu, iw] = fmax(height[iu, iw], proj[i, 2])
+
+        for i in range(n_faces):
+            a = faces[i, 0]
+            b = faces[i, 1]
+            c = faces[i, 2]
+            area = (proj[b, 0] - proj[a, 0]) * (proj[c, 1] - proj[a, 1]) - \
+                   (proj[b, 1] - proj[a, 1]) * (proj[c, 0] - proj[a, 0])
+            if fabs(area) < 1e-12:
                 continue
 
-            a[0] = coral.node_pos[v1_id, 0]
-            a[1] = coral.node_pos[v1_id, 2]
-            b[0] = coral.node_pos[v2_id, 0]
-            b[1] = coral.node_pos[v2_id, 2]
-            c[0] = coral.node_pos[v3_id, 0]
-            c[1] = coral.node_pos[v3_id, 2]
+            # Pixels whose centers may fall in the triangle.
+            u0 = max(0, <int>floor((fmin(proj[a, 0], fmin(proj[b, 0], proj[c, 0])) - min_u) / pixel - 0.5))
+            u1 = min(self.nu-1, <int>ceil((fmax(proj[a, 0], fmax(proj[b, 0], proj[c, 0])) - min_u) / pixel - 0.5))
+            w0 = max(0, <int>floor((fmin(proj[a, 1], fmin(proj[b, 1], proj[c, 1])) - min_w) / pixel - 0.5))
+            w1 = min(self.nw-1, <int>ceil((fmax(proj[a, 1], fmax(proj[b, 1], proj[c, 1])) - min_w) / pixel - 0.5))
+
+            for iu in range(u0, u1+1):
+                cu = min_u + (iu + 0.5) * pixel
+                for iw in range(w0, w1+1):
+                    cw = min_w + (iw + 0.5) * pixel
+                    b0 = ((proj[c, 0] - proj[b, 0]) * (cw - proj[b, 1]) - \
+                          (proj[c, 1] - proj[b, 1]) * (cu - proj[b, 0])) / area
+                    b1 = ((proj[a, 0] - proj[c, 0]) * (cw - proj[c, 1]) - \
+                          (proj[a, 1] - proj[c, 1]) * (cu - proj[c, 0])) / area
+                    b2 = 1.0 - b0 - b1
+                    if b0 < -1e-9 or b1 < -1e-9 or b2 < -1e-9:
+                        continue
+                    depth = b0*proj[a, 2] + b1*proj[b, 2] + b2*proj[c, 2]
+                    height[iu, iw] = fmax(height[iu, iw], depth)
+
+    cdef bint occluded(self, int i, double[:] normal) noexcept nogil:
+        """ Whether projected point i is below the surface in its pixel. The
+            tolerance is how far the tangent plane at the point can rise
+            within one pixel, so a node does not shadow itself.
+        """
+        cdef double[:] d = self.direction
+        cdef double cos_a = normal[0]*d[0] + normal[1]*d[1] + normal[2]*d[2]
+        cdef double slope = sqrt(fmax(0, 1 - cos_a*cos_a)) / fmax(cos_a, 1e-6)
+        cdef double bias = 1.4142135623730951 * self.pixel * slope + 1e-9
+        return self.sample(self.projected[i, 0], self.projected[i, 1]) > \
+               self.projected[i, 2] + bias
+
+cpdef void calculate_light_raster(GrowthForm coral) except *:
+    """ Calculate the light on each node of a coral from a height map of the
+        faces rendered once per step. Resolution is params.light_resolution
+        times target_edge_len.
+    """
+    cdef int i, n_faces
+    cdef double angle_to_light
+    cdef HeightMap height_map = coral.height_map
+    cdef double pixel = coral.params.light_resolution * coral.target_edge_len
+    cdef double[:, ::1] normals = coral.node_normal
+    cdef double[:] node_light = coral.node_light
+
+    height_map.set_direction((0, 1.0, 0))
+    cdef double[:] light = height_map.direction
+    n_faces = fill_faces(coral, coral.tri_hash)
+    height_map.render(coral.node_pos, coral.n_nodes, coral.tri_hash.faces, n_faces, pixel)
+
+    for i in prange(coral.n_nodes, nogil=True, num_threads=get_threads(), schedule='static'):
+        angle_to_light = angle_to(light, normals, i) / M_PI
+
+        if angle_to_light > .5 or height_map.occluded(i, normals[i]):
+            node_light[i] = 0
+        else:
+            node_light[i] = 2*(1 - angle_to_light - 0.5)
+
+def sky_directions(int n, double max_angle):
+    """ n directions spread evenly (a Fibonacci spiral) over the cap of the
+        sky within max_angle degrees of vertical, and their weights. An
+        overcast sky is brighter overhead so each is weighted by its cosine.
+    """
+    cdef double golden = M_PI * (3 - sqrt(5))
+    cdef double cos_max = cos(max_angle * M_PI / 180)
+    directions = np.zeros((n, 3))
+    for k in range(n):
+        y = 1 - (1 - cos_max) * (k + 0.5) / n if n > 1 else 1.0
+        r = sqrt(fmax(0, 1 - y*y))
+        directions[k] = (r * cos(k * golden), y, r * sin(k * golden))
+    weights = directions[:, 1] / directions[:, 1].sum()
+    return directions, weights
+
+cpdef void calculate_light_sky(GrowthForm coral) except *:
+    """ Calculate the light on each node of a coral integrated over
+        params.light_directions directions of the sky. The height map is
+        reused for every direction, so each costs one rasterization.
+    """
+    cdef int i, k, n_faces
+    cdef double angle_to_light
+    cdef HeightMap height_map = coral.height_map
+    cdef double[:] light
+    cdef double[:] node_light = coral.node_light
+    cdef double[:, ::1] normals = coral.node_normal
+    cdef double pixel = coral.params.light_resolution * coral.target_edge_len
+
+    directions, weights = sky_directions(coral.params.light_directions,
+                                         coral.params.light_sky_angle)
+    cdef double[:] w = weights
+    n_faces = fill_faces(coral, coral.tri_hash)
+
+    for i in range(coral.n_nodes):
+        node_light[i] = 0
+
+    for k in range(w.shape[0]):
+        height_map.set_direction(directions[k])
+        light = height_map.direction
+        height_map.render(coral.node_pos, coral.n_nodes, coral.tri_hash.faces, n_faces, pixel)
 
-            if pnt_in_tri(p, a, b, c):
-                coral.node_light[i] = 0
-                break
+        for i in prange(coral.n_nodes, nogil=True, num_threads=get_threads(),
+                        schedule='static'):
+            angle_to_light = angle_to(light, normals, i) / M_PI
+            if angle_to_light <= .5 and not height_map.occluded(i, normals[i]):
+                node_light[i] += w[k] * 2*(1 - angle_to_light - 0.5)
@@ -0,0 +1,19 @@
+ctypedef unsigned char uint8
+
+cpdef int mark_region(double[:, ::1] pos, double[:, ::1] prev, uint8[:] dirty, int n,
+                      int[:] offsets, int[:] indices, uint8[:] in_region,
+                      int[:] region) noexcept nogil
+cpdef void clear_region(double[:, ::1] pos, double[:, ::1] prev, uint8[:] dirty,
+                        int[:] region, int n_region) noexcept nogil
+cpdef void vertex_normals(double[:, ::1] pos, int[:, ::1] faces, int[:] node_corner,
+                          int[:] corner_next, int[:] region, int n_region,
+                          double[:, ::1] normals) noexcept nogil
+cpdef void vertex_defects(double[:, ::1] pos, int[:, ::1] faces, int[:] node_corner,
+                          int[:] corner_next, int[:] region, int n_region, int[:] offsets,
+                          double[:] defect) noexcept nogil
+cpdef void vertex_curvature(double[:, ::1] pos, double[:, ::1] normals, int[:] offsets,
+                            int[:] indices, int[:] region, int n_region,
+                            double[:] curvature) noexcept nogil
+cpdef void relax_region(double[:, ::1] pos, double[:, ::1] normals, int[:] offsets,
+                        int[:] indices, int[:] region, int n_region, double amount,
+                        double[:, ::1] buffer) noexcept nogil
@@ -0,0 +1,189 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+""" Mesh attributes and relaxation recomputed for a region of vertices only.
+    Node ids are vertex ids, faces are rows of vertex ids, and neighbors and
+    face corners are the indices kept by GrowthForm, so the cost depends on
+    the size of the region and not the mesh.
+"""
+from libc.math cimport sqrt, acos, fmax, fmin, M_PI
+
+cpdef int mark_region(double[:, ::1] pos, double[:, ::1] prev, uint8[:] dirty, int n,
+                      int[:] offsets, int[:] indices, uint8[:] in_region,
+                      int[:] region) noexcept nogil:
+    """ Flag nodes that moved since prev as dirty and mark the dirty nodes and
+        their neighbors. The region is written to region and its size
+        returned.
+    """
+    cdef int i, k, j
+    cdef int n_region = 0
+
+    for i in range(n):
+        in_region[i] = 0
+        if pos[i, 0] != prev[i, 0] or pos[i, 1] != prev[i, 1] or pos[i, 2] != prev[i, 2]:
+            dirty[i] = 1
+
+    for i in range(n):
+        if dirty[i]:
+            if not in_region[i]:
+                in_region[i] = 1
+                region[n_region] = i
+                n_region += 1
+            for k in range(offsets[i], offsets[i+1]):
+                j = indices[k]
+                if not in_region[j]:
+                    in_region[j] = 1
+                    region[n_region] = j
+                    n_region += 1
+
+    return n_region
+
+cpdef void clear_region(double[:, ::1] pos, double[:, ::1] prev, uint8[:] dirty,
+                        int[:] region, int n_region) noexcept nogil:
+    """ Mark the region as up to date, every dirty node is in it. """
+    cdef int i, v
+    for i in range(n_region):
+        v = region[i]
+        dirty[v] = 0
+        prev[v, 0] = pos[v, 0]
+        prev[v, 1] = pos[v, 1]
+        prev[v, 2] = pos[v, 2]
+
+cpdef void vertex_normals(double[:, ::1] pos, int[:, ::1] faces, int[:] node_corner,
+                          int[:] corner_next, int[:] region, int n_region,
+                          double[:, ::1] normals) noexcept nogil:
+    """ Area weighted normal of each region vertex from its faces. Corner
+        3f+j is vertex j of face f and the corners of vertex v are a list
+        starting at node_corner[v] and linked by corner_next.
+    """
+    cdef int i, c, f, v, a, b, d
+    cdef double ux, uy, uz, wx, wy, wz, nx, ny, nz, length
+
+    for i in range(n_region):
+        v = region[i]
+        nx = ny = nz = 0
+        c = node_corner[v]
+        while c != -1:
+            f = c // 3
+            a = faces[f, 0]
+            b = faces[f, 1]
+            d = faces[f, 2]
+            ux = pos[b, 0] - pos[a, 0]
+            uy = pos[b, 1] - pos[a, 1]
+            uz = pos[b, 2] - pos[a, 2]
+            wx = pos[d, 0] - pos[a, 0]
+            wy = pos[d, 1] - pos[a, 1]
+            wz = pos[d, 2] - pos[a, 2]
+            nx += uy*wz - uz*wy
+            ny += uz*wx - ux*wz
+            nz += ux*wy - uy*wx
+            c = corner_next[c]
+        length = sqrt(nx*nx + ny*ny + nz*nz)
+        if length > 0:
+            nx /= length
+            ny /= length
+            nz /= length
+        normals[v, 0] = nx
+        normals[v, 1] = ny
+        normals[v, 2] = nz
+
+cdef inline double corner_angle(double[:, ::1] pos, int a, int b, int c) noexcept nogil:
+    """ Angle of the triangle at vertex a. """
+    cdef double ux = pos[b, 0] - pos[a, 0]
+    cdef double uy = pos[b, 1] - pos[a, 1]
+    cdef double uz = pos[b, 2] - pos[a, 2]
+    cdef double wx = pos[c, 0] - pos[a, 0]
+    cdef double wy = pos[c, 1] - pos[a, 1]
+    cdef double wz = pos[c, 2] - pos[a, 2]
+    cdef double d = sqrt((ux*ux + uy*uy + uz*uz) * (wx*wx + wy*wy + wz*wz))
+    if d == 0:
+        return 0
+    return acos(fmax(-1, fmin(1, (ux*wx + uy*wy + uz*wz) / d)))
+
+cpdef void vertex_defects(double[:, ::1] pos, int[:, ::1] faces, int[:] node_corner,
+                          int[:] corner_next, int[:] region, int n_region, int[:] offsets,
+                          double[:] defect) noexcept nogil:
+    """ Angle defect of each region vertex: 2pi minus the angles of its
+        faces, or pi minus them on the boundary (fewer faces than
+        neighbors).
+    """
+    cdef int i, c, f, k, v, n_faces
+    cdef double total
+
+    for i in range(n_region):
+        v = region[i]
+        total = 0
+        n_faces = 0
+        c = node_corner[v]
+        while c != -1:
+            f = c // 3
+            k = c % 3
+            total += corner_angle(pos, v, faces[f, (k+1) % 3], faces[f, (k+2) % 3])
+            n_faces += 1
+            c = corner_next[c]
+        if n_faces < offsets[v+1] - offsets[v]:
+            defect[v] = M_PI - total
+        else:
+            defect[v] = 2 * M_PI - total
+
+cpdef void vertex_curvature(double[:, ::1] pos, double[:, ::1] normals, int[:] offsets,
+                            int[:] indices, int[:] region, int n_region,
+                            double[:] curvature) noexcept nogil:
+    """ Mean over neighbors of how far they fall below the tangent plane, per
+        unit distance. Positive where the surface is convex.
+    """
+    cdef int i, k, v, j
+    cdef double dx, dy, dz, d, total
+
+    for i in range(n_region):
+        v = region[i]
+        total = 0
+        for k in range(offsets[v], offsets[v+1]):
+            j = indices[k]
+            dx = pos[j, 0] - pos[v, 0]
+            dy = pos[j, 1] - pos[v, 1]
+            dz = pos[j, 2] - pos[v, 2]
+            d = sqrt(dx*dx + dy*dy + dz*dz)
+            if d > 0:
+                total -= (dx*normals[v, 0] + dy*normals[v, 1] + dz*normals[v, 2]) / d
+        if offsets[v+1] > offsets[v]:
+            curvature[v] = total / (offsets[v+1] - offsets[v])
+        else:
+            curvature[v] = 0
+
+cpdef void relax_region(double[:, ::1] pos, double[:, ::1] normals, int[:] offsets,
+                        int[:] indices, int[:] region, int n_region, double amount,
+                        double[:, ::1] buffer) noexcept nogil:
+    """ Move each region vertex amount of the way to the centroid of its
+        neighbors, within its tangent plane so the shape is kept. All
+        vertices move together (the targets use the old positions).
+    """
+    cdef int i, k, v, j, n
+    cdef double dx, dy, dz, dn
+
+    for i in range(n_region):
+        v = region[i]
+        n = offsets[v+1] - offsets[v]
+        buffer[i, 0] = buffer[i, 1] = buffer[i, 2] = 0
+        if n == 0:
+            continue
+        for k in range(offsets[v], offsets[v+1]):
+            j = indices[k]
+            buffer[i, 0] += pos[j, 0]
+            buffer[i, 1] += pos[j, 1]
+            buffer[i, 2] += pos[j, 2]
+        dx = buffer[i, 0] / n - pos[v, 0]
+        dy = buffer[i, 1] / n - pos[v, 1]
+        dz = buffer[i, 2] / n - pos[v, 2]
+        dn = dx*normals[v, 0] + dy*normals[v, 1] + dz*normals[v, 2]
+        buffer[i, 0] = amount * (dx - dn*normals[v, 0])
+        buffer[i, 1] = amount * (dy - dn*normals[v, 1])
+        buffer[i, 2] = amount * (dz - dn*normals[v, 2])
+
+    for i in range(n_region):
+        v = region[i]
+        pos[v, 0] += buffer[i, 0]
+        pos[v, 1] += buffer[i, 1]
+        pos[v, 2] += buffer[i, 2]
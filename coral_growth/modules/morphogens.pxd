@@ -1,21 +1,19 @@
 cimport numpy as np
 import numpy as np
-from cymesh.mesh cimport Mesh
-from cymem.cymem cimport Pool
-
-cdef struct Node:
-    int key
-    Node *next
 
 cdef class Morphogens:
-    cdef Pool mem
     cdef public object coral
-    cdef public Mesh mesh
-    cdef public int n_morphogens
-    cdef public double[:, :] U, V
-    cdef public double[:] F, K, diffU, diffV, dU, dV
-    cdef public unsigned short[:] n_neighbors
-    cdef Node **neighbors
+    cdef public object mesh
+    cdef public int n_morphogens, n_iterations, solver, cg_iterations
+    cdef public double dt
+    cdef public double[:, :] U, V, dU, dV
+    cdef public double[:] F, K, diffU, diffV
+    cdef public int[:] offsets, indices
+    cdef double[:] cg_r, cg_z, cg_p, cg_Ap, cg_b, cg_d
 
-    cpdef void update(self, int steps) except *
+    cpdef void update(self, int steps, double tolerance=*) except *
     cpdef void gray_scott(self, int steps, int mi) except *
+    cpdef int gray_scott_fused(self, int steps, double tolerance) except -1
+    cpdef int gray_scott_implicit(self, int steps, double dt, double tolerance) except -1
+    cdef void solve_diffusion(self, double[:] x, double[:] b, double[:] diag, double c,
+                              int n, double tol=*, int max_iter=*) except *
@@ -1,18 +1,17 @@
 # cython: boundscheck=False
-# cython: wraparound=True
+# cython: wraparound=False
 # cython: initializedcheck=False
 # cython: nonecheck=False
 # cython: cdivision=True
 
+from libc.math cimport fabs, sqrt, ceil
+from cython.parallel cimport prange
 cimport numpy as np
 import numpy as np
-from cymem.cymem cimport Pool
-
-from cymesh.structures cimport Vert
+from coral_growth.modules.threads cimport get_threads
 
 cdef class Morphogens:
     def __init__(self, coral, config, n_morphogens):
-        self.mem = Pool()
         self.coral = coral
         self.mesh = coral.mesh
         self.n_morphogens = n_morphogens
@@ -32,69 +31,268 @@ cdef class Morphogens:
         self.U = np.ones((self.n_morphogens, coral.max_nodes))
         self.V = np.zeros((self.n_morphogens, coral.max_nodes))
 
-        self.dU = np.zeros((coral.max_nodes))
-        self.dV = np.zeros((coral.max_nodes))
+        self.dU = np.zeros((self.n_morphogens, coral.max_nodes))
+        self.dV = np.zeros((self.n_morphogens, coral.max_nodes))
+        self.n_iterations = 0
+
+        # 0 is explicit Euler and 1 is semi-implicit with timestep dt.
+        self.solver = coral.params.morphogen_solver
+        self.dt = coral.params.morphogen_dt
+        self.cg_iterations = coral.params.morphogen_cg_iterations
+        self.cg_r = np.zeros(coral.max_nodes)
+        self.cg_z = np.zeros(coral.max_nodes)
+        self.cg_p = np.zeros(coral.max_nodes)
+        self.cg_Ap = np.zeros(coral.max_nodes)
+        self.cg_b = np.zeros(coral.max_nodes)
+        self.cg_d = np.zeros(coral.max_nodes)
 
-        # self.n_neighbors = np.zeros(coral.max_nodes, dtype='uint16')
-        self.neighbors = NULL
+        # Contiguous copy of the coral's neighbor index, reused across updates.
+        self.offsets = np.zeros(coral.max_nodes+1, dtype='int32')
+        self.indices = np.zeros(0, dtype='int32')
 
-    cpdef void update(self, int steps) except *:
+    cpdef void update(self, int steps, double tolerance=0.0) except *:
+        """ Run up to 'steps' iterations of all morphogens together. If
+            tolerance > 0 stop once no value changes by more than it.
+        """
         cdef int n = self.coral.n_nodes
         cdef int i = 0
-        cdef int c
-        cdef Node *node
-        cdef Vert vert, nvert
+        cdef int k
+        cdef int[:] offsets = self.coral.neighbor_offsets
+        cdef int[:] indices = self.coral.neighbor_indices
+        cdef int nnz = offsets[n]
 
-        self.neighbors = <Node **>self.mem.alloc(n, sizeof(Node *))
+        # Only grow the buffer, so memory stays flat once the coral stops growing.
+        if nnz > self.indices.shape[0]:
+            self.indices = np.zeros(max(nnz, 2*self.indices.shape[0]), dtype='int32')
 
-        for i in range(n):
-            self.neighbors[i] = NULL
-            vert = self.coral.node_verts[i]
+        for i in range(n+1):
+            self.offsets[i] = offsets[i]
+        for k in range(nnz):
+            self.indices[k] = indices[k]
 
-            for nvert in vert.neighbors():
-                node = <Node *>self.mem.alloc(1, sizeof(Node))
-                node.key = nvert.id
-                node.next = self.neighbors[i]
-                self.neighbors[i] = node
-
-        for i in range(self.n_morphogens):
-            self.gray_scott(steps, i)
+        if self.solver == 1:
+            self.n_iterations = self.gray_scott_implicit(steps, self.dt, tolerance)
+        else:
+            self.n_iterations = self.gray_scott_fused(steps, tolerance)
 
     cpdef void gray_scott(self, int steps, int mi) except *:
         cdef int i = 0
         cdef int n = self.coral.n_nodes
-        cdef int nidx, nn
+        cdef int k, nn
         cdef double uvv, u, v, lapU, lapV
-        cdef Node *node
+        cdef int[:] offsets = self.offsets
+        cdef int[:] indices = self.indices
         cdef double[:] U = self.U[mi]
         cdef double[:] V = self.V[mi]
         cdef double diffU = self.diffU[mi]
         cdef double diffV = self.diffV[mi]
         cdef double F = self.F[mi]
         cdef double K = self.K[mi]
+        cdef double[:] dU = self.dU[mi]
+        cdef double[:] dV = self.dV[mi]
 
         for _ in range(steps):
             for i in range(n):
                 u = U[i]
                 v = V[i]
-                node = self.neighbors[i]
-                nn = 0
+                nn = offsets[i+1] - offsets[i]
                 uvv = u*v*v
                 lapU = 0
                 lapV = 0
 
-                while node != NULL:
-                    lapU += U[node.key]
-                    lapV += V[node.key]
-                    nn += 1
-                    node = node.next
+                for k in range(offsets[i], offsets[i+1]):
+                    lapU += U[indices[k]]
+                    lapV += V[indices[k]]
 
                 lapU -= nn*u
                 lapV -= nn*v
 
-                self.dU[i] = diffU * lapU - uvv + F*(1 - u)
-                self.dV[i] = diffV * lapV + uvv - (K+F)*v
+                dU[i] = diffU * lapU - uvv + F*(1 - u)
+                dV[i] = diffV * lapV + uvv - (K+F)*v
 
             for i in range(n):
-                U[i] += self.dU[i]
-                V[i] += self.dV[i]
+                U[i] += dU[i]
+                V[i] += dV[i]
+
+    cpdef int gray_scott_fused(self, int steps, double tolerance) except -1:
+        """ Advance every morphogen in the same sweep over the adjacency and
+            return the number of iterations run. Stops early once the largest
+            change of any U or V is below tolerance.
+        """
+        cdef int i, k, j, mi, it
+        cdef int n = self.coral.n_nodes
+        cdef int nm = self.n_morphogens
+        cdef double uvv, u, v, lapU, lapV, max_delta
+        cdef int[:] offsets = self.offsets
+        cdef int[:] indices = self.indices
+        cdef double[:, :] U = self.U
+        cdef double[:, :] V = self.V
+        cdef double[:, :] dU = self.dU
+        cdef double[:, :] dV = self.dV
+        cdef double[:] diffU = self.diffU
+        cdef double[:] diffV = self.diffV
+        cdef double[:] F = self.F
+        cdef double[:] K = self.K
+        cdef int n_threads = get_threads()
+
+        for it in range(steps):
+            for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                for mi in range(nm):
+                    u = U[mi, i]
+                    v = V[mi, i]
+                    uvv = u*v*v
+                    lapU = 0
+                    lapV = 0
+
+                    for k in range(offsets[i], offsets[i+1]):
+                        j = indices[k]
+                        lapU = lapU + U[mi, j]
+                        lapV = lapV + V[mi, j]
+
+                    lapU = lapU - (offsets[i+1] - offsets[i])*u
+                    lapV = lapV - (offsets[i+1] - offsets[i])*v
+
+                    dU[mi, i] = diffU[mi] * lapU - uvv + F[mi]*(1 - u)
+                    dV[mi, i] = diffV[mi] * lapV + uvv - (K[mi]+F[mi])*v
+
+            max_delta = 0
+            if tolerance > 0:
+                for mi in range(nm):
+                    for i in range(n):
+                        max_delta = max(max_delta, fabs(dU[mi, i]), fabs(dV[mi, i]))
+
+            for mi in range(nm):
+                for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                    U[mi, i] += dU[mi, i]
+                    V[mi, i] += dV[mi, i]
+
+            if max_delta < tolerance:
+                return it + 1
+
+        return steps
+
+    cpdef int gray_scott_implicit(self, int steps, double dt, double tolerance) except -1:
+        """ Linearly implicit Gray-Scott: diffusion and the decay terms are
+            solved implicitly and only the u*v*v production term is explicit,
+
+                ((1 + dt*(F + v*v)) I - dt*diffU*L) U' = U + dt*F
+                ((1 + dt*(F + K)) I - dt*diffV*L) V' = V + dt*U'*v*v
+
+            where L is the graph Laplacian of the mesh. This stays stable and
+            non-negative for large dt so it covers the time of 'steps'
+            explicit iterations in ceil(steps / dt) sweeps. Each solve is
+            warm started from the current values and capped at cg_iterations
+            iterations, the splitting error dominates so an exact solve is
+            slower without looking any closer to the explicit solver. Returns
+            the number of sweeps run.
+        """
+        cdef int i, mi, it
+        cdef int n = self.coral.n_nodes
+        cdef int nm = self.n_morphogens
+        cdef int n_steps = <int>ceil(steps / dt)
+        cdef double v, max_delta
+        cdef double[:, :] U = self.U
+        cdef double[:, :] V = self.V
+        cdef double[:, :] dU = self.dU
+        cdef double[:, :] dV = self.dV
+        cdef double[:] diag = self.cg_d
+        cdef double[:] b = self.cg_b
+        cdef double F, K
+        cdef int n_threads = get_threads()
+
+        for it in range(n_steps):
+            max_delta = 0
+
+            for mi in range(nm):
+                F = self.F[mi]
+                K = self.K[mi]
+
+                # The rhs only reads V, which is solved last, so no copy is
+                # needed unless the change is measured.
+                if tolerance > 0:
+                    for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                        dU[mi, i] = U[mi, i]
+                        dV[mi, i] = V[mi, i]
+
+                for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                    v = V[mi, i]
+                    diag[i] = 1 + dt*(F + v*v)
+                    b[i] = U[mi, i] + dt*F
+                self.solve_diffusion(U[mi], b, diag, dt*self.diffU[mi], n, 1e-6,
+                                     self.cg_iterations)
+
+                for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                    v = V[mi, i]
+                    diag[i] = 1 + dt*(F + K)
+                    b[i] = v + dt*U[mi, i]*v*v
+                self.solve_diffusion(V[mi], b, diag, dt*self.diffV[mi], n, 1e-6,
+                                     self.cg_iterations)
+
+                if tolerance > 0:
+                    for i in range(n):
+                        max_delta = max(max_delta, fabs(U[mi, i] - dU[mi, i]),
+                                                   fabs(V[mi, i] - dV[mi, i]))
+
+            if max_delta < tolerance * dt:
+                return it + 1
+
+        return n_steps
+
+    cdef void solve_diffusion(self, double[:] x, double[:] b, double[:] diag, double c,
+                              int n, double tol=1e-6, int max_iter=100) except *:
+        """ Solve (diag - c*L) x = b by Jacobi preconditioned conjugate
+            gradient to a residual of tol*|b| or for max_iter iterations,
+            using the current value of x as the initial guess. The matrix is symmetric positive definite and
+            diagonally dominant so few iterations are needed.
+        """
+        cdef int i, k, it, nn
+        cdef double alpha, beta, rz, rz_new, pAp, s
+        cdef double rr = 0
+        cdef double bb = 0
+        cdef int[:] offsets = self.offsets
+        cdef int[:] indices = self.indices
+        cdef double[:] r = self.cg_r
+        cdef double[:] z = self.cg_z
+        cdef double[:] p = self.cg_p
+        cdef double[:] Ap = self.cg_Ap
+        cdef int n_threads = get_threads()
+
+        rz = 0
+        for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+            s = 0
+            for k in range(offsets[i], offsets[i+1]):
+                s = s + x[indices[k]]
+            nn = offsets[i+1] - offsets[i]
+            r[i] = b[i] - (diag[i]*x[i] + c*(nn*x[i] - s))
+            z[i] = r[i] / (diag[i] + c*nn)
+            p[i] = z[i]
+            rz += r[i]*z[i]
+            rr += r[i]*r[i]
+            bb += b[i]*b[i]
+
+        for it in range(max_iter):
+            if sqrt(rr) <= tol * sqrt(bb):
+                break
+
+            pAp = 0
+            for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                s = 0
+                for k in range(offsets[i], offsets[i+1]):
+                    s = s + p[indices[k]]
+                Ap[i] = diag[i]*p[i] + c*((offsets[i+1] - offsets[i])*p[i] - s)
+                pAp += p[i]*Ap[i]
+
+            alpha = rz / pAp
+            rz_new = 0
+            rr = 0
+            for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                x[i] += alpha * p[i]
+                r[i] -= alpha * Ap[i]
+                z[i] = r[i] / (diag[i] + c*(offsets[i+1] - offsets[i]))
+                rz_new += r[i]*z[i]
+                rr += r[i]*r[i]
+
+            beta = rz_new / rz
+            rz = rz_new
+            for i in prange(n, nogil=True, num_threads=n_threads, schedule='static'):
+                p[i] = z[i] + beta * p[i]
@@ -0,0 +1,9 @@
+cpdef void create_node_inputs(double[:, ::1] inputs, int n_nodes, double[:] energy,
+                              double[:] gravity, double[:] curvature,
+                              double[:, ::1] attributes, double[:, :] morphogensU,
+                              int morphogen_thresholds, double[:, ::1] signals,
+                              int signal_thresholds, int[:, ::1] memory, int n_memory,
+                              double[:, ::1] normals, bint use_polar_direction) noexcept nogil
+
+cpdef void calculate_gravity(double[:] gravity, double[:, ::1] normals,
+                             int n_nodes) noexcept nogil
@@ -0,0 +1,85 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+""" Array kernels that build the neural network input of every node.
+"""
+from libc.math cimport floor, atan, acos, cos, sin, sqrt, fmin, fmax, M_PI
+from cython.parallel cimport prange
+from coral_growth.modules.threads cimport get_threads
+
+cpdef void create_node_inputs(double[:, ::1] inputs, int n_nodes, double[:] energy,
+                              double[:] gravity, double[:] curvature,
+                              double[:, ::1] attributes, double[:, :] morphogensU,
+                              int morphogen_thresholds, double[:, ::1] signals,
+                              int signal_thresholds, int[:, ::1] memory, int n_memory,
+                              double[:, ::1] normals, bint use_polar_direction) noexcept nogil:
+    """ Map node stats to neural input in [-1, 1] range. Each row is:
+
+            energy, gravity, curvature, attributes..., one-hot morphogen bins...,
+            one-hot signal bins..., memory..., polar direction (4), bias
+
+        Rows past n_nodes are not written. Rows are filled in parallel.
+    """
+    cdef int i, j, mi, mbin, input_idx
+    cdef int n_inputs = inputs.shape[1]
+    cdef int n_attributes = attributes.shape[1]
+    cdef int n_morphogens = morphogensU.shape[0]
+    cdef int n_signals = signals.shape[1]
+    cdef double azimuthal_angle, polar_angle
+
+    for i in prange(n_nodes, num_threads=get_threads(), schedule='static'):
+        for j in range(n_inputs):
+            inputs[i, j] = -1
+
+        inputs[i, 0] = (energy[i] * 2) - 1
+        inputs[i, 1] = gravity[i]
+        inputs[i, 2] = curvature[i]
+        input_idx = 3
+
+        for j in range(n_attributes):
+            inputs[i, input_idx] = attributes[i, j]
+            input_idx = input_idx + 1
+
+        # Morphogens.
+        for mi in range(n_morphogens):
+            mbin = <int>(floor(morphogensU[mi, i] * morphogen_thresholds))
+            mbin = min(morphogen_thresholds - 1, mbin)
+            inputs[i, input_idx + mbin] = 1
+            input_idx = input_idx + morphogen_thresholds
+
+        # Signals.
+        for mi in range(n_signals):
+            mbin = <int>(floor(signals[i, mi] * signal_thresholds))
+            mbin = min(signal_thresholds - 1, mbin)
+            inputs[i, input_idx + mbin] = 1
+            input_idx = input_idx + signal_thresholds
+
+        # Memory.
+        for mi in range(n_memory):
+            inputs[i, input_idx] = -1.0 + memory[i, mi] * 2.0
+            input_idx = input_idx + 1
+
+        if use_polar_direction:
+            azimuthal_angle = atan(normals[i, 1] / normals[i, 0])
+            polar_angle = acos(normals[i, 2])
+            inputs[i, input_idx] = cos(azimuthal_angle)
+            inputs[i, input_idx+1] = sin(azimuthal_angle)
+            inputs[i, input_idx+2] = cos(polar_angle)
+            inputs[i, input_idx+3] = sin(polar_angle)
+            input_idx = input_idx + 4
+
+        inputs[i, input_idx] = 1 # Bias Bit
+
+cpdef void calculate_gravity(double[:] gravity, double[:, ::1] normals,
+                             int n_nodes) noexcept nogil:
+    """ Angle between each normal and straight down, scaled to [0, 1].
+    """
+    cdef int i
+    cdef double length, c
+    for i in prange(n_nodes, num_threads=get_threads(), schedule='static'):
+        length = sqrt(normals[i, 0]*normals[i, 0] + normals[i, 1]*normals[i, 1] + \
+                      normals[i, 2]*normals[i, 2])
+        c = fmax(-1.0, fmin(1.0, -normals[i, 1] / length))
+        gravity[i] = acos(c) / M_PI
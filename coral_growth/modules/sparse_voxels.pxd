@@ -0,0 +1,34 @@
+ctypedef unsigned char uint8
+
+cdef enum:
+    BRICK_SHIFT = 3
+    BRICK = 8 # Voxels along each side of a brick.
+    BRICK_MASK = 7
+    BRICK_VOXELS = 512
+
+cdef class SparseVoxelGrid:
+    cdef public int nx, ny, nz, bx, by, bz, n_bricks
+    cdef public int[:] table, coords
+    cdef public uint8[:, :] bricks
+
+    cdef int brick_of(self, int x, int y, int z) noexcept nogil
+    cdef int allocate(self, int b) except -1
+    cpdef void set(self, int x, int y, int z, uint8 value) except *
+    cdef uint8 get(self, int x, int y, int z) noexcept nogil
+    cpdef int nbytes(self)
+
+cdef class SparseFloodFill:
+    cdef public SparseVoxelGrid grid
+    cdef public uint8[:] reached
+    cdef public uint8[:, :] outside
+    cdef public int[:] queue
+
+    cdef uint8 get(self, int x, int y, int z) noexcept nogil
+    cdef void visit(self, int x, int y, int z, int *tail) noexcept nogil
+    cdef int fill(self) noexcept nogil
+    cpdef int nbytes(self)
+
+cpdef void calculate_collection_sparse(double[:] collection, int[:, :] voxels,
+                                       SparseVoxelGrid voxel_grid, int radius=*) except *
+cpdef tuple create_sparse_voxel_grid(double[:, :] node_pos, int n_nodes, int[:, :] faces,
+                                     int n_faces, double voxel_length)
@@ -0,0 +1,2 @@
+cpdef void set_threads(int n) except *
+cdef int get_threads() noexcept nogil
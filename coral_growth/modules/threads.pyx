@@ -0,0 +1,18 @@
+""" The number of threads the prange kernels use. Without OpenMP the
+    kernels run serially whatever it is set to.
+
+    In a prange body an in-place operator on a local variable declares a
+    reduction, which Cython rejects if the variable is also assigned, so
+    the kernels write per-iteration sums out as x = x + y.
+"""
+import multiprocessing
+
+cdef int n_threads = 1
+
+cpdef void set_threads(int n) except *:
+    """ Use n threads, or one per core if n is 0. """
+    global n_threads
+    n_threads = n if n > 0 else multiprocessing.cpu_count()
+
+cdef int get_threads() noexcept nogil:
+    return n_threads
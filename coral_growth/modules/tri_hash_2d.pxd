@@ -1,19 +1,12 @@
-from cymem.cymem cimport Pool
-
-ctypedef unsigned int uint
-
-cdef struct Entry:
-    int key
-    Entry *next
-
 cdef class TriHash2D:
-    cdef Pool mem
-    cdef double cell_size
-    cdef int world_size, l, size, dim_size
-    cdef Entry **bins
-
-    # cdef void initialize(self)
-    cdef uint tri_bucket(self, double[:] a, double[:] b, double[:] c)
-    cdef void add_tri(self, int key, double[:] a, double[:] b, double[:] c) except *
-    cdef int neighbors(self, double[:] a, int[:] results)  except *
-
+    cdef public double cell_size, min_x, min_y
+    cdef public int dim_x, dim_y, n_tris, n_rebuilds, n_moved
+    cdef public int[:] head, next, prev, tri_cell
+    cdef public int[:, :] faces
+
+    cpdef void reserve(self, int n_tris) except *
+    cdef int cell_of(self, double x, double y) noexcept nogil
+    cdef void insert(self, int key, int cell) noexcept nogil
+    cdef void remove(self, int key) noexcept nogil
+    cdef void rebuild(self, int n_tris, double[:, :] points, double max_len) except *
+    cpdef void update(self, int n_tris, double[:, :] points) except *
@@ -1,92 +1,154 @@
-# cython: boundscheck=True
+# cython: boundscheck=False
 # cython: wraparound=False
 # cython: initializedcheck=False
 # cython: nonecheck=False
 # cython: cdivision=True
 
-from cymem.cymem cimport Pool
+from libc.math cimport floor, sqrt, fmax
+import numpy as np
 
 cdef class TriHash2D:
-    def __init__(self, cell_size, world_size):
-        self.mem = Pool()
+    """ A uniform grid over the xz plane that buckets triangles by centroid.
+        It persists across steps: update() only moves triangles whose
+        centroid changed cell and rebuilds (with room to grow) when a
+        triangle leaves the grid or gets larger than a cell. Each bucket is a
+        doubly linked list stored in int arrays indexed by triangle id.
+    """
+    def __init__(self, cell_size=0.0, max_tris=1024):
         self.cell_size = cell_size
-        self.world_size = world_size
-
-        self.dim_size = int(world_size / cell_size)
-        self.size = self.dim_size**2
-        self.bins = <Entry **>self.mem.alloc(self.size, sizeof(Entry *))
-
-        cdef size_t i
-        for i in range(self.size):
-            self.bins[i] = NULL
-
-    cdef uint tri_bucket(self, double[:] a, double[:] b, double[:] c):
-        # Find cell coords off center of tri.
-        cdef double ws2 = self.world_size / 2
-        cdef int x = <int>((((a[0] + b[0] + c[0])/3) + ws2) / self.cell_size)
-        cdef int y = <int>((((a[1] + b[1] + c[1])/3) + ws2) / self.cell_size)
-
-        cdef uint bi = x + y*self.dim_size
-        bi = max(0, min(bi, self.size-1))
-
-        return bi
-
-    cdef void add_tri(self, int key, double[:] a, double[:] b, double[:] c) except *:
-        cdef uint bi = self.tri_bucket(a, b, c)
-        cdef Entry *entry = <Entry *>self.mem.alloc(1, sizeof(Entry))
-
-        entry.key = key
-        entry.next = self.bins[bi]
-        self.bins[bi] = entry
-
-    # def py_add_tr(self, int key, list la, list lb, list lc):
-    #     cdef double a[2], b[2], c[2]
-    #     a[:] = la
-    #     b[:] = lb
-    #     c[:] = lc
-    #     self.add_tri(key, a, b, c)
-
-    cdef int neighbors(self, double[:] a, int[:] results) except *:
-        cdef int h, x, y, z
-        cdef int i = 0
-        cdef int n = results.shape[0]
-        cdef Entry* entry
-
-        cdef double ws2 = self.world_size / 2
-        cdef int cx = <int>((a[0] + ws2) / self.cell_size)
-        cdef int cy = <int>((a[1] + ws2) / self.cell_size)
-
-        for x in range(max(0, cx-1), min(cx+1, self.dim_size-1)):
-            for y in range(max(0, cy-1), min(cy+1, self.dim_size-1)):
-                h = x + y*self.dim_size
-                entry = self.bins[h]
-
-                while entry != NULL:
-                    results[i] = entry.key
-
-                    if i == n - 1:
-                        return i
-                    else:
-                        i += 1
-                        entry = entry.next
-        return i
-
-    # def py_neighbors(self, a):
-    #     cdef int h, x, y, z
-    #     cdef Entry* entry
-
-    #     cdef double ws2 = self.world_size / 2
-    #     cdef int cx = <int>((a[0] + ws2) / self.cell_size)
-    #     cdef int cy = <int>((a[1] + ws2) / self.cell_size)
-
-    #     cdef list results = []
-
-    #     for x in range(max(0, cx-1), min(cx+2, self.dim_size-1)):
-    #         for y in range(max(0, cy-1), min(cy+2, self.dim_size-1)):
-    #             h = x + y*self.dim_size
-    #             entry = self.bins[h]
-
-    #             while entry != NULL:
-    #                 results.append(entry.key)
-    #                 entry = entry.next
-    #     return results
+        self.min_x = 0
+        self.min_y = 0
+        self.dim_x = 0
+        self.dim_y = 0
+        self.n_tris = 0
+        self.n_rebuilds = 0
+        self.n_moved = 0
+        self.head = np.zeros(0, dtype='int32')
+        self.faces = np.zeros((max_tris, 3), dtype='int32')
+        self.next = np.full(max_tris, -1, dtype='int32')
+        self.prev = np.full(max_tris, -1, dtype='int32')
+        self.tri_cell = np.full(max_tris, -1, dtype='int32')
+
+    cpdef void reserve(self, int n_tris) except *:
+        """ Make room for n_tris triangles, growing the buffers geometrically.
+        """
+        cdef int old_size = self.next.shape[0]
+        cdef int size = old_size
+        if n_tris <= size:
+            return
+        while size < n_tris:
+            size *= 2
+        faces = np.zeros((size, 3), dtype='int32')
+        faces[:old_size] = self.faces
+        self.faces = faces
+        for name in ('next', 'prev', 'tri_cell'):
+            arr = np.full(size, -1, dtype='int32')
+            arr[:old_size] = getattr(self, name)
+            setattr(self, name, arr)
+
+    cdef inline int cell_of(self, double x, double y) noexcept nogil:
+        """ The cell index of a point or -1 if it is outside the grid. """
+        cdef int cx = <int>floor((x - self.min_x) / self.cell_size)
+        cdef int cy = <int>floor((y - self.min_y) / self.cell_size)
+        if cx < 0 or cy < 0 or cx >= self.dim_x or cy >= self.dim_y:
+            return -1
+        return cx + cy*self.dim_x
+
+    cdef void insert(self, int key, int cell) noexcept nogil:
+        self.tri_cell[key] = cell
+        self.prev[key] = -1
+        self.next[key] = self.head[cell]
+        if self.head[cell] != -1:
+            self.prev[self.head[cell]] = key
+        self.head[cell] = key
+
+    cdef void remove(self, int key) noexcept nogil:
+        if self.prev[key] != -1:
+            self.next[self.prev[key]] = self.next[key]
+        else:
+            self.head[self.tri_cell[key]] = self.next[key]
+        if self.next[key] != -1:
+            self.prev[self.next[key]] = self.prev[key]
+        self.tri_cell[key] = -1
+
+    cdef void rebuild(self, int n_tris, double[:, :] points, double max_len) except *:
+        """ Resize the grid to the current triangles with a margin so it
+            does not need to be resized again until the coral grows by half.
+        """
+        cdef int i, cell
+        cdef double x, y
+        cdef double min_x = 1e300, min_y = 1e300, max_x = -1e300, max_y = -1e300
+        cdef int[:, :] faces = self.faces
+
+        for i in range(n_tris):
+            x = (points[faces[i, 0], 0] + points[faces[i, 1], 0] + points[faces[i, 2], 0]) / 3
+            y = (points[faces[i, 0], 2] + points[faces[i, 1], 2] + points[faces[i, 2], 2]) / 3
+            min_x = min(min_x, x)
+            min_y = min(min_y, y)
+            max_x = max(max_x, x)
+            max_y = max(max_y, y)
+
+        self.cell_size = fmax(self.cell_size, 1.5 * max_len)
+        cdef double margin = fmax(self.cell_size, 0.5 * fmax(max_x - min_x, max_y - min_y))
+        self.min_x = min_x - margin
+        self.min_y = min_y - margin
+        self.dim_x = <int>((max_x - min_x + 2*margin) / self.cell_size) + 1
+        self.dim_y = <int>((max_y - min_y + 2*margin) / self.cell_size) + 1
+        self.head = np.full(self.dim_x * self.dim_y, -1, dtype='int32')
+        self.n_rebuilds += 1
+
+        for i in range(n_tris):
+            x = (points[faces[i, 0], 0] + points[faces[i, 1], 0] + points[faces[i, 2], 0]) / 3
+            y = (points[faces[i, 0], 2] + points[faces[i, 1], 2] + points[faces[i, 2], 2]) / 3
+            self.insert(i, self.cell_of(x, y))
+
+    cpdef void update(self, int n_tris, double[:, :] points) except *:
+        """ Bring the grid up to date after the first n_tris rows of faces
+            were (re)written with vertex indices into points. Only triangles
+            that are new or whose centroid moved cell are re-bucketed.
+        """
+        cdef int i, j, a, b, cell
+        cdef double x, y, dx, dy
+        cdef double max_len = 0
+        cdef int[:, :] faces = self.faces
+        cdef int[:] tri_cell = self.tri_cell
+
+        # Longest edge in the xz plane, a triangle covering a point must then
+        # have its centroid in a neighboring cell.
+        for i in range(n_tris):
+            for j in range(3):
+                a = faces[i, j]
+                b = faces[i, (j+1) % 3]
+                dx = points[a, 0] - points[b, 0]
+                dy = points[a, 2] - points[b, 2]
+                max_len = fmax(max_len, dx*dx + dy*dy)
+        max_len = sqrt(max_len)
+
+        # Triangles that no longer exist.
+        for i in range(n_tris, self.n_tris):
+            if tri_cell[i] != -1:
+                self.remove(i)
+
+        if self.dim_x == 0 or max_len > self.cell_size:
+            self.n_tris = n_tris
+            self.rebuild(n_tris, points, max_len)
+            return
+
+        self.n_moved = 0
+        for i in range(n_tris):
+            x = (points[faces[i, 0], 0] + points[faces[i, 1], 0] + points[faces[i, 2], 0]) / 3
+            y = (points[faces[i, 0], 2] + points[faces[i, 1], 2] + points[faces[i, 2], 2]) / 3
+            cell = self.cell_of(x, y)
+
+            if cell == -1:
+                self.n_tris = n_tris
+                self.rebuild(n_tris, points, max_len)
+                return
+
+            if cell != tri_cell[i]:
+                if tri_cell[i] != -1:
+                    self.remove(i)
+                self.insert(i, cell)
+                self.n_moved += 1
+
+        self.n_tris = n_tris
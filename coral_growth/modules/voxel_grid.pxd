@@ -0,0 +1,21 @@
+ctypedef unsigned char uint8
+
+cdef class VoxelGrid:
+    cdef public double voxel_length
+    cdef public int n_nodes, n_faces, n_rebuilds, n_changed
+    cdef public int[:] origin
+    cdef public int[:, :, :] counts
+    cdef public uint8[:, :, :] grid
+    cdef public int[:, :] node_voxels, face_voxels
+
+    cpdef void reserve(self, int n_nodes, int n_faces) except *
+    cdef void add(self, int x, int y, int z) noexcept nogil
+    cdef void subtract(self, int x, int y, int z) noexcept nogil
+    cdef void place(self, int[:, :] voxels, int i, bint is_new, double x, double y,
+                    double z) noexcept nogil
+    cdef bint in_bounds(self, double x, double y, double z) noexcept nogil
+    cdef void rebuild(self, double[:, :] node_pos, int n_nodes, int[:, :] faces,
+                      int n_faces) except *
+    cpdef void update(self, double[:, :] node_pos, int n_nodes, int[:, :] faces,
+                      int n_faces, double voxel_length) except *
+    cpdef tuple dense(self)
@@ -0,0 +1,167 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+from libc.math cimport floor
+import numpy as np
+
+# Empty voxels kept around the points on each side, as in flowx.create_voxel_grid.
+cdef int[3] PAD_LOW = [4, 0, 4]
+cdef int[3] PAD_HIGH = [5, 4, 5]
+
+cdef class VoxelGrid:
+    """ Voxel occupancy of the nodes and face midpoints of a form that is
+        kept between steps. Each voxel counts the points in it, so a point
+        that moved only touches its old and new voxel. The grid is padded
+        like flowx.create_voxel_grid plus some room to grow and is only
+        rebuilt when a point crosses the padded bounds. dense() crops it
+        back to the extent create_voxel_grid has.
+    """
+    def __init__(self):
+        self.voxel_length = 0
+        self.n_nodes = 0
+        self.n_faces = 0
+        self.n_rebuilds = 0
+        self.n_changed = 0
+        self.origin = np.zeros(3, dtype='int32')
+        self.counts = np.zeros((0, 0, 0), dtype='int32')
+        self.grid = np.zeros((0, 0, 0), dtype='uint8')
+        self.node_voxels = np.zeros((0, 3), dtype='int32')
+        self.face_voxels = np.zeros((0, 3), dtype='int32')
+
+    cpdef void reserve(self, int n_nodes, int n_faces) except *:
+        """ Make room for the voxels of n_nodes nodes and n_faces faces. """
+        if self.node_voxels.shape[0] < n_nodes:
+            voxels = np.zeros((max(n_nodes, 2*self.node_voxels.shape[0]), 3), dtype='int32')
+            voxels[:self.node_voxels.shape[0]] = self.node_voxels
+            self.node_voxels = voxels
+        if self.face_voxels.shape[0] < n_faces:
+            voxels = np.zeros((max(n_faces, 2*self.face_voxels.shape[0]), 3), dtype='int32')
+            voxels[:self.face_voxels.shape[0]] = self.face_voxels
+            self.face_voxels = voxels
+
+    cdef inline void add(self, int x, int y, int z) noexcept nogil:
+        self.counts[x, y, z] += 1
+        self.grid[x, y, z] = 1
+
+    cdef inline void subtract(self, int x, int y, int z) noexcept nogil:
+        self.counts[x, y, z] -= 1
+        if self.counts[x, y, z] == 0:
+            self.grid[x, y, z] = 0
+
+    cdef void place(self, int[:, :] voxels, int i, bint is_new, double x, double y,
+                    double z) noexcept nogil:
+        """ Move point i of voxels to the voxel of position (x, y, z). """
+        cdef double vl = self.voxel_length
+        cdef int vx = <int>floor(x / vl) - self.origin[0]
+        cdef int vy = <int>floor(y / vl) - self.origin[1]
+        cdef int vz = <int>floor(z / vl) - self.origin[2]
+
+        if not is_new:
+            if voxels[i, 0] == vx and voxels[i, 1] == vy and voxels[i, 2] == vz:
+                return
+            self.subtract(voxels[i, 0], voxels[i, 1], voxels[i, 2])
+
+        voxels[i, 0] = vx
+        voxels[i, 1] = vy
+        voxels[i, 2] = vz
+        self.add(vx, vy, vz)
+        self.n_changed += 1
+
+    cdef inline bint in_bounds(self, double x, double y, double z) noexcept nogil:
+        cdef double vl = self.voxel_length
+        cdef int vx = <int>floor(x / vl) - self.origin[0]
+        cdef int vy = <int>floor(y / vl) - self.origin[1]
+        cdef int vz = <int>floor(z / vl) - self.origin[2]
+        return vx >= PAD_LOW[0] and vy >= PAD_LOW[1] and vz >= PAD_LOW[2] and \
+               vx < self.grid.shape[0] - PAD_HIGH[0] and \
+               vy < self.grid.shape[1] - PAD_HIGH[1] and \
+               vz < self.grid.shape[2] - PAD_HIGH[2]
+
+    cdef void rebuild(self, double[:, :] node_pos, int n_nodes, int[:, :] faces,
+                      int n_faces) except *:
+        """ Size the grid to the nodes with padding and an extra eighth of the
+            extent to grow into (never below, as the padding starts at the
+            lowest node), then add every point.
+        """
+        cdef int i
+        cdef double vl = self.voxel_length
+        positions = np.asarray(node_pos[:n_nodes])
+        min_v = np.floor(positions.min(axis=0) / vl).astype('int32')
+        max_v = np.floor(positions.max(axis=0) / vl).astype('int32')
+        slack = (max_v - min_v) // 8 + 2
+        slack_low = slack.copy()
+        slack_low[1] = 0
+
+        self.origin = (min_v - np.array(PAD_LOW) - slack_low).astype('int32')
+        shape = max_v - min_v + 1 + np.array(PAD_LOW) + np.array(PAD_HIGH) + slack_low + slack
+        self.counts = np.zeros(shape, dtype='int32')
+        self.grid = np.zeros(shape, dtype='uint8')
+        self.n_rebuilds += 1
+
+        for i in range(n_nodes):
+            self.place(self.node_voxels, i, True, node_pos[i, 0], node_pos[i, 1],
+                       node_pos[i, 2])
+        for i in range(n_faces):
+            self.place(self.face_voxels, i, True,
+                       (node_pos[faces[i, 0], 0] + node_pos[faces[i, 1], 0] + node_pos[faces[i, 2], 0]) / 3,
+                       (node_pos[faces[i, 0], 1] + node_pos[faces[i, 1], 1] + node_pos[faces[i, 2], 1]) / 3,
+                       (node_pos[faces[i, 0], 2] + node_pos[faces[i, 1], 2] + node_pos[faces[i, 2], 2]) / 3)
+
+    cpdef void update(self, double[:, :] node_pos, int n_nodes, int[:, :] faces,
+                      int n_faces, double voxel_length) except *:
+        """ Bring the grid up to date with the first n_nodes node positions
+            and the midpoints of the first n_faces faces (rows of vertex ids).
+            Only points that are new or changed voxel are touched.
+        """
+        cdef int i
+        cdef bint rebuild = self.voxel_length != voxel_length or self.grid.shape[0] == 0
+        self.reserve(n_nodes, n_faces)
+        self.voxel_length = voxel_length
+        self.n_changed = 0
+
+        # Face midpoints lie inside the bounds of the nodes.
+        if not rebuild:
+            for i in range(n_nodes):
+                if not self.in_bounds(node_pos[i, 0], node_pos[i, 1], node_pos[i, 2]):
+                    rebuild = True
+                    break
+
+        if rebuild:
+            self.rebuild(node_pos, n_nodes, faces, n_faces)
+            self.n_nodes = n_nodes
+            self.n_faces = n_faces
+            return
+
+        with nogil:
+            for i in range(n_nodes, self.n_nodes):
+                self.subtract(self.node_voxels[i, 0], self.node_voxels[i, 1],
+                              self.node_voxels[i, 2])
+            for i in range(n_faces, self.n_faces):
+                self.subtract(self.face_voxels[i, 0], self.face_voxels[i, 1],
+                              self.face_voxels[i, 2])
+
+            for i in range(n_nodes):
+                self.place(self.node_voxels, i, i >= self.n_nodes, node_pos[i, 0],
+                           node_pos[i, 1], node_pos[i, 2])
+            for i in range(n_faces):
+                self.place(self.face_voxels, i, i >= self.n_faces,
+                           (node_pos[faces[i, 0], 0] + node_pos[faces[i, 1], 0] + node_pos[faces[i, 2], 0]) / 3,
+                           (node_pos[faces[i, 0], 1] + node_pos[faces[i, 1], 1] + node_pos[faces[i, 2], 1]) / 3,
+                           (node_pos[faces[i, 0], 2] + node_pos[faces[i, 1], 2] + node_pos[faces[i, 2], 2]) / 3)
+
+        self.n_nodes = n_nodes
+        self.n_faces = n_faces
+
+    cpdef tuple dense(self):
+        """ The node voxels, grid and grid origin create_voxel_grid would
+            return. The grid is a view cropped to the nodes and the padding,
+            so flood fills and kernels see the same borders no matter when
+            the grid was last rebuilt.
+        """
+        voxels = np.asarray(self.node_voxels[:self.n_nodes])
+        low = voxels.min(axis=0) - np.array(PAD_LOW, dtype='int32')
+        high = voxels.max(axis=0) + np.array(PAD_HIGH, dtype='int32') + 1
+        grid = np.asarray(self.grid)[low[0]:high[0], low[1]:high[1], low[2]:high[2]]
+        return (voxels - low).astype('int32'), grid, np.asarray(self.origin) + low
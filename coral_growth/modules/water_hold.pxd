@@ -0,0 +1,12 @@
+cdef class CellHeap:
+    cdef public double[:] keys
+    cdef public int[:] cells
+    cdef public int size
+
+    cdef void push(self, double key, int cell) noexcept nogil
+    cdef int pop(self, double *key) noexcept nogil
+
+cpdef double trap_rain_water(double[:, :] heights) except? -1
+cpdef void fill_faces(int[:, :, :] grid, double[:, :] node_pos, int[:, :] faces,
+                      int n_faces, int[:] origin, double voxel_length) except *
+cpdef int water_voxels(int[:, :, :] grid, int[:, :] node_voxels, double[:] node_water) except -1
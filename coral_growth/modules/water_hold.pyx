@@ -0,0 +1,259 @@
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: initializedcheck=False
+# cython: nonecheck=False
+# cython: cdivision=True
+from libc.math cimport fmax, fmin, fabs, floor
+import numpy as np
+
+cdef class CellHeap:
+    """ A binary min-heap of grid cells keyed by height, stored in arrays
+        with room for every cell to be in it once.
+    """
+    def __init__(self, int n_cells):
+        self.keys = np.zeros(max(1, n_cells), dtype='float64')
+        self.cells = np.zeros(max(1, n_cells), dtype='int32')
+        self.size = 0
+
+    cdef void push(self, double key, int cell) noexcept nogil:
+        cdef int parent
+        cdef int i = self.size
+        self.size += 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.keys[parent] <= key:
+                break
+            self.keys[i] = self.keys[parent]
+            self.cells[i] = self.cells[parent]
+            i = parent
+        self.keys[i] = key
+        self.cells[i] = cell
+
+    cdef int pop(self, double *key) noexcept nogil:
+        """ Remove the lowest cell, return it and write its key to key. """
+        cdef int i = 0, child
+        cdef int top = self.cells[0]
+        cdef double last_key
+        cdef int last_cell
+        key[0] = self.keys[0]
+        self.size -= 1
+        last_key = self.keys[self.size]
+        last_cell = self.cells[self.size]
+
+        while True:
+            child = 2*i + 1
+            if child >= self.size:
+                break
+            if child + 1 < self.size and self.keys[child+1] < self.keys[child]:
+                child += 1
+            if self.keys[child] >= last_key:
+                break
+            self.keys[i] = self.keys[child]
+            self.cells[i] = self.cells[child]
+            i = child
+        self.keys[i] = last_key
+        self.cells[i] = last_cell
+        return top
+
+cpdef double trap_rain_water(double[:, :] heights) except? -1:
+    """ Volume of rain water a height map holds, by flooding inwards from the
+        border in order of height (priority flood).
+    """
+    cdef int n = heights.shape[0]
+    cdef int m = heights.shape[1]
+    cdef int i, k, x, y, nx, ny, cell
+    cdef double h, ans = 0
+    cdef int[4] dx = [1, -1, 0, 0]
+    cdef int[4] dy = [0, 0, 1, -1]
+    cdef unsigned char[:, :] visit = np.zeros((n, m), dtype='uint8')
+    cdef CellHeap heap = CellHeap(n * m)
+
+    with nogil:
+        for x in range(n):
+            for y in range(m):
+                if x == 0 or y == 0 or x == n-1 or y == m-1:
+                    visit[x, y] = 1
+                    heap.push(heights[x, y], x*m + y)
+
+        while heap.size > 0:
+            cell = heap.pop(&h)
+            x = cell // m
+            y = cell % m
+            for k in range(4):
+                nx = x + dx[k]
+                ny = y + dy[k]
+                if 0 <= nx and nx < n and 0 <= ny and ny < m and not visit[nx, ny]:
+                    visit[nx, ny] = 1
+                    heap.push(fmax(h, heights[nx, ny]), nx*m + ny)
+                    ans += fmax(0, h - heights[nx, ny])
+
+    return ans
+
+cdef inline bint separates(double *axis, double *v0, double *v1, double *v2,
+                           double h) noexcept nogil:
+    """ Whether axis separates the triangle from the cube of half size h at
+        the origin.
+    """
+    cdef double p0 = axis[0]*v0[0] + axis[1]*v0[1] + axis[2]*v0[2]
+    cdef double p1 = axis[0]*v1[0] + axis[1]*v1[1] + axis[2]*v1[2]
+    cdef double p2 = axis[0]*v2[0] + axis[1]*v2[1] + axis[2]*v2[2]
+    cdef double r = h * (fabs(axis[0]) + fabs(axis[1]) + fabs(axis[2]))
+    return fmin(p0, fmin(p1, p2)) > r or fmax(p0, fmax(p1, p2)) < -r
+
+cdef bint triangle_box_overlap(double *v0, double *v1, double *v2, double h) noexcept nogil:
+    """ Separating axis test of a triangle against the closed cube of half
+        size h centered on the origin.
+    """
+    cdef int i, j
+    cdef double[3] axis
+    cdef double[3][3] edges
+    for j in range(3):
+        edges[0][j] = v1[j] - v0[j]
+        edges[1][j] = v2[j] - v1[j]
+        edges[2][j] = v0[j] - v2[j]
+
+    # The cube's face normals.
+    for j in range(3):
+        axis[0] = axis[1] = axis[2] = 0
+        axis[j] = 1
+        if separates(axis, v0, v1, v2, h):
+            return False
+
+    # The triangle's normal.
+    axis[0] = edges[0][1]*edges[1][2] - edges[0][2]*edges[1][1]
+    axis[1] = edges[0][2]*edges[1][0] - edges[0][0]*edges[1][2]
+    axis[2] = edges[0][0]*edges[1][1] - edges[0][1]*edges[1][0]
+    if separates(axis, v0, v1, v2, h):
+        return False
+
+    # Cross products of the edges with the cube's axes.
+    for i in range(3):
+        axis[0] = 0
+        axis[1] = edges[i][2]
+        axis[2] = -edges[i][1]
+        if separates(axis, v0, v1, v2, h):
+            return False
+        axis[0] = -edges[i][2]
+        axis[1] = 0
+        axis[2] = edges[i][0]
+        if separates(axis, v0, v1, v2, h):
+            return False
+        axis[0] = edges[i][1]
+        axis[1] = -edges[i][0]
+        axis[2] = 0
+        if separates(axis, v0, v1, v2, h):
+            return False
+
+    return True
+
+cpdef void fill_faces(int[:, :, :] grid, double[:, :] node_pos, int[:, :] faces,
+                      int n_faces, int[:] origin, double voxel_length) except *:
+    """ Mark every voxel of grid that one of the first n_faces faces passes
+        through, so a shell of node and face midpoint voxels has no gaps
+        where edges are longer than a voxel. origin is the voxel position of
+        grid[0, 0, 0]. Any 6-connected path of voxels through a closed mesh
+        then crosses a marked voxel.
+    """
+    cdef int f, j, k, x, y, z
+    cdef int[3] low, high
+    cdef double[3][3] tri, v
+    cdef int[3] shape = [grid.shape[0], grid.shape[1], grid.shape[2]]
+
+    with nogil:
+        for f in range(n_faces):
+            # The triangle in voxel units relative to the grid.
+            for j in range(3):
+                for k in range(3):
+                    tri[j][k] = node_pos[faces[f, j], k] / voxel_length - origin[k]
+            for k in range(3):
+                low[k] = max(0, <int>floor(fmin(tri[0][k], fmin(tri[1][k], tri[2][k]))))
+                high[k] = min(shape[k] - 1,
+                              <int>floor(fmax(tri[0][k], fmax(tri[1][k], tri[2][k]))))
+
+            for x in range(low[0], high[0]+1):
+                for y in range(low[1], high[1]+1):
+                    for z in range(low[2], high[2]+1):
+                        if grid[x, y, z]:
+                            continue
+                        for j in range(3):
+                            v[j][0] = tri[j][0] - x - 0.5
+                            v[j][1] = tri[j][1] - y - 0.5
+                            v[j][2] = tri[j][2] - z - 0.5
+                        if triangle_box_overlap(v[0], v[1], v[2], 0.5):
+                            grid[x, y, z] = 1
+
+cpdef int water_voxels(int[:, :, :] grid, int[:, :] node_voxels, double[:] node_water) except -1:
+    """ Fill a voxel grid with water from above and return how many empty
+        voxels keep it. The level of an empty voxel is the lowest height
+        water in it has to rise to on the way out of the grid through the
+        sides or top (priority flood from those faces, the bottom is the
+        ground), and it holds water if that is above it. Covered voxels
+        under an overhang drain sideways, and cavities sealed from outside
+        hold none. The grid should be closed with fill_faces. node_water[i]
+        is set to 1 if there is water within two voxels of node voxel i.
+    """
+    cdef int nx = grid.shape[0]
+    cdef int ny = grid.shape[1]
+    cdef int nz = grid.shape[2]
+    cdef int i, k, x, y, z, x2, y2, z2, cell
+    cdef int n_water = 0
+    cdef double level
+    cdef int[6] dx = [1, -1, 0, 0, 0, 0]
+    cdef int[6] dy = [0, 0, 1, -1, 0, 0]
+    cdef int[6] dz = [0, 0, 0, 0, 1, -1]
+    cdef unsigned char[:, :, :] visit = np.zeros((nx, ny, nz), dtype='uint8')
+    cdef unsigned char[:, :, :] water = np.zeros((nx, ny, nz), dtype='uint8')
+    cdef CellHeap heap = CellHeap(nx * ny * nz)
+
+    with nogil:
+        for x in range(nx):
+            for y in range(ny):
+                for z in range(nz):
+                    if not grid[x, y, z] and (x == 0 or z == 0 or x == nx-1 or \
+                                              z == nz-1 or y == ny-1):
+                        visit[x, y, z] = 1
+                        heap.push(y, (x*ny + y)*nz + z)
+
+        while heap.size > 0:
+            cell = heap.pop(&level)
+            z = cell % nz
+            y = (cell // nz) % ny
+            x = cell // (ny*nz)
+            for k in range(6):
+                x2 = x + dx[k]
+                y2 = y + dy[k]
+                z2 = z + dz[k]
+                if x2 < 0 or y2 < 0 or z2 < 0 or x2 >= nx or y2 >= ny or z2 >= nz:
+                    continue
+                if visit[x2, y2, z2] or grid[x2, y2, z2]:
+                    continue
+                visit[x2, y2, z2] = 1
+                if level > y2:
+                    water[x2, y2, z2] = 1
+                    n_water += 1
+                heap.push(fmax(level, y2), (x2*ny + y2)*nz + z2)
+
+        # Walls filled by fill_faces can be two voxels thick around a node.
+        for i in range(node_voxels.shape[0]):
+            node_water[i] = 0
+            x, y, z = node_voxels[i, 0], node_voxels[i, 1], node_voxels[i, 2]
+            for x2 in range(max(0, x-2), min(nx, x+3)):
+                for y2 in range(max(0, y-2), min(ny, y+3)):
+                    for z2 in range(max(0, z-2), min(nz, z+3)):
+                        if water[x2, y2, z2]:
+                            node_water[i] = 1
+
+    return n_water
+
+def water_hold(points, double grid_size):
+    """ Water held by the form whose vertex positions are points, from the
+        maximum height of the vertices in each grid_size column.
+    """
+    points = np.asarray(points)
+    x = (points[:, 0] / grid_size).astype('int64')
+    z = (points[:, 2] / grid_size).astype('int64')
+    x -= x.min()
+    z -= z.min()
+    heights = np.zeros((x.max() + 1, z.max() + 1))
+    np.maximum.at(heights, (x, z), points[:, 1])
+    return trap_rain_water(heights)
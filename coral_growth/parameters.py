@@ -18,6 +18,7 @@ class Parameters(object):
 
         # Coral Growth.
         self.seed_type = 1 # 0 is flat bottom and 1 is round, use 0 with 'has_ground'
+        self.seed_cache = False # Build seed meshes from arrays kept in memory instead of parsing the obj.
 
         self.max_nodes = 15000
         self.max_volume = 200.0
@@ -35,6 +36,13 @@ class Parameters(object):
         self.n_morphogens = 2
         self.morphogen_thresholds = 3
         self.morphogen_steps = 200
+        self.morphogen_tolerance = 0.0 # Stop morphogen steps early when changes are below this.
+        self.morphogen_solver = 0 # 0 is explicit and 1 is semi-implicit (uses morphogen_dt).
+        self.morphogen_dt = 6.0
+        self.morphogen_cg_iterations = 1 # Cap on the conjugate gradient iterations per semi-implicit solve.
+        self.n_threads = 1 # Threads for the parallel kernels, 0 uses every core.
+        self.local_updates = 0 # 0 recomputes the whole mesh each step with cymesh. 1 recomputes only nodes that moved and their neighbors with the mesh_local kernels, whose curvature and relaxation are not cymesh's, so it grows different forms. 2 is 1 but also recomputes every node with the same kernels and sets local_error to the difference.
+        self.array_mesh = False # Keep the mesh in flat half-edge arrays (ArrayMesh) instead of cymesh objects. Needs local_updates.
 
         self.use_gravity = True
         self.use_polar_direction = True
@@ -42,9 +50,23 @@ class Parameters(object):
 
         # These are coral specific and should get re-factored somewhere...
         self.light_amount = 0.7
+        self.light_method = 0 # 0 buckets faces in a hash, 1 rasterizes a height map, 2 is a sky dome.
+        self.light_resolution = 0.5 # Height map pixel size relative to target_edge_len.
+        self.light_directions = 8 # Directions sampled from the sky when light_method is 2.
+        self.light_sky_angle = 60.0 # Degrees from vertical of the lowest sampled direction.
         self.gradient_height = 6.0
         self.gradient_bottom = 0.2
         self.collection_radius = 5
+        self.collection_convolve = False # Compute collection with grid convolutions, cost independent of radius.
+        self.incremental_voxels = False # Keep the collection voxel grid between steps.
+        self.sparse_voxels = False # Store the collection voxel grid as bricks allocated on demand, can not be combined with the two above.
+        self.use_flow = False # Collection from a lattice-Boltzmann flow field instead of exposure, the three above are then unused.
+        self.flow_velocity = 0.05 # Inflow speed in lattice units.
+        self.flow_tau = 0.6 # Lattice-Boltzmann relaxation time, sets the viscosity.
+        self.flow_steps = 10 # Sweeps per growth step, the field is kept from the last step.
+        self.flow_warmup_steps = 200 # Sweeps the first time, from uniform flow.
+        self.flow_collection_scale = 7.0 # Flow collection is the speed near a node over the inflow speed, this brings its mean to that of exposure collection (collection_radius 5) so light_amount weighs both the same.
+        self.voxel_water = False # Cups hold water in 3D voxels, this also sets holding_water.
 
         self.addTrait('energy_diffuse_steps', (0, 8), 'int')
 
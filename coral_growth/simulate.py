@@ -1,7 +1,7 @@
 import os
 import time
 import MultiNEAT as NEAT
-
+from coral_growth.compiled_network import CompiledNetwork
 
 
 def export(form, folder, pi, s):
@@ -9,7 +9,18 @@ def export(form, folder, pi, s):
     form.export(path)
 
 def simulate_network(Form, network, net_depth, traits, all_params, \
-                     export_folder=None, verbose=False):
+                     export_folder=None, verbose=False, compile_network=False,
+                     checkpoints=None, checkpoint_folder=None):
+    """ If compile_network is set the network is evaluated for all nodes at
+        once with a CompiledNetwork instead of node by node.
+        checkpoints is an optional list with a state file (or None) per params
+        to continue from, the run then starts at the step it was saved at.
+        If checkpoint_folder is set the final state of each form is saved
+        there as <pi>.state.npz.
+    """
+    if compile_network:
+        network = CompiledNetwork(network, net_depth)
+
     forms = []
     for pi, params in enumerate(all_params):
 
@@ -20,15 +31,18 @@ def simulate_network(Form, network, net_depth, traits, all_params, \
 
         form = Form(obj_path, network, net_depth, traits, params)
 
+        if checkpoints and checkpoints[pi]:
+            form.loadState(checkpoints[pi])
+
         if export_folder:
-            os.mkdir(os.path.join(export_folder, str(pi)))
-            export(form, export_folder, pi, 0)
+            os.makedirs(os.path.join(export_folder, str(pi)), exist_ok=True)
+            export(form, export_folder, pi, form.age)
 
         if verbose:
             print('Initial Fitness', form.fitness())
             print()
 
-        for s in range(params.max_steps):
+        for s in range(form.age, params.max_steps):
             step_start = time.time()
             form.step()
 
@@ -47,13 +61,18 @@ def simulate_network(Form, network, net_depth, traits, all_params, \
             if form.volume >= params.max_volume:
                 break
 
+        if checkpoint_folder:
+            form.saveState(os.path.join(checkpoint_folder, '%i.state.npz' % pi))
+
         forms.append(form)
 
     return forms
 
-def simulate_genome(Form, genome, traits, params, export_folder=None, verbose=False):
+def simulate_genome(Form, genome, traits, params, export_folder=None, verbose=False,
+                    compile_network=False, checkpoints=None, checkpoint_folder=None):
     network = NEAT.NeuralNetwork()
     genome.BuildPhenotype(network)
     genome.CalculateDepth()
     depth = genome.GetDepth()
-    return simulate_network(Form, network, depth, traits, params, export_folder, verbose)
+    return simulate_network(Form, network, depth, traits, params, export_folder, verbose,
+                            compile_network, checkpoints, checkpoint_folder)
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 import os
+import sys
+import shutil
+import tempfile
 import numpy
 from setuptools import setup, find_packages
 from Cython.Build import cythonize
@@ -12,6 +15,38 @@ def find_pyx(path='.'):
                 pyx_files.append(os.path.join(root, fname))
     return pyx_files
 
+def openmp_flags():
+    """ Compile and link flags for OpenMP, or none if the compiler does not
+        support it. The prange kernels then build as serial loops.
+    """
+    from distutils.ccompiler import new_compiler
+    from distutils.errors import CompileError, LinkError
+    flag = '/openmp' if sys.platform == 'win32' else '-fopenmp'
+    tmp = tempfile.mkdtemp()
+    src = os.path.join(tmp, 'test_openmp.c')
+    with open(src, 'w') as f:
+        f.write('#include <omp.h>\nint main(void) { return omp_get_max_threads() < 1; }\n')
+    compiler = new_compiler()
+    try:
+        objects = compiler.compile([src], output_dir=tmp, extra_postargs=[flag])
+        compiler.link_executable(objects, os.path.join(tmp, 'test_openmp'),
+                                 extra_postargs=[flag])
+    except (CompileError, LinkError):
+        print('OpenMP is not available, kernels will run on one thread.')
+        return [], []
+    finally:
+        shutil.rmtree(tmp)
+    return [flag], ([] if sys.platform == 'win32' else [flag])
+
+extensions = cythonize(
+    find_pyx(),
+    include_path = [numpy.get_include()],
+)
+compile_args, link_args = openmp_flags()
+for extension in extensions:
+    extension.extra_compile_args += compile_args
+    extension.extra_link_args += link_args
+
 setup(
     name = "coral-growth",
     version = '0.1.0',
@@ -22,10 +57,7 @@ setup(
     include_dirs = [numpy.get_include()],
 
     packages = find_packages(),
-    ext_modules = cythonize(
-        find_pyx(),
-        include_path = [numpy.get_include()],
-    ),
+    ext_modules = extensions,
     include_package_data = True,
     package_data = {
         'cymesh': ['*.pxd'],
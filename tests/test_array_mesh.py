@@ -0,0 +1,176 @@
+""" Check that ArrayMesh keeps a valid half-edge structure through splits and
+    flips, agrees with the mesh_local kernels and round trips through obj.
+"""
+import os
+from math import pi
+import numpy as np
+from coral_growth.modules.array_mesh import ArrayMesh
+from tests.test_mesh_local import Attributes, neighbor_index, upper_half
+from tests.test_water_hold import load_obj
+
+SEED = os.path.join(os.path.dirname(__file__), '..', 'data', 'triangulated_sphere_2.obj')
+
+def check_half_edges(mesh):
+    n_he = 3 * mesh.n_faces
+    vert = np.asarray(mesh.he_vert)[:n_he]
+    nxt = np.asarray(mesh.he_next)[:n_he]
+    twin = np.asarray(mesh.he_twin)[:n_he]
+    he = np.arange(n_he)
+
+    assert np.array_equal(nxt, he - he % 3 + (he + 1) % 3)
+    assert np.array_equal(np.asarray(mesh.he_face)[:n_he], he // 3)
+    assert np.array_equal(np.asarray(mesh.face_he)[:mesh.n_faces], 3 * np.arange(mesh.n_faces))
+    faces = vert.reshape(-1, 3)
+    assert (faces[:, 0] != faces[:, 1]).all() and (faces[:, 1] != faces[:, 2]).all() and \
+           (faces[:, 2] != faces[:, 0]).all()
+
+    # Twins run the other way along the same edge.
+    inner = he[twin != -1]
+    assert np.array_equal(twin[twin[inner]], inner)
+    assert np.array_equal(vert[twin[inner]], vert[nxt[inner]])
+    assert np.array_equal(vert[nxt[twin[inner]]], vert[inner])
+
+    # No edge is in two faces the same way, every vertex has a half-edge.
+    edges = np.stack([vert, vert[nxt]], axis=1)
+    assert np.unique(edges, axis=0).shape[0] == n_he
+    vert_he = np.asarray(mesh.vert_he)[:mesh.n_verts]
+    assert np.array_equal(vert[vert_he], np.arange(mesh.n_verts))
+    assert mesh.n_edges == (twin == -1).sum() + (twin != -1).sum() // 2
+
+def check_rings(mesh):
+    faces = mesh.faces()
+    offsets, indices = mesh._csr()
+    expected_offsets, expected_indices = neighbor_index(mesh.n_verts, faces)
+    assert np.array_equal(offsets, expected_offsets)
+    face_set = set(map(tuple, faces.tolist()))
+    for v in range(mesh.n_verts):
+        ring = mesh.neighbors(v)
+        assert ring == list(indices[offsets[v]:offsets[v+1]])
+        assert sorted(ring) == list(expected_indices[offsets[v]:offsets[v+1]])
+        # Counter clockwise, consecutive neighbors make a face with v.
+        for a, b in zip(ring, ring[1:] + ring[:1]):
+            if (v, a, b) in face_set or (a, b, v) in face_set or (b, v, a) in face_set:
+                continue
+            assert a == ring[-1] and b == ring[0], 'Ring of %i is out of order.' % v
+
+def rotated(faces):
+    """ Faces as a set, each rotated to start at its smallest vertex. """
+    return { tuple(np.roll(f, -np.argmin(f))) for f in faces.tolist() }
+
+def signed_volume(pos, faces):
+    a, b, c = pos[faces[:, 0]], pos[faces[:, 1]], pos[faces[:, 2]]
+    return (a * np.cross(b, c)).sum() / 6
+
+def random_splits(mesh, rng, n):
+    for _ in range(n):
+        n_verts, n_faces = mesh.n_verts, mesh.n_faces
+        f = rng.randint(n_faces)
+        centroid = np.asarray(mesh.pos)[mesh.faces()[f]].mean(axis=0)
+        assert mesh.split(f) == n_verts
+        assert mesh.n_verts == n_verts + 1 and mesh.n_faces == n_faces + 2
+        assert np.allclose(mesh.pos[n_verts], centroid)
+        check_half_edges(mesh)
+
+def test_split_closed():
+    points, faces = load_obj(SEED)
+    mesh = ArrayMesh(points, faces, max_verts=2000)
+    random_splits(mesh, np.random.RandomState(0), 600)
+    check_rings(mesh)
+
+    pos = np.asarray(mesh.pos)[:mesh.n_verts]
+    assert mesh.n_verts - mesh.n_edges + mesh.n_faces == 2
+    assert np.isclose(mesh.volume(), signed_volume(pos, mesh.faces()))
+    assert np.allclose(mesh.edge_lengths().sum(), sum(
+        np.linalg.norm(pos[v] - pos[mesh.neighbors(v)], axis=1).sum()
+        for v in range(mesh.n_verts)) / 2)
+
+    # Gauss-Bonnet, a sphere has Euler characteristic 2.
+    defect = np.zeros(mesh.n_verts)
+    mesh.calculate_defect(defect)
+    assert abs(defect.sum() - 4*pi) < 1e-9
+
+def test_split_open():
+    points, faces = upper_half(*load_obj(SEED))
+    mesh = ArrayMesh(points, faces, max_verts=2000)
+    random_splits(mesh, np.random.RandomState(1), 600)
+    check_rings(mesh)
+    assert mesh.n_verts - mesh.n_edges + mesh.n_faces == 1
+
+    # A disk has Euler characteristic 1, boundary defects are pi - angles.
+    defect = np.zeros(mesh.n_verts)
+    mesh.calculate_defect(defect)
+    assert abs(defect.sum() - 2*pi) < 1e-9
+
+def test_split_aliases_pos():
+    points, faces = load_obj(SEED)
+    pos = np.zeros((points.shape[0] + 1, 3))
+    mesh = ArrayMesh(points, faces, pos)
+    assert np.array_equal(pos[:points.shape[0]], points)
+    assert mesh.split(0) == points.shape[0]
+    assert pos[-1].any()
+    assert mesh.split(0) == -1
+    assert mesh.n_verts == pos.shape[0]
+    check_half_edges(mesh)
+
+def test_flip():
+    points, faces = upper_half(*load_obj(SEED))
+    mesh = ArrayMesh(points, faces)
+    rng = np.random.RandomState(2)
+    twin = np.asarray(mesh.he_twin)
+    assert not mesh.flip(int(np.flatnonzero(twin[:3*mesh.n_faces] == -1)[0]))
+
+    n_flipped = 0
+    for h in rng.permutation(3 * mesh.n_faces):
+        before = mesh.faces().copy()
+        t = mesh.he_twin[h]
+        if not mesh.flip(h):
+            continue
+        n_flipped += 1
+        check_half_edges(mesh)
+        # The new diagonal is the last edge of the face of h and stays there,
+        # flipping it back restores the faces.
+        fh = 3 * (h // 3)
+        assert mesh.he_twin[fh+2] == 3 * (t // 3) + 2
+        after = mesh.faces().copy()
+        assert mesh.flip(fh+2)
+        assert rotated(mesh.faces()) == rotated(before)
+        assert mesh.flip(fh+2)
+        assert rotated(mesh.faces()) == rotated(after)
+        check_half_edges(mesh)
+
+    assert n_flipped > mesh.n_edges // 2
+    check_rings(mesh)
+    assert mesh.n_verts - mesh.n_edges + mesh.n_faces == 1
+
+def test_attributes_match_mesh_local():
+    points, faces = load_obj(SEED)
+    mesh = ArrayMesh(points, faces, max_verts=500)
+    random_splits(mesh, np.random.RandomState(3), 100)
+    n = mesh.n_verts
+    expected = Attributes(np.array(mesh.pos[:n]), mesh.faces().copy())
+
+    normals = np.zeros((n, 3))
+    defect = np.zeros(n)
+    curvature = np.zeros(n)
+    mesh.calculate_normals(normals)
+    mesh.calculate_defect(defect)
+    mesh.calculate_curvature(normals, curvature)
+    assert np.array_equal(normals, expected.normal)
+    assert np.array_equal(defect, expected.defect)
+    # Curvature sums the neighbors in ring order, not sorted.
+    assert np.allclose(curvature, expected.curvature, rtol=0, atol=1e-12)
+
+def test_obj_round_trip(tmpdir):
+    points, faces = load_obj(SEED)
+    mesh = ArrayMesh.from_obj(SEED, max_verts=500)
+    assert np.allclose(mesh.pos[:mesh.n_verts], points)
+    assert np.array_equal(mesh.faces(), faces)
+
+    random_splits(mesh, np.random.RandomState(4), 100)
+    path = str(tmpdir.join('mesh.obj'))
+    mesh.export(path)
+    loaded = ArrayMesh.from_obj(path)
+    assert loaded.n_verts == mesh.n_verts and loaded.n_edges == mesh.n_edges
+    assert np.allclose(loaded.pos[:loaded.n_verts], mesh.pos[:mesh.n_verts], atol=1e-6)
+    assert np.array_equal(loaded.faces(), mesh.faces())
+    check_half_edges(loaded)
@@ -0,0 +1,59 @@
+""" Check that CompiledNetwork gives the same outputs as evaluating the
+    MultiNEAT network node by node, as GrowthForm.grow does without it.
+"""
+import numpy as np
+import pytest
+NEAT = pytest.importorskip('MultiNEAT')
+from coral_growth.compiled_network import CompiledNetwork
+
+def create_population(n_inputs, n_hidden, n_outputs, allow_loops):
+    params = NEAT.Parameters()
+    params.PopulationSize = 20
+    params.MutateAddNeuronProb = 0.3
+    params.MutateAddLinkProb = 0.3
+    params.AllowLoops = allow_loops
+    genome = NEAT.Genome(0, n_inputs, n_hidden, n_outputs, False,
+                         NEAT.ActivationFunction.UNSIGNED_SIGMOID,
+                         NEAT.ActivationFunction.UNSIGNED_SIGMOID,
+                         1, params, 1)
+    return NEAT.Population(genome, params, True, 1.0, 0)
+
+def reference_outputs(network, depth, inputs):
+    """ The per-node loop of GrowthForm.grow. """
+    outputs = []
+    for row in inputs:
+        network.Flush()
+        network.Input(row)
+        for _ in range(depth):
+            network.ActivateFast()
+        outputs.append(network.Output())
+    return np.array(outputs)
+
+def check_population(allow_loops):
+    n_inputs, n_outputs = 6, 3
+    pop = create_population(n_inputs, 4, n_outputs, allow_loops)
+    rng = np.random.RandomState(0)
+    inputs = rng.uniform(-1, 1, (50, n_inputs))
+    inputs[:, -1] = 1 # Bias input.
+
+    for generation in range(5):
+        genomes = NEAT.GetGenomeList(pop)
+        for genome in genomes:
+            network = NEAT.NeuralNetwork()
+            genome.BuildPhenotype(network)
+            genome.CalculateDepth()
+            depth = genome.GetDepth()
+
+            expected = reference_outputs(network, depth, inputs)
+            result = CompiledNetwork(network, depth).activate(inputs)
+            assert np.allclose(result, expected, rtol=1e-9, atol=1e-12)
+
+        # Random fitness, the epochs only add structure.
+        NEAT.ZipFitness(genomes, rng.uniform(0, 1, len(genomes)).tolist())
+        pop.Epoch()
+
+def test_feed_forward_matches_multineat():
+    check_population(allow_loops=False)
+
+def test_recurrent_matches_multineat():
+    check_population(allow_loops=True)
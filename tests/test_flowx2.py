@@ -0,0 +1,75 @@
+""" Check the flowx2 flood fill and collection against the list based and
+    splatting versions they replaced.
+"""
+import numpy as np
+from coral_growth.modules.flowx2 import FloodFillWorkspace, flood_fill, sphere_kernel, \
+                                        calculate_collection
+
+def reference_flood_fill(grid):
+    """ The list based fill flowx2.flood_fill used to be. """
+    nx, ny, nz = grid.shape
+    seen = np.zeros_like(grid)
+    result = np.zeros_like(grid)
+    current = [(0, 0, 0)]
+    while current:
+        x, y, z = current.pop()
+        seen[x, y, z] = 1
+        if not grid[x, y, z]:
+            result[x, y, z] = 1
+            for dx, dy, dz in ((-1, 0, 0), (1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, -1), (0, 0, 1)):
+                x2, y2, z2 = x + dx, y + dy, z + dz
+                if x2 < 0 or y2 < 0 or z2 < 0 or x2 > nx-1 or y2 > ny-1 or z2 > nz-1:
+                    continue
+                if seen[x2, y2, z2]:
+                    continue
+                current.append((x2, y2, z2))
+    return result
+
+def reference_collection(voxels, grid, radius):
+    """ The splatting loops of calculate_collection before convolve. """
+    nx, ny, nz = grid.shape
+    w = 2*radius + 1
+    kernel = sphere_kernel(radius)
+    outside = reference_flood_fill(grid)
+    counts = np.zeros(grid.shape)
+
+    def window(x, y, z):
+        """ The kernel cells around (x, y, z) that are inside [0, n-1). """
+        for dx, dy, dz in np.ndindex(w, w, w):
+            x2, y2, z2 = x + dx - radius, y + dy - radius, z + dz - radius
+            if 0 <= x2 < nx-1 and 0 <= y2 < ny-1 and 0 <= z2 < nz-1:
+                yield kernel[dx, dy, dz], (x2, y2, z2)
+
+    for x, y, z in voxels:
+        for k, cell in window(x, y, z):
+            counts[cell] += k
+    collection = np.zeros(voxels.shape[0])
+    for i, (x, y, z) in enumerate(voxels):
+        collection[i] = sum(k * outside[cell] / (1 + counts[cell]) for k, cell in window(x, y, z))
+    return collection / w**3
+
+def random_grids(rng, n):
+    for _ in range(n):
+        shape = rng.randint(1, 14, 3)
+        yield (rng.uniform(0, 1, shape) < rng.uniform(0.1, 0.6)).astype('uint8')
+
+def test_flood_fill_matches_list_fill():
+    rng = np.random.RandomState(0)
+    workspace = FloodFillWorkspace()
+    for grid in random_grids(rng, 100):
+        expected = reference_flood_fill(grid)
+        # Grids of every size share the workspace, as in Coral.
+        assert np.array_equal(np.asarray(flood_fill(grid, workspace)), expected)
+        assert np.array_equal(np.asarray(flood_fill(grid)), expected)
+
+def test_collection_matches_splatting():
+    rng = np.random.RandomState(1)
+    for radius in (1, 2, 3):
+        for grid in random_grids(rng, 5):
+            grid[0, 0, 0] = 0
+            voxels = np.argwhere(grid).astype('int32')
+            expected = reference_collection(voxels, grid, radius)
+            for convolve in (False, True):
+                collection = np.zeros(voxels.shape[0])
+                calculate_collection(collection, voxels, grid, radius, None, convolve)
+                assert np.allclose(collection, expected, rtol=1e-5, atol=1e-7)
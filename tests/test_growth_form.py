@@ -0,0 +1,133 @@
+""" Check that forms built or restored from cached data match forms simulated
+    from scratch, and that the array mesh stays in step with the node arrays.
+"""
+import os
+import numpy as np
+import pytest
+pytest.importorskip('cymesh')
+NEAT = pytest.importorskip('MultiNEAT')
+from coral_growth import growth_form
+from coral_growth.growth_form import GrowthForm
+from coral_growth.forms.coral import Coral
+from coral_growth.parameters import Parameters
+
+SEED = os.path.join(os.path.dirname(__file__), '..', 'data', 'triangulated_sphere_2.obj')
+
+class Form(GrowthForm):
+    def __init__(self, obj_path, network, net_depth, traits, params):
+        super().__init__([], obj_path, network, net_depth, traits, params)
+
+def create_params(**kwargs):
+    params = Parameters()
+    params.max_nodes = 2000
+    params.morphogen_steps = 20
+    for key, value in kwargs.items():
+        setattr(params, key, value)
+    return params
+
+def create_network(form_class, params):
+    """ A random network with the inputs and outputs of form_class. """
+    n_inputs, n_outputs = form_class.calculate_inouts(params)
+    genome = NEAT.Genome(0, n_inputs, 0, n_outputs, False,
+                         NEAT.ActivationFunction.UNSIGNED_SIGMOID,
+                         NEAT.ActivationFunction.UNSIGNED_SIGMOID, 1, params.neat, 0)
+    pop = NEAT.Population(genome, params.neat, True, 1.0, 0)
+    genome = NEAT.GetGenomeList(pop)[0]
+    network = NEAT.NeuralNetwork()
+    genome.BuildPhenotype(network)
+    genome.CalculateDepth()
+    return network, genome.GetDepth()
+
+def create_traits(params):
+    traits = { 'energy_diffuse_steps': 2 }
+    for i in range(params.n_signals):
+        traits['signal_diffuse_steps%i' % i] = i + 1
+    for i in range(params.n_morphogens):
+        traits['K%i' % i] = 0.06
+        traits['F%i' % i] = 0.04
+        traits['diffU%i' % i] = 0.01
+        traits['diffV%i' % i] = 0.005
+    return traits
+
+def create_form(params, form_class=Form):
+    network, depth = create_network(form_class, params)
+    return form_class(SEED, network, depth, create_traits(params), params)
+
+def assert_same_state(a, b):
+    n = a.n_nodes
+    assert b.n_nodes == n and b.n_faces == a.n_faces and b.age == a.age
+    nnz = a.neighbor_offsets[n]
+    assert np.array_equal(a.neighbor_offsets[:n+1], b.neighbor_offsets[:n+1])
+    assert np.array_equal(a.neighbor_indices[:nnz], b.neighbor_indices[:nnz])
+    assert np.array_equal(a.face_verts[:a.n_faces], b.face_verts[:b.n_faces])
+    for name, arr in a.nodeArrays().items():
+        assert np.array_equal(arr[:n], b.nodeArrays()[name][:n], equal_nan=True), name
+    assert np.array_equal(np.asarray(a.morphogens.U)[:, :n], np.asarray(b.morphogens.U)[:, :n])
+    assert np.array_equal(np.asarray(a.morphogens.V)[:, :n], np.asarray(b.morphogens.V)[:, :n])
+    if a.array_mesh:
+        assert np.array_equal(a.mesh.faces(), b.mesh.faces())
+        assert np.array_equal(np.asarray(a.mesh.vert_he)[:n], np.asarray(b.mesh.vert_he)[:n])
+    else:
+        assert [ v.defect for v in a.mesh.verts ] == [ v.defect for v in b.mesh.verts ]
+        assert [ v.curvature for v in a.mesh.verts ] == [ v.curvature for v in b.mesh.verts ]
+
+def check_seed_cache(**kwargs):
+    growth_form.seed_cache.clear()
+    uncached = create_form(create_params(**kwargs))
+    create_form(create_params(seed_cache=True, **kwargs)) # Fills the cache.
+    cached = create_form(create_params(seed_cache=True, **kwargs))
+    assert len(growth_form.seed_cache) == 1
+
+    assert_same_state(uncached, cached)
+    for _ in range(5):
+        uncached.step()
+        cached.step()
+    assert_same_state(uncached, cached)
+
+def test_seed_cache_matches_obj():
+    check_seed_cache()
+
+def test_seed_cache_matches_obj_array():
+    check_seed_cache(local_updates=1, array_mesh=True)
+
+def check_resume(params, tmpdir):
+    path = str(tmpdir.join('state.npz'))
+    straight = create_form(params, Coral)
+    for _ in range(4):
+        straight.step()
+    straight.saveState(path)
+    for _ in range(4):
+        straight.step()
+
+    resumed = create_form(params, Coral)
+    resumed.loadState(path)
+    for _ in range(4):
+        resumed.step()
+
+    assert_same_state(straight, resumed)
+    assert np.array_equal(np.asarray(straight.flow.f), np.asarray(resumed.flow.f))
+    assert straight.flow.n_sweeps == resumed.flow.n_sweeps
+
+def test_resume_matches_straight_run(tmpdir):
+    check_resume(create_params(use_flow=True, flow_warmup_steps=20), tmpdir)
+
+def test_resume_matches_straight_run_local(tmpdir):
+    check_resume(create_params(use_flow=True, flow_warmup_steps=20, local_updates=1), tmpdir)
+
+def test_resume_matches_straight_run_array(tmpdir):
+    check_resume(create_params(use_flow=True, flow_warmup_steps=20, local_updates=1,
+                               array_mesh=True), tmpdir)
+
+def test_array_mesh_matches_node_arrays():
+    form = create_form(create_params(local_updates=1, array_mesh=True), Coral)
+    n_start = form.n_nodes
+    for _ in range(8):
+        form.step()
+    n = form.n_nodes
+    assert n > n_start and form.mesh.n_verts == n and form.mesh.n_faces == form.n_faces
+    assert np.shares_memory(np.asarray(form.node_pos), np.asarray(form.mesh.pos))
+    assert np.array_equal(form.mesh.faces(), form.face_verts[:form.n_faces])
+    for i in range(n):
+        ring = form.neighbor_indices[form.neighbor_offsets[i]:form.neighbor_offsets[i+1]]
+        assert list(ring) == form.mesh.neighbors(i)
+    assert np.isclose(form.volume, form.mesh.volume())
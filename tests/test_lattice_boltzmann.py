@@ -0,0 +1,61 @@
+""" Check that a LatticeBoltzmann restored from get_state continues exactly as
+    the one it was taken from, as Coral.loadState relies on, and that its
+    collection is on the scale Parameters.flow_collection_scale assumes.
+"""
+import os
+import numpy as np
+from coral_growth.modules.lattice_boltzmann import LatticeBoltzmann
+from coral_growth.modules.flowx2 import calculate_collection
+from tests.test_voxel_grid import reference_voxel_grid
+from tests.test_water_hold import load_obj
+
+DIR = os.path.dirname(__file__)
+
+def test_state_round_trip():
+    grid = np.zeros((6, 5, 6), dtype='int32')
+    grid[2:4, :3, 2:4] = 1
+    origin = np.array([-3, 0, -3], dtype='int32')
+    voxels = np.argwhere(grid).astype('int32')
+
+    flow = LatticeBoltzmann()
+    flow.set_grid(grid, origin)
+    flow.run(20)
+    state = { key: np.array(value) for key, value in flow.get_state().items() }
+    restored = LatticeBoltzmann()
+    restored.set_state(state)
+
+    # The coral grows a voxel, both lattices move and run on.
+    grid[2:4, 3, 2:4] = 1
+    expected = np.zeros(voxels.shape[0])
+    result = np.zeros(voxels.shape[0])
+    for lattice, collection in ((flow, expected), (restored, result)):
+        lattice.set_grid(grid, origin)
+        lattice.run(10)
+        lattice.collection(collection, voxels, origin)
+
+    assert restored.n_sweeps == flow.n_sweeps == 30
+    assert np.array_equal(np.asarray(restored.f), np.asarray(flow.f))
+    assert np.array_equal(result, expected)
+    assert expected.max() > 0
+
+def test_collection_scale():
+    """ Exposure collection (times 100 in Coral) averages about 7 times the
+        flow collection on seed meshes, the default flow_collection_scale.
+    """
+    for path in ('../data/triangulated_sphere_3.obj', '../data/half_sphere_smooth4.obj',
+                 'cup.obj', 'cup2.obj'):
+        node_pos, faces = load_obj(os.path.join(DIR, path))
+        edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+        voxel_length = np.linalg.norm(node_pos[edges[:, 0]] - node_pos[edges[:, 1]], axis=1).mean()
+        node_pos[:, 1] -= node_pos[:, 1].min()
+        voxels, grid, origin = reference_voxel_grid(node_pos, faces, voxel_length)
+
+        exposure = np.zeros(node_pos.shape[0])
+        calculate_collection(exposure, voxels, grid, 5)
+        flow = LatticeBoltzmann()
+        flow.set_grid(grid.astype('int32'), origin)
+        flow.run(200)
+        collection = np.zeros(node_pos.shape[0])
+        flow.collection(collection, voxels, origin)
+
+        assert 5 < 100 * exposure.mean() / collection.mean() < 9
@@ -0,0 +1,97 @@
+""" Check that updating the attributes of the region around moved nodes, as
+    GrowthForm does with local_updates, gives the same values as
+    recalculating every node.
+"""
+import os
+from math import pi
+import numpy as np
+from coral_growth.modules import mesh_local
+from tests.test_water_hold import load_obj
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+def neighbor_index(n, faces):
+    """ The compressed sparse row neighbor index of GrowthForm. """
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)
+    offsets = np.zeros(n + 1, dtype='int32')
+    offsets[1:] = np.cumsum(np.bincount(edges[:, 0], minlength=n))
+    return offsets, edges[:, 1].astype('int32')
+
+def corner_lists(n, faces):
+    """ The corner lists of GrowthForm, corner 3f+j is vertex j of face f. """
+    node_corner = np.full(n, -1, dtype='int32')
+    corner_next = np.full(3*faces.shape[0], -1, dtype='int32')
+    for c, v in enumerate(faces.ravel()):
+        corner_next[c] = node_corner[v]
+        node_corner[v] = c
+    return node_corner, corner_next
+
+class Attributes(object):
+    """ The arrays GrowthForm keeps for the mesh_local kernels. """
+    def __init__(self, pos, faces):
+        n = pos.shape[0]
+        self.pos = pos
+        self.faces = faces
+        self.offsets, self.indices = neighbor_index(n, faces)
+        self.node_corner, self.corner_next = corner_lists(n, faces)
+        self.prev = self.pos.copy()
+        self.dirty = np.zeros(n, dtype='uint8')
+        self.in_region = np.zeros(n, dtype='uint8')
+        self.region = np.zeros(n, dtype='int32')
+        self.normal = np.zeros((n, 3))
+        self.defect = np.zeros(n)
+        self.curvature = np.zeros(n)
+        self.calculate(np.arange(n, dtype='int32'))
+
+    def calculate(self, region):
+        mesh_local.vertex_normals(self.pos, self.faces, self.node_corner, self.corner_next,
+                                  region, region.shape[0], self.normal)
+        mesh_local.vertex_defects(self.pos, self.faces, self.node_corner, self.corner_next,
+                                  region, region.shape[0], self.offsets, self.defect)
+        mesh_local.vertex_curvature(self.pos, self.normal, self.offsets, self.indices,
+                                    region, region.shape[0], self.curvature)
+
+    def update(self):
+        n = self.pos.shape[0]
+        n_region = mesh_local.mark_region(self.pos, self.prev, self.dirty, n, self.offsets,
+                                          self.indices, self.in_region, self.region)
+        self.calculate(self.region[:n_region])
+        mesh_local.clear_region(self.pos, self.prev, self.dirty, self.region, n_region)
+        return n_region
+
+def upper_half(pos, faces):
+    """ The faces above y = 0, an open mesh. """
+    faces = faces[pos[faces, 1].mean(axis=1) > 0]
+    used, faces = np.unique(faces, return_inverse=True)
+    return pos[used], faces.reshape(-1, 3).astype('int32')
+
+def check_region_updates(pos, faces):
+    rng = np.random.RandomState(0)
+    attributes = Attributes(pos, faces)
+    n = attributes.pos.shape[0]
+
+    for _ in range(20):
+        moved = rng.choice(n, n // 20, replace=False)
+        attributes.pos[moved] += rng.normal(0, 0.01, (moved.shape[0], 3))
+        n_region = attributes.update()
+        assert n_region < n
+
+        expected = Attributes(attributes.pos.copy(), faces)
+        assert np.array_equal(attributes.normal, expected.normal)
+        assert np.array_equal(attributes.defect, expected.defect)
+        assert np.array_equal(attributes.curvature, expected.curvature)
+
+    return attributes
+
+def test_region_updates_closed():
+    pos, faces = load_obj(os.path.join(DATA, 'triangulated_sphere_2.obj'))
+    attributes = check_region_updates(pos, faces)
+    # Gauss-Bonnet, a sphere has Euler characteristic 2.
+    assert abs(attributes.defect.sum() - 4*pi) < 1e-9
+
+def test_region_updates_open():
+    pos, faces = load_obj(os.path.join(DATA, 'triangulated_sphere_2.obj'))
+    attributes = check_region_updates(*upper_half(pos, faces))
+    # A disk has Euler characteristic 1, boundary defects are pi - angles.
+    assert abs(attributes.defect.sum() - 2*pi) < 1e-9
@@ -0,0 +1,59 @@
+""" Check that capping the CG iterations of the semi-implicit morphogen solver
+    keeps its patterns as close to the explicit solver as solving exactly.
+"""
+import numpy as np
+import pytest
+pytest.importorskip('cymesh')
+pytest.importorskip('MultiNEAT')
+from coral_growth.modules.morphogens import Morphogens
+from coral_growth.parameters import Parameters
+
+class Params(object):
+    morphogen_solver = 0
+    morphogen_dt = 1.0
+    morphogen_cg_iterations = 100
+
+class Coral(object):
+    """ The parts of GrowthForm Morphogens reads, on a triangulated torus. """
+    def __init__(self, side):
+        index = lambda x, y: (x % side) * side + (y % side)
+        neighbors = [ [ index(x+1, y), index(x-1, y), index(x, y+1), index(x, y-1),
+                        index(x+1, y+1), index(x-1, y-1) ]
+                      for x in range(side) for y in range(side) ]
+        self.n_nodes = self.max_nodes = side * side
+        self.neighbor_offsets = np.arange(0, 6*self.n_nodes + 1, 6, dtype='int32')
+        self.neighbor_indices = np.array(neighbors, dtype='int32').ravel()
+        self.mesh = None
+        self.params = Params()
+
+def run(V0, solver=0, dt=1.0, cg_iterations=100):
+    coral = Coral(40)
+    traits = { 'F0': .035, 'K0': .06, 'diffU0': .016, 'diffV0': .008 }
+    morphogens = Morphogens(coral, traits, 1)
+    morphogens.solver = solver
+    morphogens.dt = dt
+    morphogens.cg_iterations = cg_iterations
+    np.asarray(morphogens.V)[:] = V0
+    for _ in range(3):
+        morphogens.update(200)
+    return np.asarray(morphogens.U).copy(), morphogens.n_iterations
+
+def same_bin(a, b, bins=3):
+    """ Fraction of nodes given the same network input, as thresholded with
+        Parameters.morphogen_thresholds.
+    """
+    return np.mean(np.minimum(bins-1, np.floor(a*bins)) == np.minimum(bins-1, np.floor(b*bins)))
+
+def test_capped_implicit_matches_explicit():
+    rng = np.random.RandomState(0)
+    V0 = np.zeros(1600)
+    V0[rng.choice(1600, 32, replace=False)] = 1
+    U_explicit, sweeps = run(V0)
+    assert sweeps == 200
+
+    params = Parameters()
+    U_capped, sweeps = run(V0, 1, params.morphogen_dt, params.morphogen_cg_iterations)
+    assert sweeps == np.ceil(200 / params.morphogen_dt)
+    assert np.isfinite(U_capped).all() and U_capped.min() >= 0
+    U_exact, _ = run(V0, 1, 4.0, 100) # The previous default, solved exactly.
+    assert same_bin(U_explicit, U_capped) >= same_bin(U_explicit, U_exact)
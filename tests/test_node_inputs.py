@@ -0,0 +1,114 @@
+""" Check that the array input kernels match the original per-node loop, so
+    networks of previously evolved genomes see the same inputs.
+"""
+from math import floor, atan, acos, cos, sin, pi
+import numpy as np
+from coral_growth.modules.node_inputs import create_node_inputs, calculate_gravity
+
+def reference_node_inputs(inputs, n_nodes, energy, gravity, curvature, attributes,
+                          morphogensU, morphogen_thresholds, signals, signal_thresholds,
+                          memory, n_memory, normals, use_polar_direction):
+    """ The per-node implementation GrowthForm.createNodeInputs used before. """
+    inputs[:, :] = -1
+    for i in range(n_nodes):
+        inputs[i, 0] = (energy[i] * 2) - 1
+        inputs[i, 1] = gravity[i]
+        inputs[i, 2] = curvature[i]
+        input_idx = 3
+
+        for j in range(attributes.shape[1]):
+            inputs[i, input_idx] = attributes[i, j]
+            input_idx += 1
+
+        for mi in range(morphogensU.shape[0]):
+            mbin = int(floor(morphogensU[mi, i] * morphogen_thresholds))
+            mbin = min(morphogen_thresholds - 1, mbin)
+            inputs[i, input_idx + (mbin)] = 1
+            input_idx += morphogen_thresholds
+
+        for mi in range(signals.shape[1]):
+            mbin = int(floor(signals[i, mi] * signal_thresholds))
+            mbin = min(signal_thresholds - 1, mbin)
+            inputs[i, input_idx + mbin] = 1
+            input_idx += signal_thresholds
+
+        for mi in range(n_memory):
+            inputs[i, input_idx] = -1.0 + memory[i, mi] * 2.0
+            input_idx += 1
+
+        if use_polar_direction:
+            azimuthal_angle = atan(normals[i, 1] / normals[i, 0])
+            polar_angle = acos(normals[i, 2])
+            inputs[i, input_idx] = cos(azimuthal_angle)
+            inputs[i, input_idx+1] = sin(azimuthal_angle)
+            inputs[i, input_idx+2] = cos(polar_angle)
+            inputs[i, input_idx+3] = sin(polar_angle)
+            input_idx += 4
+
+        inputs[i, input_idx] = 1
+        input_idx += 1
+        assert input_idx == inputs.shape[1]
+
+def random_state(n_nodes, max_nodes, n_attributes, n_morphogens, n_signals, n_memory):
+    rng = np.random.RandomState(0)
+    normals = rng.normal(size=(max_nodes, 3))
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    return dict(
+        energy=rng.uniform(0, 1, max_nodes),
+        gravity=rng.uniform(0, 1, max_nodes),
+        curvature=rng.uniform(-1, 1, max_nodes),
+        attributes=rng.uniform(0, 1, (max_nodes, n_attributes)),
+        morphogensU=rng.uniform(0, 1.2, (n_morphogens, max_nodes)),
+        signals=rng.randint(0, 2, (max_nodes, n_signals)).astype('float64'),
+        memory=rng.randint(0, 2, (max_nodes, n_memory)).astype('int32'),
+        normals=normals,
+    )
+
+def check_inputs(use_polar_direction, n_attributes):
+    n_nodes, max_nodes = 200, 250
+    n_morphogens, n_signals, n_memory = 2, 2, 2
+    morphogen_thresholds, signal_thresholds = 3, 3
+    n_inputs = 4 + n_attributes + n_morphogens * morphogen_thresholds + \
+               n_signals * signal_thresholds + n_memory + 4 * use_polar_direction
+    state = random_state(n_nodes, max_nodes, n_attributes, n_morphogens, n_signals, n_memory)
+
+    expected = np.zeros((max_nodes, n_inputs))
+    reference_node_inputs(expected, n_nodes, state['energy'], state['gravity'],
+                          state['curvature'], state['attributes'], state['morphogensU'],
+                          morphogen_thresholds, state['signals'], signal_thresholds,
+                          state['memory'], n_memory, state['normals'], use_polar_direction)
+
+    result = -np.ones((max_nodes, n_inputs))
+    create_node_inputs(result, n_nodes, state['energy'], state['gravity'],
+                       state['curvature'], state['attributes'], state['morphogensU'],
+                       morphogen_thresholds, state['signals'], signal_thresholds,
+                       state['memory'], n_memory, state['normals'], use_polar_direction)
+
+    assert np.array_equal(result, expected)
+
+def test_node_inputs_match_reference():
+    check_inputs(use_polar_direction=True, n_attributes=2)
+
+def test_node_inputs_match_reference_no_polar():
+    check_inputs(use_polar_direction=False, n_attributes=0)
+
+def reference_gravity(normal):
+    """ The vangle(down, normal) / pi of GrowthForm.calculateGravity before. """
+    down = np.array([0, -1.0, 0])
+    c = np.dot(down, normal) / (np.linalg.norm(down) * np.linalg.norm(normal))
+    return acos(max(-1.0, min(1.0, c))) / pi
+
+def test_gravity():
+    normals = np.array([[0, -1.0, 0], [0, 1.0, 0], [1.0, 0, 0], [0, 0, -1.0]])
+    gravity = np.zeros(4)
+    calculate_gravity(gravity, normals, 4)
+    assert np.allclose(gravity, [0, 1, .5, .5])
+
+def test_gravity_matches_reference():
+    rng = np.random.RandomState(0)
+    normals = rng.normal(size=(500, 3))
+    normals[::2] /= np.linalg.norm(normals[::2], axis=1)[:, None]
+    gravity = np.zeros(500)
+    calculate_gravity(gravity, normals, 500)
+    expected = [ reference_gravity(normal) for normal in normals ]
+    assert np.allclose(gravity, expected, rtol=0, atol=1e-12)
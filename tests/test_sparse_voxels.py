@@ -0,0 +1,57 @@
+""" Check that the sparse brick grid gives the same grid, flood fill and
+    collection as the dense flowx and flowx2 versions.
+"""
+import numpy as np
+from coral_growth.modules.flowx2 import flood_fill, calculate_collection
+from coral_growth.modules.sparse_voxels import SparseVoxelGrid, SparseFloodFill, \
+                                               calculate_collection_sparse, \
+                                               create_sparse_voxel_grid
+from tests.test_voxel_grid import reference_voxel_grid
+
+def random_grid(rng, shape):
+    """ Scattered voxels and a closed box, so there is water it encloses. """
+    grid = np.zeros(shape, dtype='uint8')
+    grid[tuple(rng.randint(0, shape, (20, 3)).T)] = 1
+    lo = rng.randint(1, 6, 3)
+    hi = lo + rng.randint(3, 10, 3)
+    grid[lo[0]:hi[0]+1, lo[1]:hi[1]+1, lo[2]:hi[2]+1] = 1
+    grid[lo[0]+1:hi[0], lo[1]+1:hi[1], lo[2]+1:hi[2]] = 0
+    return grid
+
+def to_sparse(grid):
+    sparse = SparseVoxelGrid(*grid.shape)
+    for x, y, z in np.argwhere(grid):
+        sparse.set(x, y, z, 1)
+    return sparse
+
+def test_flood_fill_matches_dense():
+    rng = np.random.RandomState(0)
+    for _ in range(10):
+        grid = random_grid(rng, rng.randint(20, 48, 3))
+        sparse = to_sparse(grid)
+        assert np.array_equal(sparse.dense(), grid)
+        assert sparse.n_bricks < sparse.table.shape[0]
+        assert np.array_equal(SparseFloodFill(sparse).dense(), np.asarray(flood_fill(grid)))
+
+def test_collection_matches_dense():
+    rng = np.random.RandomState(1)
+    for radius in (1, 3, 5):
+        grid = random_grid(rng, rng.randint(20, 48, 3))
+        voxels = np.argwhere(grid).astype('int32')
+        expected = np.zeros(voxels.shape[0])
+        calculate_collection(expected, voxels, grid, radius)
+        collection = np.zeros(voxels.shape[0])
+        calculate_collection_sparse(collection, voxels, to_sparse(grid), radius)
+        assert np.allclose(collection, expected, rtol=1e-6, atol=1e-9)
+        assert expected.max() > 0
+
+def test_create_matches_dense():
+    rng = np.random.RandomState(2)
+    n_nodes, n_faces = 200, 300
+    node_pos = rng.uniform(-3, 5, (n_nodes, 3))
+    faces = rng.randint(0, n_nodes, (n_faces, 3)).astype('int32')
+    node_voxels, grid, origin = create_sparse_voxel_grid(node_pos, n_nodes, faces, n_faces, 0.5)
+    expected = reference_voxel_grid(node_pos, faces, 0.5)
+    assert np.array_equal(node_voxels, expected[0])
+    assert np.array_equal(grid.dense(), expected[1])
+    assert np.array_equal(origin, expected[2])
@@ -0,0 +1,49 @@
+""" Check that the persistent VoxelGrid gives the same node voxels and grid
+    as building it from scratch with flowx.create_voxel_grid every step.
+"""
+import numpy as np
+from coral_growth.modules.voxel_grid import VoxelGrid
+
+def reference_voxel_grid(node_pos, faces, voxel_length):
+    """ flowx.create_voxel_grid on arrays instead of a form. """
+    node_voxel = np.floor(node_pos / voxel_length).astype('int32')
+    min_v = node_voxel.min(axis=0)
+    max_v = node_voxel.max(axis=0)
+    padding = np.array([8, 4, 8], dtype='int32')
+    offset = padding - 4
+    grid = np.zeros(padding + max_v - min_v + [2, 1, 2], dtype='uint8')
+    node_voxel += offset - min_v
+    grid[node_voxel[:, 0], node_voxel[:, 1], node_voxel[:, 2]] = 1
+    midpoints = (node_pos[faces[:, 0]] + node_pos[faces[:, 1]] + node_pos[faces[:, 2]]) / 3
+    face_voxel = np.floor(midpoints / voxel_length).astype('int32') - min_v + offset
+    grid[face_voxel[:, 0], face_voxel[:, 1], face_voxel[:, 2]] = 1
+    return node_voxel, grid, min_v - offset
+
+def test_dense_matches_create_voxel_grid():
+    rng = np.random.RandomState(0)
+    max_nodes, voxel_length = 400, 0.5
+    node_pos = np.zeros((max_nodes, 3))
+    faces = np.zeros((2*max_nodes, 3), dtype='int32')
+    n_nodes, n_faces = 100, 150
+    node_pos[:n_nodes] = rng.uniform(0, 5, (n_nodes, 3))
+    faces[:n_faces] = rng.randint(0, n_nodes, (n_faces, 3))
+    voxel_grid = VoxelGrid()
+
+    for step in range(30):
+        voxel_grid.update(node_pos, n_nodes, faces, n_faces, voxel_length)
+        node_voxels, grid, origin = voxel_grid.dense()
+        expected = reference_voxel_grid(node_pos[:n_nodes], faces[:n_faces], voxel_length)
+        assert np.array_equal(node_voxels, expected[0])
+        assert np.array_equal(grid, expected[1])
+        assert np.array_equal(origin, expected[2])
+
+        # Small moves mostly stay in the grid, growth sometimes leaves it.
+        node_pos[:n_nodes] += rng.normal(0, 0.2, (n_nodes, 3))
+        node_pos[:n_nodes, 1] = np.abs(node_pos[:n_nodes, 1])
+        new_nodes = rng.randint(0, 10)
+        node_pos[n_nodes:n_nodes+new_nodes] = node_pos[:new_nodes] * 1.1
+        n_nodes += new_nodes
+        faces[n_faces:n_faces+2*new_nodes] = rng.randint(0, n_nodes, (2*new_nodes, 3))
+        n_faces += 2*new_nodes
+
+    assert voxel_grid.n_rebuilds < 30
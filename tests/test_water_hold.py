@@ -0,0 +1,118 @@
+""" Check Cup's water retention: the height map flood against the
+    PriorityQueue version it replaced, and the voxel flood on a meshed cup
+    whose edges are much longer than a voxel.
+"""
+import os
+import queue
+from math import sqrt
+import numpy as np
+from coral_growth.modules.water_hold import water_voxels, fill_faces, trap_rain_water, \
+                                            water_hold
+from tests.test_voxel_grid import reference_voxel_grid
+
+def load_obj(path):
+    verts, faces = [], []
+    for line in open(path):
+        parts = line.split()
+        if parts and parts[0] == 'v':
+            verts.append([ float(x) for x in parts[1:4] ])
+        elif parts and parts[0] == 'f':
+            faces.append([ int(x.split('/')[0]) - 1 for x in parts[1:4] ])
+    return np.array(verts), np.array(faces, dtype='int32')
+
+class Cell:
+    def __init__(self, x, y, h):
+        self.x, self.y, self.h = x, y, h
+
+    def __lt__(self, other):
+        return self.h < other.h
+
+def reference_trap_rain_water(heights):
+    """ Solution.trapRainWater from the old water_hold.py. """
+    q = queue.PriorityQueue()
+    n = heights.shape[0]
+    m = heights.shape[1]
+    visit = [[False for i in range(m)] for i in range(n)]
+    for i in range(n):
+        q.put(Cell(i, 0, heights[i][0]))
+        q.put(Cell(i, m-1, heights[i][m-1]))
+        visit[i][0] = True
+        visit[i][m-1] = True
+    for i in range(m):
+        q.put(Cell(0, i, heights[0][i]))
+        q.put(Cell(n-1, i, heights[n-1][i]))
+        visit[0][i] = True
+        visit[n-1][i] = True
+
+    ans = 0
+    while not q.empty():
+        now = q.get()
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            nx = now.x + dx
+            ny = now.y + dy
+            if 0 <= nx and nx < n and 0 <= ny and ny < m and not visit[nx][ny]:
+                visit[nx][ny] = True
+                q.put(Cell(nx, ny, max(now.h, heights[nx][ny])))
+                ans += max(0, now.h - heights[nx][ny])
+    return ans
+
+def reference_water_hold(points, grid_size):
+    """ The old dict based height map, for points with x, z >= 0 where its
+        column indices were right.
+    """
+    columns = {}
+    for x, y, z in points:
+        key = (int(x / grid_size), int(z / grid_size))
+        columns[key] = max(columns.get(key, 0), y)
+    heights = np.zeros((max(k[0] for k in columns) + 1, max(k[1] for k in columns) + 1))
+    for (x, z), y in columns.items():
+        heights[x, z] = y
+    return reference_trap_rain_water(heights)
+
+def test_trap_rain_water_matches_priority_queue():
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        shape = rng.randint(1, 30, 2)
+        heights = rng.randint(0, 10, shape).astype('float64')
+        assert trap_rain_water(heights) == reference_trap_rain_water(heights)
+        heights = rng.uniform(0, 10, shape)
+        assert np.isclose(trap_rain_water(heights), reference_trap_rain_water(heights))
+
+    # A bowl, so the water is not only in small random pits.
+    x, z = np.meshgrid(np.linspace(-1, 1, 40), np.linspace(-1, 1, 40))
+    bowl = np.minimum(x*x + z*z, 0.8) + rng.uniform(0, 0.01, x.shape)
+    assert np.isclose(trap_rain_water(bowl), reference_trap_rain_water(bowl))
+    assert trap_rain_water(bowl) > 100
+
+def test_water_hold_matches_dict_height_map():
+    rng = np.random.RandomState(1)
+    for _ in range(20):
+        points = rng.uniform(0, 10, (500, 3))
+        assert np.isclose(water_hold(points, 0.7), reference_water_hold(points, 0.7))
+
+def hexagonal_frustum_volume(r0, r1, height):
+    return 3 * sqrt(3) / 2 * height * (r0*r0 + r0*r1 + r1*r1) / 3
+
+def test_cup_holds_water():
+    pos, faces = load_obj(os.path.join(os.path.dirname(__file__), 'cup.obj'))
+    # The inside of the cup widens from the bottom and narrows to the rim.
+    inside = hexagonal_frustum_volume(27.388542, 36.963924, 50.151825 - 5) + \
+             hexagonal_frustum_volume(36.963924, 32.766788, 71.960785 - 50.151825)
+
+    for voxel_length in (1.0, 2.0):
+        node_voxels, grid, origin = reference_voxel_grid(pos, faces, voxel_length)
+        grid = grid.astype('int32')
+        node_water = np.zeros(pos.shape[0])
+
+        # Nodes and face midpoints alone leave gaps the water drains through.
+        assert water_voxels(grid.copy(), node_voxels, node_water) == 0
+
+        fill_faces(grid, pos, faces, faces.shape[0], origin.astype('int32'), voxel_length)
+        water = water_voxels(grid, node_voxels, node_water) * voxel_length**3
+        assert 0.85 * inside < water < inside
+
+        # The 18 nodes on the inside wall, not the ones on the outside.
+        inner = [ i for i, p in enumerate(pos) if sqrt(p[0]**2 + p[2]**2) < \
+                  {5.0: 28, 50.151825: 37, 71.960785: 33}.get(round(p[1], 6), 0) ]
+        assert len(inner) == 18
+        assert node_water[inner].sum() >= 16